@@ -0,0 +1,171 @@
+"""
+asyncio front end for the endpoints that wait on the Fake Store API.
+
+    gunicorn "async_app:create_async_app()" --worker-class aiohttp.GunicornWebWorker
+
+Serves ``GET /products``, ``POST /cart/<id>/items`` and
+``POST /cart/<id>/items/batch`` from an aiohttp event loop. The products a
+request needs are fetched first with the asyncio client, all of them
+concurrently; the request then runs through the regular Flask views on a
+pool of ``ASYNC_APP_THREADS`` threads, which find those products in the
+WSGI environ. Validation, idempotency keys, sharding and the responses
+stay those of the Flask app, while threads are only held for database
+work: one process keeps up to ``UPSTREAM_ASYNC_MAX_IN_FLIGHT`` upstream
+calls in flight. Route these three endpoints here and the rest to the
+Flask app.
+"""
+
+import asyncio
+import io
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote
+
+import requests
+from aiohttp import web
+from marshmallow import ValidationError
+from multidict import CIMultiDict
+from werkzeug.wrappers import Response
+
+from app import create_app
+from resources.schemas import CartItemAddSchema, CartItemBatchSchema
+from services.catalog import PREFETCHED_LISTING, PREFETCHED_PRODUCTS, catalog
+from services.upstream_async import product_api_async
+
+FLASK_APP = web.AppKey("flask_app", object)
+EXECUTOR = web.AppKey("executor", ThreadPoolExecutor)
+# Response headers aiohttp writes itself.
+SERVER_HEADERS = {"content-length", "transfer-encoding", "connection", "date", "server"}
+
+
+def wsgi_environ(request, body):
+    """WSGI environ for an aiohttp ``request`` whose body has been read."""
+    host, _, port = request.host.partition(":")
+    environ = {
+        "REQUEST_METHOD": request.method,
+        "SCRIPT_NAME": "",
+        "PATH_INFO": unquote(request.raw_path.partition("?")[0], "latin-1"),
+        "QUERY_STRING": request.query_string,
+        "SERVER_NAME": host,
+        "SERVER_PORT": port or ("443" if request.secure else "80"),
+        "SERVER_PROTOCOL": f"HTTP/{request.version.major}.{request.version.minor}",
+        "REMOTE_ADDR": request.remote or "",
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": request.scheme,
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in request.headers.items():
+        key = name.upper().replace("-", "_")
+        if key == "CONTENT_TYPE":
+            environ[key] = value
+        elif key != "CONTENT_LENGTH":
+            key = f"HTTP_{key}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def call_flask(flask_app, environ):
+    response = Response.from_app(flask_app, environ, buffered=True)
+    return response.status_code, response.headers.to_wsgi_list(), response.get_data()
+
+
+async def dispatch(request, body, prefetched):
+    """Run the request through the Flask app with the ``prefetched`` environ keys."""
+    environ = wsgi_environ(request, body)
+    environ.update(prefetched)
+    status, headers, data = await asyncio.get_running_loop().run_in_executor(
+        request.app[EXECUTOR], call_flask, request.app[FLASK_APP], environ
+    )
+    return web.Response(
+        status=status,
+        body=data,
+        headers=CIMultiDict(
+            (name, value)
+            for name, value in headers
+            if name.lower() not in SERVER_HEADERS
+        ),
+    )
+
+
+async def prefetch(key, coroutine):
+    """``{key: result}``, or the upstream error for the view to report."""
+    try:
+        return {key: await coroutine}
+    except requests.RequestException as e:
+        return {key: e}
+
+
+def added_products(body, schema, items):
+    """
+    Ids of the products a valid cart item request adds; none for an invalid
+    one, which the view then rejects without asking the upstream.
+    """
+    try:
+        data = schema.load(json.loads(body))
+    except (ValueError, ValidationError):
+        return []
+    return [
+        item["product_id"]
+        for item in items(data)
+        if item.get("action", "add") != "remove"
+    ]
+
+
+async def list_products(request):
+    listing = await prefetch(
+        PREFETCHED_LISTING, catalog.get_all_async(product_api_async)
+    )
+    return await dispatch(request, b"", listing)
+
+
+async def add_items(request, schema, items):
+    body = await request.read()
+    product_ids = added_products(body, schema, items)
+    if not product_ids:
+        return await dispatch(request, body, {})
+    products = await prefetch(
+        PREFETCHED_PRODUCTS, catalog.get_many_async(product_ids, product_api_async)
+    )
+    return await dispatch(request, body, products)
+
+
+async def add_item(request):
+    return await add_items(request, CartItemAddSchema(), lambda data: [data])
+
+
+async def add_item_batch(request):
+    return await add_items(request, CartItemBatchSchema(), lambda data: data["items"])
+
+
+async def close_executor(app):
+    app[EXECUTOR].shutdown(wait=False)
+
+
+def create_async_app(flask_app=None):
+    """
+    aiohttp application in front of ``flask_app`` (default: ``create_app()``)
+    for the product endpoints and the cart item adds.
+    """
+    flask_app = flask_app or create_app()
+    product_api_async.init_app(flask_app)
+    app = web.Application()
+    app[FLASK_APP] = flask_app
+    app[EXECUTOR] = ThreadPoolExecutor(
+        flask_app.config["ASYNC_APP_THREADS"], thread_name_prefix="async-app"
+    )
+    app.cleanup_ctx.append(product_api_async.session_context)
+    app.on_cleanup.append(close_executor)
+    app.add_routes(
+        [
+            web.get("/products", list_products),
+            web.post(r"/cart/{cart_id:\d+}/items", add_item),
+            web.post(r"/cart/{cart_id:\d+}/items/batch", add_item_batch),
+        ]
+    )
+    return app
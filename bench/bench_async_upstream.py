@@ -0,0 +1,175 @@
+"""
+Load-test the Flask app against the asyncio front end under gunicorn.
+
+Starts the Fake Store stub with a fixed latency and, for each server,
+runs gunicorn with ``gunicorn.conf.py`` on a shared SQLite file: the Flask
+app on gthread workers, then ``async_app`` on aiohttp workers. Both get
+the same number of workers, ``--threads`` request threads (gthread) or
+database threads (``ASYNC_APP_THREADS``), and an upstream cap of
+``--cap`` connections per worker. The catalog cache is off, so every
+request goes upstream. ``--clients`` concurrent clients then list the
+products and add items singly and in batches.
+
+    python -m bench.bench_async_upstream
+    python -m bench.bench_async_upstream --workers 2 --threads 4 --cap 100 \\
+        --clients 60 --requests 300 --latency 0.2
+"""
+
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from sqlalchemy import create_engine
+
+from bench.fakestore_stub import FakeStoreStub
+from migrations import upgrade
+
+SERVERS = {
+    "sync": ["app:create_app()", "--worker-class", "gthread"],
+    "async": [
+        "async_app:create_async_app()",
+        "--worker-class",
+        "aiohttp.GunicornWebWorker",
+    ],
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(name, stub, db_url, args):
+    port = free_port()
+    env = dict(
+        os.environ,
+        DATABASE_URL=db_url,
+        PRODUCT_API_URL=stub.url,
+        CATALOG_TTL="0",
+        CATALOG_STALE_TTL="0",
+        JOB_WORKERS="0",
+        WEB_CONCURRENCY=str(args.workers),
+        GUNICORN_THREADS=str(args.threads),
+        ASYNC_APP_THREADS=str(args.threads),
+        UPSTREAM_POOL_SIZE=str(args.cap),
+        UPSTREAM_ASYNC_MAX_IN_FLIGHT=str(args.cap),
+        UPSTREAM_POOL_TIMEOUT="30",
+        UPSTREAM_READ_TIMEOUT="30",
+        GUNICORN_ACCESS_LOG="/dev/null",
+        GUNICORN_LOG_LEVEL="warning",
+    )
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py"]
+        + ["--bind", f"127.0.0.1:{port}", *SERVERS[name]],
+        env=env,
+    )
+    base = f"http://127.0.0.1:{port}"
+    for _ in range(200):
+        try:
+            requests.get(f"{base}/products?limit=1", timeout=5)
+            return process, base
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError(f"{name} server did not start")
+
+
+def measure(name, flow, call, args):
+    started = time.perf_counter()
+    with ThreadPoolExecutor(args.clients) as pool:
+        latencies = sorted(pool.map(call, range(args.requests)))
+    elapsed = time.perf_counter() - started
+    return {
+        "server": name,
+        "flow": flow,
+        "rps": round(args.requests / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 1),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 1),
+    }
+
+
+def run_server(name, stub, db_url, carts, args):
+    process, base = start_server(name, stub, db_url, args)
+
+    def timed(method, path, expected, **kwargs):
+        started = time.perf_counter()
+        response = requests.request(method, f"{base}{path}", **kwargs)
+        assert response.status_code == expected, response.text
+        return time.perf_counter() - started
+
+    def listing(i):
+        return timed("GET", "/products", 200)
+
+    def single(i):
+        cart_id = carts[i % len(carts)]
+        return timed(
+            "POST", f"/cart/{cart_id}/items", 201, json={"product_id": 1 + i % 20}
+        )
+
+    def batch(i):
+        cart_id = carts[i % len(carts)]
+        items = [{"product_id": 1 + (i + k) % 20} for k in range(args.batch_size)]
+        return timed("POST", f"/cart/{cart_id}/items/batch", 200, json={"items": items})
+
+    try:
+        return [
+            measure(name, flow, call, args)
+            for flow, call in (
+                ("list", listing),
+                ("single add", single),
+                ("batch add", batch),
+            )
+        ]
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--cap", type=int, default=100)
+    parser.add_argument("--clients", type=int, default=40)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.2)
+    args = parser.parse_args()
+
+    stub = FakeStoreStub(latency=args.latency).start()
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        db_url = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        upgrade(create_engine(db_url))
+        os.environ.update(JOB_WORKERS="0", DATABASE_URL=db_url)
+        from app import create_app
+
+        client = create_app(db_url).test_client()
+        carts = [
+            client.post("/cart", json={"user_id": u, "status": "active"}).json["id"]
+            for u in range(1, args.clients + 1)
+        ]
+        for name in SERVERS:
+            results += run_server(name, stub, db_url, carts, args)
+
+    print(
+        f"{args.workers} workers x {args.threads} threads, cap {args.cap},"
+        f" {args.clients} clients, {args.latency}s upstream latency"
+    )
+    print(f"{'server':<8}{'flow':<12}{'req/s':>8}{'p50 ms':>9}{'p95 ms':>9}")
+    for r in results:
+        print(
+            f"{r['server']:<8}{r['flow']:<12}{r['rps']:>8}{r['p50_ms']:>9}{r['p95_ms']:>9}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Compare adding N products with N ``POST /cart/<id>/items`` calls against one
+``POST /cart/<id>/items/batch`` call.
+
+Runs in-process against a throwaway SQLite database; Fake Store is replaced
+by an in-memory catalog with a simulated round-trip latency.
+
+    python -m bench.bench_cart_batch --items 50 --latency 0.05
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from sqlalchemy import event
+
+from app import create_app
+from db import db
+from services.catalog import catalog
+
+
+def fake_products(count):
+    return [
+        {
+            "id": i,
+            "title": f"Product {i}",
+            "price": round(1.5 * i, 2),
+            "description": "",
+            "category": "bench",
+        }
+        for i in range(1, count + 1)
+    ]
+
+
+def install_fake_upstream(products, latency, calls):
+    by_id = {p["id"]: p for p in products}
+
+    def product_loader(product_id):
+        calls["upstream"] += 1
+        time.sleep(latency)
+        return by_id.get(product_id)
+
+    def listing_loader():
+        calls["upstream"] += 1
+        time.sleep(latency)
+        return list(products)
+
+    catalog.product_loader = product_loader
+    catalog.listing_loader = listing_loader
+
+
+def run(client, cart_id, product_ids, batch, calls):
+    catalog.clear()
+    calls.update(upstream=0, statements=0)
+    started = time.perf_counter()
+    if batch:
+        response = client.post(
+            f"/cart/{cart_id}/items/batch",
+            json={"items": [{"product_id": pid, "quantity": 2} for pid in product_ids]},
+        )
+        assert response.status_code == 200, response.json
+    else:
+        for pid in product_ids:
+            response = client.post(
+                f"/cart/{cart_id}/items", json={"product_id": pid, "quantity": 2}
+            )
+            assert response.status_code == 201, response.json
+    elapsed = time.perf_counter() - started
+    return {
+        "mode": "batch" if batch else "single",
+        "seconds": round(elapsed, 4),
+        "statements": calls["statements"],
+        "upstream_calls": calls["upstream"],
+        "total_price": client.get(f"/cart/{cart_id}").json["total_price"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--items", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    products = fake_products(args.items)
+    calls = {"upstream": 0, "statements": 0}
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        install_fake_upstream(products, args.latency, calls)
+        with app.app_context():
+            db.create_all()
+            event.listen(
+                db.engine,
+                "before_cursor_execute",
+                lambda *_: calls.update(statements=calls["statements"] + 1),
+            )
+            client = app.test_client()
+            results = []
+            for user_id, batch in ((1, False), (2, True)):
+                cart_id = client.post(
+                    "/cart", json={"user_id": user_id, "status": "active"}
+                ).json["id"]
+                results.append(
+                    run(client, cart_id, [p["id"] for p in products], batch, calls)
+                )
+
+    print(f"{'mode':<8}{'seconds':>10}{'statements':>12}{'upstream':>10}{'total':>12}")
+    for r in results:
+        print(
+            f"{r['mode']:<8}{r['seconds']:>10}{r['statements']:>12}"
+            f"{r['upstream_calls']:>10}{r['total_price']:>12}"
+        )
+    single, batch = results
+    print(f"speedup: {single['seconds'] / batch['seconds']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Compare marshmallow and the hand-written dump functions for listings.
+
+Seeds a throwaway SQLite database with orders whose carts hold a few
+items, loads them the way the listing endpoints do and serializes them
+both ways: ``OrderSchema``/``CartSchema`` plus Flask's JSON provider
+(what flask-smorest does) against ``resources.serializers`` plus orjson.
+The outputs must be identical; the script exits 1 when they are not.
+
+    python -m bench.bench_serialization --orders 2000 --items 5
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import orjson
+
+from app import create_app
+from db import db
+from models import CartItemModel, CartModel, OrderModel, UserModel
+from resources.orders import ORDER_LOADERS
+from resources.carts import CART_LOADERS
+from resources.schemas import CartSchema, OrderSchema
+from resources.serializers import dump_cart, dump_many, dump_order, encode
+
+
+def seed(orders, items):
+    for i in range(1, orders + 1):
+        cart = CartModel(id=i, user_id=1 + i % 50, status="completed")
+        cart.items = [
+            CartItemModel(
+                product_id=k,
+                product_name=f"Product {k} é",
+                product_price=round(4.99 + k * 3.1, 2),
+                quantity=1 + (i + k) % 3,
+            )
+            for k in range(1, items + 1)
+        ]
+        db.session.add(cart)
+        db.session.add(
+            OrderModel(
+                user_id=cart.user_id,
+                cart_id=i,
+                total_price=sum(it.product_price * it.quantity for it in cart.items),
+                shipping_address=f"{i} Main Street",
+            )
+        )
+    db.session.add_all([UserModel(id=u) for u in range(1, 51)])
+    db.session.commit()
+
+
+def best_of(repeat, fn):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings), result
+
+
+def compare(name, rows, schema, dump, repeat, provider):
+    before, slow = best_of(repeat, lambda: provider.dumps(schema.dump(rows)))
+    after, fast = best_of(repeat, lambda: encode(dump_many(dump, rows)))
+    identical = schema.dump(rows) == dump_many(dump, rows) and orjson.loads(
+        fast
+    ) == orjson.loads(slow)
+    print(
+        f"{name:<8}{len(rows):>7}{len(rows) / before:>14,.0f}"
+        f"{len(rows) / after:>14,.0f}{before / after:>9.1f}x"
+        f"  {'identical' if identical else 'MISMATCH'}"
+    )
+    return identical
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--orders", type=int, default=2000)
+    parser.add_argument("--items", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app(f"sqlite:///{os.path.join(tmp, 'serialize.db')}")
+        with app.app_context():
+            db.create_all()
+            seed(args.orders, args.items)
+            db.session.expunge_all()
+            orders = OrderModel.query.options(*ORDER_LOADERS).all()
+            carts = CartModel.query.options(*CART_LOADERS).all()
+
+            print(
+                f"{'rows':<8}{'count':>7}{'schema rows/s':>14}"
+                f"{'fast rows/s':>14}{'speedup':>10}"
+            )
+            ok = compare(
+                "orders",
+                orders,
+                OrderSchema(many=True),
+                dump_order,
+                args.repeat,
+                app.json,
+            )
+            ok &= compare(
+                "carts", carts, CartSchema(many=True), dump_cart, args.repeat, app.json
+            )
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Check read-replica routing end to end on two local SQLite databases.
+
+The "replica" is a second database that never receives the primary's
+writes, so every read shows where it ran: rows written through the API
+only exist on the primary, and a marker cart seeded only on the replica
+is only visible there. Checks that writes go to the primary, that reads
+go to the replica, that reads of a user or cart written within
+``DB_READ_YOUR_WRITES`` stay on the primary, and that they return to the
+replica once the window has passed. Exits 1 on the first failure.
+
+    python -m bench.check_read_routing
+    python -m bench.check_read_routing --window 0.5
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine, text
+
+from app import create_app
+from bench.bench_cart_batch import fake_products, install_fake_upstream
+from migrations import upgrade
+from services.replicas import replicas
+
+REPLICA_USER = 900
+WRITER_USER = 901
+
+
+def check(ok, message):
+    print(f"{'ok' if ok else 'FAIL':<6}{message}")
+    if not ok:
+        sys.exit(1)
+
+
+def count(engine, sql, **params):
+    with engine.connect() as connection:
+        return connection.execute(text(sql), params).scalar()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--window", type=float, default=1.0, help="DB_READ_YOUR_WRITES seconds"
+    )
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    primary_url, replica_url = (f"sqlite:///{tmp}/{name}.db" for name in "pr")
+    primary, replica = create_engine(primary_url), create_engine(replica_url)
+    for engine in (primary, replica):
+        upgrade(engine)
+    with replica.begin() as connection:
+        connection.execute(text(f"INSERT INTO users (id) VALUES ({REPLICA_USER})"))
+        connection.execute(
+            text(
+                "INSERT INTO carts (id, user_id, status, total_price)"
+                f" VALUES ({REPLICA_USER}, {REPLICA_USER}, 'active', 0)"
+            )
+        )
+
+    os.environ["DB_READ_YOUR_WRITES"] = str(args.window)
+    os.environ.setdefault("JOB_WORKERS", "0")
+    app = create_app(primary_url, replica_urls=[replica_url], shard_urls=[])
+    install_fake_upstream(fake_products(20), 0, {"upstream": 0})
+    client = app.test_client()
+
+    carts = client.get(f"/user/{REPLICA_USER}/carts").json
+    check(len(carts) == 1, "reads of a user without writes go to the replica")
+
+    cart_id = client.post(
+        "/cart", json={"user_id": WRITER_USER, "status": "active"}
+    ).json["id"]
+    client.post(f"/cart/{cart_id}/items", json={"product_id": 3})
+    on_primary = count(primary, "SELECT COUNT(*) FROM cart_items")
+    on_replica = count(
+        replica, "SELECT COUNT(*) FROM carts WHERE user_id = :u", u=WRITER_USER
+    )
+    check(on_primary == 1 and on_replica == 0, "writes go to the primary")
+
+    carts = client.get(f"/user/{WRITER_USER}/carts").json
+    check(
+        [cart["id"] for cart in carts] == [cart_id],
+        "reads of the written user stay on the primary inside the window",
+    )
+    changes = client.get(f"/cart/{cart_id}/changes?since=0")
+    check(
+        changes.status_code == 200 and changes.json["version"] == 1,
+        "reads of the written cart stay on the primary inside the window",
+    )
+
+    time.sleep(args.window)
+    order = client.post(
+        "/order",
+        json={"user_id": WRITER_USER, "cart_id": cart_id, "shipping_address": "x"},
+    )
+    check(order.status_code == 201, "checkout by cart id succeeds")
+    carts = client.get(f"/user/{WRITER_USER}/carts").json
+    check(
+        [cart["status"] for cart in carts] == ["ordered"],
+        "a write routed by cart id keeps its user's reads on the primary",
+    )
+
+    time.sleep(args.window)
+    client.put(f"/order/{order.json['id']}", json={"status": "canceled"})
+    changes = client.get(f"/cart/{cart_id}/changes?since=0")
+    check(
+        changes.status_code == 200,
+        "a write routed by order id keeps its cart's reads on the primary",
+    )
+
+    time.sleep(args.window)
+    carts = client.get(f"/user/{WRITER_USER}/carts").json
+    check(carts == [], "reads return to the replica after the window")
+    changes = client.get(f"/cart/{cart_id}/changes?since=0")
+    check(changes.status_code == 404, "cart reads return to the replica as well")
+    print(replicas.stats())
+
+
+if __name__ == "__main__":
+    main()
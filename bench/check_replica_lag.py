@@ -0,0 +1,99 @@
+"""
+Measure how far the read replicas trail the primary and check the lag
+against ``DB_READ_YOUR_WRITES``.
+
+Each sample writes a WAL record on the primary and times how long every
+replica takes to replay up to it. Reads of a user's data stay on the
+primary for ``DB_READ_YOUR_WRITES`` seconds after a write, so the window
+has to cover the worst lag seen; the script exits 1 when it does not.
+PostgreSQL streaming replicas only.
+
+    python -m bench.check_replica_lag
+    python -m bench.check_replica_lag --primary postgresql://.../shopping_db \\
+        --replicas postgresql://.../replica1,postgresql://.../replica2 \\
+        --samples 50 --window 1.5
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+from sqlalchemy import create_engine, text
+
+EMIT = text("SELECT pg_logical_emit_message(false, 'replica-lag', '')")
+CAUGHT_UP = text("SELECT pg_last_wal_replay_lsn() >= CAST(:lsn AS pg_lsn)")
+
+
+def measure(replica, lsn, started, timeout):
+    """
+    Seconds from ``started`` (when ``lsn`` was written) until ``replica``
+    has replayed it, or None on timeout.
+    """
+    while time.perf_counter() - started < timeout:
+        if replica.execute(CAUGHT_UP, {"lsn": lsn}).scalar():
+            return time.perf_counter() - started
+        time.sleep(0.001)
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--primary", default=os.getenv("DATABASE_URL"))
+    parser.add_argument(
+        "--replicas",
+        default=os.getenv("DATABASE_REPLICA_URLS", ""),
+        help="comma separated replica URLs",
+    )
+    parser.add_argument("--samples", type=int, default=20)
+    parser.add_argument("--interval", type=float, default=0.1)
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument(
+        "--window",
+        type=float,
+        default=float(os.getenv("DB_READ_YOUR_WRITES", 0)),
+        help="DB_READ_YOUR_WRITES seconds to check the lag against",
+    )
+    args = parser.parse_args()
+    urls = [url for url in args.replicas.split(",") if url]
+    if not args.primary or not urls:
+        parser.error("needs --primary and --replicas (or the environment)")
+
+    with create_engine(args.primary, isolation_level="AUTOCOMMIT").connect() as primary:
+        replicas = {
+            url.rsplit("@", 1)[-1]: create_engine(
+                url, isolation_level="AUTOCOMMIT"
+            ).connect()
+            for url in urls
+        }
+        lags = {name: [] for name in replicas}
+        for _ in range(args.samples):
+            lsn = primary.execute(EMIT).scalar()
+            started = time.perf_counter()
+            for name, replica in replicas.items():
+                lags[name].append(measure(replica, lsn, started, args.timeout))
+            time.sleep(args.interval)
+        for replica in replicas.values():
+            replica.close()
+
+    failed = False
+    print(f"{'replica':<40}{'p50 ms':>9}{'p95 ms':>9}{'max ms':>9}{'timeouts':>10}")
+    for name, samples in lags.items():
+        seen = sorted(lag for lag in samples if lag is not None)
+        timeouts = len(samples) - len(seen)
+        worst = seen[-1] if seen else 0.0
+        p95 = seen[max(0, -(-len(seen) * 95 // 100) - 1)] if seen else 0.0
+        print(
+            f"{name:<40}{(statistics.median(seen) if seen else 0) * 1000:>9.1f}"
+            f"{p95 * 1000:>9.1f}{worst * 1000:>9.1f}{timeouts:>10}"
+        )
+        if timeouts or (args.window and worst > args.window):
+            failed = True
+    if args.window:
+        print(f"DB_READ_YOUR_WRITES={args.window}s {'too short' if failed else 'ok'}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
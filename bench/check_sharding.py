@@ -0,0 +1,177 @@
+"""
+Check cart/order sharding end to end on several local databases.
+
+Starts with one database and no shards, where carts and orders get plain
+sequential ids, and places orders and leaves active carts for the legacy
+users through the API. Then adds a second shard with ``flask
+rebalance-shards``, places orders for many more users with bucket-encoded
+ids and adds a third shard. After every step it checks that every cart and
+order is reachable by the id it was created with, that the users' rows
+live on the shard the ring assigns, that ``GET /order`` merges all shards
+in order and that legacy users still get their active cart back from
+``POST /cart`` and in their cart listing.
+
+    python -m bench.check_sharding
+    python -m bench.check_sharding --urls postgresql://.../s0,postgresql://.../s1,postgresql://.../s2
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+from app import create_app
+from bench.bench_cart_batch import fake_products, install_fake_upstream
+from migrations import upgrade
+from services.replicas import replicas
+from models import CartModel
+from services.sharding import shards
+
+
+def make_app(urls):
+    app = create_app(urls[0], replica_urls=[], shard_urls=urls[1:])
+    install_fake_upstream(fake_products(20), 0, {"upstream": 0})
+    return app
+
+
+def seed_legacy(client, users, first_user):
+    """
+    Place an order and leave an active cart for ``users`` users through the
+    API of an unsharded app. Returns
+    ``{user_id: (cart_id, order_id, active_cart_id)}``.
+    """
+    legacy = {}
+    for user_id, (cart_id, order_id) in place_orders(client, users, first_user).items():
+        active = client.post("/cart", json={"user_id": user_id, "status": "active"})
+        assert active.status_code == 201, active.json
+        legacy[user_id] = (cart_id, order_id, active.json["id"])
+    return legacy
+
+
+def place_orders(client, users, first_user=1):
+    created = {}
+    for user_id in range(first_user, first_user + users):
+        cart = client.post("/cart", json={"user_id": user_id, "status": "active"})
+        cart_id = cart.json["id"]
+        client.post(f"/cart/{cart_id}/items", json={"product_id": user_id % 20 + 1})
+        order = client.post(
+            "/order",
+            json={"user_id": user_id, "cart_id": cart_id, "shipping_address": "x"},
+        )
+        assert order.status_code == 201, order.json
+        created[user_id] = (cart_id, order.json["id"])
+    return created
+
+
+def check(app, created):
+    client = app.test_client()
+    for user_id, (cart_id, order_id) in created.items():
+        cart = client.get(f"/cart/{cart_id}")
+        assert cart.status_code == 200 and cart.json["user_id"] == user_id
+        order = client.get(f"/order/{order_id}")
+        assert order.status_code == 200 and order.json["cart_id"] == cart_id
+        assert [o["id"] for o in client.get(f"/user/{user_id}/orders").json] == [
+            order_id
+        ]
+
+    listed = []
+    cursor = None
+    while True:
+        query = "/order?limit=25" + (f"&cursor={cursor}" if cursor else "")
+        page = client.get(query)
+        listed += page.json
+        cursor = page.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    keys = [(o["created_at"], o["id"]) for o in listed]
+    assert keys == sorted(keys), "GET /order is not merged in order"
+    assert {o["id"] for o in listed} == {o for _, o in created.values()}
+    streamed = [
+        json.loads(line)
+        for line in client.get("/order?format=ndjson").data.splitlines()
+    ]
+    assert len(streamed) == len(created)
+    # Item ids repeat across shards; every order must carry its own items.
+    for order in listed + streamed:
+        expected = [order["user_id"] % 20 + 1]
+        assert [i["product_id"] for i in order["items"]] == expected, order["id"]
+        assert [i["product_id"] for i in order["cart"]["items"]] == expected, order[
+            "id"
+        ]
+    daily = client.get("/analytics/daily").json
+    assert sum(row["order_count"] for row in daily) == len(created)
+
+    counts = {}
+    with app.app_context():
+        for name in shards.each():
+            user_ids = {cart.user_id for cart in CartModel.query.all()}
+            assert all(shards.for_user(u) == name for u in user_ids), name
+            counts[name] = len(user_ids)
+    return counts
+
+
+def check_legacy(app, legacy):
+    client = app.test_client()
+    for user_id, (_, _, active_id) in legacy.items():
+        cart = client.post("/cart", json={"user_id": user_id, "status": "active"})
+        assert cart.status_code == 201 and cart.json["id"] == active_id, user_id
+        listed = {c["id"] for c in client.get(f"/user/{user_id}/carts").json}
+        assert active_id in listed, user_id
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--legacy-users", type=int, default=100)
+    parser.add_argument("--urls", help="Three comma separated database URLs.")
+    args = parser.parse_args()
+
+    # Run finalize_order inline so every statement hits the shards in turn.
+    os.environ["JOB_WORKERS"] = "0"
+    tmp = tempfile.mkdtemp()
+    urls = (
+        args.urls.split(",")
+        if args.urls
+        else [f"sqlite:///{os.path.join(tmp, f'shard{i}.db')}" for i in range(3)]
+    )
+
+    # Legacy rows on one database, then a shard added, more API traffic and
+    # a third shard.
+    app = make_app(urls[:1])
+    with app.app_context():
+        upgrade(shards.engine(shards.names[0]))
+    legacy = seed_legacy(app.test_client(), args.legacy_users, 10001)
+    assert max(cart_id for _, _, cart_id in legacy.values()) < 2 * args.legacy_users + 1
+    created = {
+        user_id: (cart_id, order_id)
+        for user_id, (cart_id, order_id, _) in legacy.items()
+    }
+    print("1 shard, users per shard:", check(app, created))
+
+    for count in (2, 3):
+        result = app.test_cli_runner().invoke(
+            args=["rebalance-shards", urls[count - 1]]
+        )
+        print(result.output.strip())
+        if result.exception:
+            raise result.exception
+        app = make_app(urls[:count])
+        print(f"{count} shards, users per shard:", check(app, created))
+        check_legacy(app, legacy)
+        if count == 2:
+            created.update(place_orders(app.test_client(), args.users))
+            print("2 shards, new users:", check(app, created))
+    print(f"{len(legacy)} legacy users kept their carts, orders and ids")
+
+    # Replicas only mirror the primary; with shards they must stay unused.
+    app = create_app(urls[0], replica_urls=[urls[0]], shard_urls=urls[1:])
+    assert replicas.stats()["disabled"] == "sharded"
+    health = app.test_client().get("/health").json
+    assert health["db_replicas"]["replicas"] == 0, health
+    print("replicas disabled with shards")
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
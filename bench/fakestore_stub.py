@@ -0,0 +1,98 @@
+"""
+Local stand-in for the Fake Store API with a configurable response latency.
+
+    python -m bench.fakestore_stub --port 8099 --latency 0.1 --products 200
+
+Serves ``GET /products`` and ``GET /products/<id>`` like the real API
+(an empty 200 body for unknown ids).
+"""
+
+import argparse
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CATEGORIES = ["men's clothing", "women's clothing", "jewelery", "electronics"]
+
+
+def make_products(count):
+    return [
+        {
+            "id": i,
+            "title": f"Product {i}",
+            "price": round(4.99 + (i * 7.31) % 500, 2),
+            "description": f"Description of product {i}",
+            "category": CATEGORIES[i % len(CATEGORIES)],
+            "image": f"https://fakestoreapi.com/img/{i}.jpg",
+            "rating": {"rate": round(1 + (i % 40) / 10, 1), "count": i * 3},
+        }
+        for i in range(1, count + 1)
+    ]
+
+
+class FakeStoreStub(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, port=0, latency=0.0, products=20):
+        self.latency = latency
+        self.products = make_products(products)
+        self.by_id = {p["id"]: p for p in self.products}
+        self.requests = 0
+        super().__init__(("127.0.0.1", port), _Handler)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Send headers and body in one segment so keep-alive reuse is not
+    # slowed down by Nagle / delayed-ACK interplay.
+    wbufsize = 65536
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        server.requests += 1
+        time.sleep(server.latency)
+        match = re.fullmatch(r"/products(?:/(\d+))?", self.path)
+        if not match:
+            self._reply(404, b"")
+        elif match.group(1) is None:
+            self._reply(200, json.dumps(server.products).encode())
+        else:
+            product = server.by_id.get(int(match.group(1)))
+            self._reply(200, json.dumps(product).encode() if product else b"")
+
+    def _reply(self, status, body):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency", type=float, default=0.1)
+    parser.add_argument("--products", type=int, default=20)
+    args = parser.parse_args()
+    stub = FakeStoreStub(args.port, args.latency, args.products)
+    print(f"Fake Store stub on {stub.url} ({args.latency}s latency)")
+    stub.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+Count SQL statements per endpoint and fail when a count exceeds its budget.
+
+Seeds a throwaway SQLite database with enough carts and orders that an
+N+1 pattern shows up as a large count, replays a fixed list of requests
+and compares each statement count with ``bench/query_budget.json``.
+
+    python -m bench.query_budget            # check, exit 1 on regression
+    python -m bench.query_budget --update   # rewrite the budget file
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import tempfile
+
+from app import create_app
+from bench.bench_cart_batch import fake_products, install_fake_upstream
+from db import db
+from models import CartItemModel, CartModel, OrderModel, UserModel
+
+QUERIES = re.compile(r'desc="(\d+) queries"')
+BUDGET_FILE = os.path.join(os.path.dirname(__file__), "query_budget.json")
+
+USERS = 20
+ITEMS_PER_CART = 3
+
+REQUESTS = [
+    ("GET /order", "get", "/order", None),
+    ("GET /order/<id>", "get", "/order/1", None),
+    ("GET /user/<id>/orders", "get", "/user/1/orders", None),
+    ("GET /user/<id>/carts", "get", "/user/1/carts", None),
+    ("GET /cart/<id>", "get", f"/cart/{USERS + 1}", None),
+    ("POST /cart", "post", "/cart", {"user_id": USERS + 2, "status": "active"}),
+    ("POST /cart/<id>/items", "post", f"/cart/{USERS + 1}/items", {"product_id": 9}),
+    (
+        "POST /cart/<id>/items/batch",
+        "post",
+        f"/cart/{USERS + 1}/items/batch",
+        {"items": [{"product_id": pid} for pid in range(10, 16)]},
+    ),
+    (
+        "PATCH /cart/<id>/items/<pid>",
+        "patch",
+        f"/cart/{USERS + 1}/items/9",
+        {"quantity": 3},
+    ),
+    ("DELETE /cart/<id>/items/<pid>", "delete", f"/cart/{USERS + 1}/items/9", None),
+    (
+        "GET /cart/<id>/changes",
+        "get",
+        f"/cart/{USERS + 1}/changes?since=0",
+        None,
+    ),
+    ("PUT /order/<id>", "put", "/order/2", {"status": "canceled"}),
+    ("DELETE /order/<id>", "delete", "/order/2", None),
+    (
+        "POST /order",
+        "post",
+        "/order",
+        {"user_id": 1, "cart_id": USERS + 1, "shipping_address": "x"},
+    ),
+    ("PUT /cart/<id>", "put", f"/cart/{USERS + 3}", {"status": "completed"}),
+    ("DELETE /cart/<id>", "delete", f"/cart/{USERS + 3}", None),
+]
+
+
+def seed():
+    products = fake_products(ITEMS_PER_CART)
+    for user_id in range(1, USERS + 1):
+        cart = CartModel(id=user_id, user_id=user_id, status="completed")
+        cart.items = [
+            CartItemModel(
+                product_id=p["id"],
+                product_name=p["title"],
+                product_price=p["price"],
+                quantity=1,
+            )
+            for p in products
+        ]
+        db.session.add_all([UserModel(id=user_id), cart])
+        db.session.add(
+            OrderModel(
+                id=user_id,
+                user_id=user_id,
+                cart_id=user_id,
+                total_price=sum(p["price"] for p in products),
+            )
+        )
+    # An active cart for user 1 and a second user with one item to check out.
+    db.session.add(CartModel(id=USERS + 1, user_id=1))
+    db.session.add(UserModel(id=USERS + 3))
+    cart = CartModel(id=USERS + 3, user_id=USERS + 3)
+    cart.items = [
+        CartItemModel(product_id=1, product_name="p", product_price=1, quantity=1)
+    ]
+    db.session.add(cart)
+    db.session.commit()
+
+
+def measure():
+    counts = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app(f"sqlite:///{os.path.join(tmp, 'budget.db')}")
+        install_fake_upstream(fake_products(20), 0, {"upstream": 0})
+        with app.app_context():
+            db.create_all()
+            seed()
+            db.session.remove()
+            client = app.test_client()
+            client.get("/products")
+            for name, method, path, body in REQUESTS:
+                response = getattr(client, method)(path, json=body)
+                assert response.status_code < 400, (name, response.json)
+                # Counted per request by the instrumentation, so statements
+                # of background jobs do not land on the endpoint.
+                timing = QUERIES.search(response.headers["Server-Timing"])
+                counts[name] = int(timing.group(1))
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--update", action="store_true")
+    args = parser.parse_args()
+
+    counts = measure()
+    if args.update or not os.path.exists(BUDGET_FILE):
+        with open(BUDGET_FILE, "w") as f:
+            json.dump(counts, f, indent=2)
+            f.write("\n")
+
+    with open(BUDGET_FILE) as f:
+        budget = json.load(f)
+
+    failed = False
+    for name, count in counts.items():
+        allowed = budget.get(name)
+        over = allowed is not None and count > allowed
+        failed |= over
+        flag = "  OVER BUDGET" if over else ""
+        print(f"{name:<32}{count:>5} / {allowed}{flag}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,39 @@
+from flask import g, has_app_context
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+from sqlalchemy.sql.elements import TextClause
 
-db = SQLAlchemy()
+
+def _is_write(clause):
+    if isinstance(clause, TextClause):
+        return not clause.text.lstrip().upper().startswith("SELECT")
+    return getattr(clause, "is_dml", False)
+
+
+class RoutingSession(Session):
+    """
+    Session that sends statements to the shard chosen for the context
+    (``services.sharding``) and those of read-only requests to a replica.
+
+    ``services.replicas.read_only`` stores the bind key of the replica chosen
+    for the request in ``g._db_read_bind``. Statements go there until the
+    session flushes or runs a write, after which the rest of the request
+    stays on the primary.
+    A shard set for the context wins; replicas are disabled when sharding
+    is configured, so that never drops a replica read.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_app_context():
+            shard = g.get("_db_shard_engine")
+            if shard is not None:
+                return shard
+        read_bind = g.get("_db_read_bind") if has_app_context() else None
+        if bind is None and read_bind is not None:
+            if not self._flushing and not _is_write(clause):
+                return self._db.engines[read_bind]
+            g._db_read_bind = None
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+db = SQLAlchemy(session_options={"class_": RoutingSession})
@@ -0,0 +1,50 @@
+"""
+Gunicorn settings for production serving.
+
+    gunicorn -c gunicorn.conf.py
+
+Every setting can be tuned through the environment. The app is preloaded
+in the master so workers fork with the code already imported; schema
+migrations are not part of startup and must run first (``flask migrate``).
+"""
+
+import multiprocessing
+import os
+
+wsgi_app = "app:create_app()"
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5000")
+
+# gthread by default; "gevent" needs the gevent package installed. The
+# asyncio front end (async_app) runs on "aiohttp.GunicornWebWorker".
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.getenv("GUNICORN_THREADS", 4))
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", 1000))
+
+# gevent has to monkey-patch before the app is imported, so it cannot preload.
+preload_app = worker_class != "gevent"
+
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 30))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", 20))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", 5))
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", 2000))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", 200))
+
+accesslog = os.getenv("GUNICORN_ACCESS_LOG", "-")
+errorlog = "-"
+loglevel = os.getenv("GUNICORN_LOG_LEVEL", "info")
+
+
+def post_fork(server, worker):
+    """Drop any pooled DB connections inherited from the preloaded master."""
+    from db import db
+
+    app = server.app.wsgi()
+    if not hasattr(app, "app_context"):
+        # The asyncio front end (async_app) wraps the Flask app.
+        from async_app import FLASK_APP
+
+        app = app[FLASK_APP]
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
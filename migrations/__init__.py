@@ -0,0 +1,111 @@
+"""
+Versioned schema migrations.
+
+Each module in ``migrations/versions`` is named ``<version>_<name>.py`` and
+defines ``upgrade(connection)``. Applied versions are recorded in the
+``schema_migrations`` table; ``flask migrate`` applies the pending ones in
+order, each in its own transaction.
+"""
+
+import importlib
+import os
+import re
+import time
+from datetime import datetime
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, text
+from sqlalchemy.exc import OperationalError
+
+from db import db
+
+VERSIONS_DIR = os.path.join(os.path.dirname(__file__), "versions")
+MIGRATION_LOCK_ID = 7_240_001
+
+schema_migrations = Table(
+    "schema_migrations",
+    MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("name", String(255), nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+
+def discover():
+    """Return ``[(version, name, module)]`` for every migration, in order."""
+    migrations = []
+    for filename in sorted(os.listdir(VERSIONS_DIR)):
+        match = re.fullmatch(r"(\d+)_(\w+)\.py", filename)
+        if match:
+            module = importlib.import_module(f"migrations.versions.{filename[:-3]}")
+            migrations.append((int(match.group(1)), match.group(2), module))
+    return migrations
+
+
+def applied_versions(connection):
+    schema_migrations.create(connection, checkfirst=True)
+    return {row[0] for row in connection.execute(schema_migrations.select())}
+
+
+def upgrade(engine):
+    """Apply pending migrations to ``engine`` and return the applied names."""
+    applied = []
+    with engine.connect() as lock_connection:
+        if engine.dialect.name == "postgresql":
+            # Serialize concurrent runners (e.g. several containers starting).
+            lock_connection.execute(
+                text("SELECT pg_advisory_lock(:id)"), {"id": MIGRATION_LOCK_ID}
+            )
+        try:
+            with engine.begin() as connection:
+                done = applied_versions(connection)
+            for version, name, module in discover():
+                if version in done:
+                    continue
+                with engine.begin() as connection:
+                    module.upgrade(connection)
+                    connection.execute(
+                        schema_migrations.insert().values(
+                            version=version, name=name, applied_at=datetime.utcnow()
+                        )
+                    )
+                applied.append(f"{version:04d}_{name}")
+        finally:
+            if engine.dialect.name == "postgresql":
+                lock_connection.execute(
+                    text("SELECT pg_advisory_unlock(:id)"), {"id": MIGRATION_LOCK_ID}
+                )
+    return applied
+
+
+def wait_for_database(engine, timeout):
+    """Retry connecting for up to ``timeout`` seconds (e.g. while Postgres boots)."""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with engine.connect():
+                return
+        except OperationalError:
+            if time.monotonic() >= deadline:
+                raise
+            time.sleep(1)
+
+
+@click.command("migrate")
+@click.option(
+    "--wait", default=0, show_default=True, help="Seconds to wait for the database."
+)
+@with_appcontext
+def migrate_command(wait):
+    """Apply pending schema migrations to the database and every shard."""
+    applied = []
+    for key, engine in db.engines.items():
+        # Replicas get their schema from the primary.
+        if key is not None and not key.startswith("shard_"):
+            continue
+        wait_for_database(engine, wait)
+        for name in upgrade(engine):
+            click.echo(f"Applied {name}" + (f" on {key}" if key else ""))
+            applied.append(name)
+    click.echo("Schema is up to date" if not applied else f"{len(applied)} applied")
@@ -0,0 +1,60 @@
+"""Tables as they existed before versioned migrations (previously db.create_all)."""
+
+from sqlalchemy import (
+    Column,
+    DateTime,
+    ForeignKey,
+    Integer,
+    MetaData,
+    Numeric,
+    String,
+    Table,
+    func,
+)
+
+metadata = MetaData()
+
+Table("users", metadata, Column("id", Integer, primary_key=True))
+
+Table(
+    "carts",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("user_id", Integer, ForeignKey("users.id"), nullable=False),
+    Column("status", String(20), nullable=False),
+    Column("created_at", DateTime, server_default=func.now()),
+    Column("updated_at", DateTime),
+    Column("total_price", Numeric(10, 2), nullable=False),
+)
+
+Table(
+    "cart_items",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("cart_id", Integer, ForeignKey("carts.id"), nullable=False),
+    Column("product_id", Integer, nullable=False),
+    Column("product_name", String(255), nullable=False),
+    Column("product_price", Numeric(10, 2), nullable=False),
+    Column("quantity", Integer, nullable=False),
+    Column("subtotal", Numeric(10, 2), nullable=False),
+)
+
+Table(
+    "orders",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("user_id", Integer, ForeignKey("users.id"), nullable=False),
+    Column("cart_id", Integer, ForeignKey("carts.id"), nullable=False),
+    Column("status", String(20), nullable=False),
+    Column("created_at", DateTime, server_default=func.now()),
+    Column("updated_at", DateTime),
+    Column("total_price", Numeric(10, 2), nullable=False),
+    Column("shipping_address", String(255)),
+    Column("billing_address", String(255)),
+    Column("payment_status", String(20), nullable=False),
+)
+
+
+def upgrade(connection):
+    # checkfirst keeps this a no-op on databases created by db.create_all().
+    metadata.create_all(connection, checkfirst=True)
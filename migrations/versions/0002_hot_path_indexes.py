@@ -0,0 +1,68 @@
+"""Indexes for the cart item, active cart and order lookups."""
+
+from sqlalchemy import text
+
+# A later row of the same cart and product; the earliest row is kept.
+DUPLICATE = """
+    EXISTS (
+        SELECT 1 FROM cart_items kept
+        WHERE kept.cart_id = {row}.cart_id AND kept.product_id = {row}.product_id
+            AND kept.id < {row}.id
+    )
+"""
+
+STATEMENTS = [
+    # The old select-then-insert add could race into duplicate rows, which
+    # would fail the unique index: fold their quantities into the earliest
+    # row, recompute the totals of the affected carts, drop the rest.
+    """
+    UPDATE cart_items SET
+        quantity = (
+            SELECT SUM(same.quantity) FROM cart_items same
+            WHERE same.cart_id = cart_items.cart_id
+                AND same.product_id = cart_items.product_id
+        ),
+        subtotal = product_price * (
+            SELECT SUM(same.quantity) FROM cart_items same
+            WHERE same.cart_id = cart_items.cart_id
+                AND same.product_id = cart_items.product_id
+        )
+    WHERE id IN (
+        SELECT MIN(id) FROM cart_items
+        GROUP BY cart_id, product_id HAVING COUNT(*) > 1
+    )
+    """,
+    f"""
+    UPDATE carts SET total_price = (
+        SELECT COALESCE(SUM(subtotal), 0) FROM cart_items
+        WHERE cart_items.cart_id = carts.id AND NOT {DUPLICATE.format(row="cart_items")}
+    )
+    WHERE id IN (
+        SELECT cart_id FROM cart_items
+        GROUP BY cart_id, product_id HAVING COUNT(*) > 1
+    )
+    """,
+    f"DELETE FROM cart_items WHERE {DUPLICATE.format(row='cart_items')}",
+    # Also the conflict target of the add-to-cart upsert.
+    "CREATE UNIQUE INDEX IF NOT EXISTS uq_cart_items_cart_product"
+    " ON cart_items (cart_id, product_id)",
+    "CREATE INDEX IF NOT EXISTS ix_carts_user_status ON carts (user_id, status)",
+    # Keep only the newest active cart per user so the partial index can build.
+    """
+    UPDATE carts SET status = 'inactive'
+    WHERE status = 'active' AND id NOT IN (
+        SELECT MAX(id) FROM carts WHERE status = 'active' GROUP BY user_id
+    )
+    """,
+    "CREATE UNIQUE INDEX IF NOT EXISTS uq_carts_user_active"
+    " ON carts (user_id) WHERE status = 'active'",
+    "CREATE INDEX IF NOT EXISTS ix_orders_user_created"
+    " ON orders (user_id, created_at, id)",
+    "CREATE INDEX IF NOT EXISTS ix_orders_cart_id ON orders (cart_id)",
+    "CREATE INDEX IF NOT EXISTS ix_orders_created ON orders (created_at, id)",
+]
+
+
+def upgrade(connection):
+    for statement in STATEMENTS:
+        connection.execute(text(statement))
@@ -0,0 +1,16 @@
+"""Per-bucket id counters used when carts and orders are sharded."""
+
+from sqlalchemy import Column, Integer, MetaData, Table
+
+metadata = MetaData()
+
+Table(
+    "shard_buckets",
+    metadata,
+    Column("bucket", Integer, primary_key=True, autoincrement=False),
+    Column("next_id", Integer, nullable=False),
+)
+
+
+def upgrade(connection):
+    metadata.create_all(connection, checkfirst=True)
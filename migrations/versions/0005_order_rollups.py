@@ -0,0 +1,28 @@
+"""Order analytics rollups, filled from orders by migration 0008."""
+
+from sqlalchemy import Column, Date, Integer, MetaData, Numeric, String, Table
+
+metadata = MetaData()
+
+Table(
+    "order_daily_rollups",
+    metadata,
+    Column("day", Date, primary_key=True),
+    Column("status", String(20), primary_key=True),
+    Column("payment_status", String(20), primary_key=True),
+    Column("order_count", Integer, nullable=False),
+    Column("revenue", Numeric(12, 2), nullable=False),
+)
+
+Table(
+    "user_order_rollups",
+    metadata,
+    Column("user_id", Integer, primary_key=True, autoincrement=False),
+    Column("status", String(20), primary_key=True),
+    Column("order_count", Integer, nullable=False),
+    Column("total_spent", Numeric(12, 2), nullable=False),
+)
+
+
+def upgrade(connection):
+    metadata.create_all(connection, checkfirst=True)
@@ -0,0 +1,46 @@
+"""Cart versions and the per-cart change log behind ``GET /cart/<id>/changes``."""
+
+from sqlalchemy import (
+    Column,
+    DateTime,
+    ForeignKey,
+    Index,
+    Integer,
+    MetaData,
+    Numeric,
+    String,
+    Table,
+    func,
+    inspect,
+    text,
+)
+
+metadata = MetaData()
+
+# Only the referenced column; the carts table itself already exists.
+Table("carts", metadata, Column("id", Integer, primary_key=True))
+
+Table(
+    "cart_changes",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("cart_id", Integer, ForeignKey("carts.id"), nullable=False),
+    Column("version", Integer, nullable=False),
+    Column("kind", String(20), nullable=False),
+    Column("product_id", Integer),
+    Column("product_name", String(255)),
+    Column("product_price", Numeric(10, 2)),
+    Column("quantity", Integer),
+    Column("status", String(20)),
+    Column("created_at", DateTime, server_default=func.now()),
+    Index("uq_cart_changes_cart_version", "cart_id", "version", unique=True),
+)
+
+
+def upgrade(connection):
+    columns = {column["name"] for column in inspect(connection).get_columns("carts")}
+    if "version" not in columns:
+        connection.execute(
+            text("ALTER TABLE carts ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+        )
+    metadata.tables["cart_changes"].create(connection, checkfirst=True)
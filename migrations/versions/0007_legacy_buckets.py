@@ -0,0 +1,24 @@
+"""
+Bucket of every cart and order written before sharding was configured.
+
+Shard routing reads the bucket of newer ids from ``id % BUCKETS``; rows
+created before that keep their ids, and ``flask rebalance-shards`` records
+their user's bucket here before it moves the first bucket. The table stays
+on the primary and is only read for ids up to its highest recorded id.
+"""
+
+from sqlalchemy import Column, Integer, MetaData, SmallInteger, String, Table
+
+metadata = MetaData()
+
+Table(
+    "legacy_buckets",
+    metadata,
+    Column("table_name", String(20), primary_key=True),
+    Column("id", Integer, primary_key=True, autoincrement=False),
+    Column("bucket", SmallInteger, nullable=False),
+)
+
+
+def upgrade(connection):
+    metadata.create_all(connection, checkfirst=True)
@@ -0,0 +1,89 @@
+"""
+Split the daily order rollups into per-user stripes and fill both rollup
+tables from ``orders``.
+
+Every checkout of a day used to update the same daily row, so concurrent
+checkouts queued on its lock. The daily table is recreated with a
+``stripe`` key column (see ``models.analytics.ROLLUP_STRIPES``) and both
+rollups are rebuilt here, in chunks of order ids, so orders written before
+0005 are counted without a separate ``flask backfill-order-rollups`` run.
+The statements are copied from ``models.analytics`` as of this version.
+"""
+
+from sqlalchemy import (
+    Column,
+    Date,
+    Integer,
+    MetaData,
+    Numeric,
+    SmallInteger,
+    String,
+    Table,
+    text,
+)
+
+CHUNK_SIZE = 10000
+ROLLUP_STRIPES = 16
+STRIPE = f"user_id % {ROLLUP_STRIPES}"
+IN_CHUNK = "id > :after_id AND id <= :upto_id"
+
+REBUILD_CHUNK = [
+    text(
+        f"""
+        INSERT INTO order_daily_rollups
+            (day, status, payment_status, stripe, order_count, revenue)
+        SELECT DATE(created_at), status, payment_status, {STRIPE},
+            COUNT(*), SUM(total_price)
+        FROM orders WHERE {IN_CHUNK}
+        GROUP BY DATE(created_at), status, payment_status, {STRIPE}
+        ON CONFLICT (day, status, payment_status, stripe) DO UPDATE SET
+            order_count = order_daily_rollups.order_count + excluded.order_count,
+            revenue = order_daily_rollups.revenue + excluded.revenue
+        """
+    ),
+    text(
+        f"""
+        INSERT INTO user_order_rollups (user_id, status, order_count, total_spent)
+        SELECT user_id, status, COUNT(*), SUM(total_price)
+        FROM orders WHERE {IN_CHUNK}
+        GROUP BY user_id, status
+        ON CONFLICT (user_id, status) DO UPDATE SET
+            order_count = user_order_rollups.order_count + excluded.order_count,
+            total_spent = user_order_rollups.total_spent + excluded.total_spent
+        """
+    ),
+]
+CHUNK_END = text(
+    "SELECT id FROM orders WHERE id > :after_id ORDER BY id LIMIT 1 OFFSET :offset"
+)
+LAST_ID = text("SELECT MAX(id) FROM orders WHERE id > :after_id")
+
+metadata = MetaData()
+
+order_daily_rollups = Table(
+    "order_daily_rollups",
+    metadata,
+    Column("day", Date, primary_key=True),
+    Column("status", String(20), primary_key=True),
+    Column("payment_status", String(20), primary_key=True),
+    Column("stripe", SmallInteger, primary_key=True, autoincrement=False),
+    Column("order_count", Integer, nullable=False),
+    Column("revenue", Numeric(12, 2), nullable=False),
+)
+
+
+def upgrade(connection):
+    connection.execute(text("DROP TABLE IF EXISTS order_daily_rollups"))
+    order_daily_rollups.create(connection)
+    connection.execute(text("DELETE FROM user_order_rollups"))
+    after_id = 0
+    while True:
+        params = {"after_id": after_id, "offset": CHUNK_SIZE - 1}
+        upto_id = connection.execute(CHUNK_END, params).scalar()
+        if upto_id is None:
+            upto_id = connection.execute(LAST_ID, params).scalar()
+            if upto_id is None:
+                return
+        for statement in REBUILD_CHUNK:
+            connection.execute(statement, {"after_id": after_id, "upto_id": upto_id})
+        after_id = upto_id
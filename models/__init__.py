@@ -1,3 +1,6 @@
-from models.cart import CartItemModel, CartModel
+from models.analytics import OrderDailyRollupModel, UserOrderRollupModel
+from models.cart import CartChangeModel, CartItemModel, CartModel
+from models.idempotency import IdempotencyKeyModel
 from models.order import OrderModel
+from models.shard import LegacyBucketModel, ShardBucketModel
 from models.user import UserModel
@@ -0,0 +1,107 @@
+from db import db
+from models.order import OrderModel
+from sqlalchemy import bindparam, event, text
+from sqlalchemy.orm import Session
+
+
+# Each day/status/payment status group is split over this many rows by
+# user, so concurrent checkouts rarely wait on the same rollup row. Readers
+# add the stripes up.
+ROLLUP_STRIPES = 16
+STRIPE = f"user_id % {ROLLUP_STRIPES}"
+
+
+class OrderDailyRollupModel(db.Model):
+    """Order count and revenue per creation day, status and payment status."""
+
+    __tablename__ = "order_daily_rollups"
+
+    day = db.Column(db.Date, primary_key=True)
+    status = db.Column(db.String(20), primary_key=True)
+    payment_status = db.Column(db.String(20), primary_key=True)
+    stripe = db.Column(db.SmallInteger, primary_key=True, autoincrement=False)
+    order_count = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+
+
+class UserOrderRollupModel(db.Model):
+    """Order count and spend per user and order status."""
+
+    __tablename__ = "user_order_rollups"
+
+    user_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    status = db.Column(db.String(20), primary_key=True)
+    order_count = db.Column(db.Integer, nullable=False, default=0)
+    total_spent = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+
+
+# Add (sign 1) or retract (sign -1) the current rows of some orders. The
+# WHERE clause also keeps SQLite from reading ON CONFLICT as a join.
+ROLLUP_DAILY = f"""
+    INSERT INTO order_daily_rollups
+        (day, status, payment_status, stripe, order_count, revenue)
+    SELECT DATE(created_at), status, payment_status, {STRIPE},
+        :sign * COUNT(*), :sign * SUM(total_price)
+    FROM orders WHERE {{where}}
+    GROUP BY DATE(created_at), status, payment_status, {STRIPE}
+    ON CONFLICT (day, status, payment_status, stripe) DO UPDATE SET
+        order_count = order_daily_rollups.order_count + excluded.order_count,
+        revenue = order_daily_rollups.revenue + excluded.revenue
+"""
+
+ROLLUP_USERS = """
+    INSERT INTO user_order_rollups (user_id, status, order_count, total_spent)
+    SELECT user_id, status, :sign * COUNT(*), :sign * SUM(total_price)
+    FROM orders WHERE {where}
+    GROUP BY user_id, status
+    ON CONFLICT (user_id, status) DO UPDATE SET
+        order_count = user_order_rollups.order_count + excluded.order_count,
+        total_spent = user_order_rollups.total_spent + excluded.total_spent
+"""
+
+ROLLUP_ORDERS = [
+    text(statement.format(where="id IN :order_ids")).bindparams(
+        bindparam("order_ids", expanding=True)
+    )
+    for statement in (ROLLUP_DAILY, ROLLUP_USERS)
+]
+
+# Columns the rollups group or sum by.
+ROLLUP_COLUMNS = ("created_at", "user_id", "status", "payment_status", "total_price")
+
+
+def rollup_orders(connection, order_ids, sign):
+    """
+    Add the current rows of ``order_ids`` to the rollups (``sign=1``) or
+    take them out (``sign=-1``). Any write to orders is bracketed by a
+    retract before and an add after it, in the same transaction.
+    """
+    if order_ids:
+        params = {"order_ids": sorted(set(order_ids)), "sign": sign}
+        for statement in ROLLUP_ORDERS:
+            connection.execute(statement, params)
+
+
+def _changes_rollups(order):
+    state = db.inspect(order)
+    return any(state.attrs[column].history.has_changes() for column in ROLLUP_COLUMNS)
+
+
+@event.listens_for(Session, "before_flush")
+def retract_changed_orders(session, flush_context, instances):
+    changed = [
+        order.id
+        for order in session.dirty
+        if isinstance(order, OrderModel) and _changes_rollups(order)
+    ]
+    deleted = [order.id for order in session.deleted if isinstance(order, OrderModel)]
+    if changed or deleted:
+        rollup_orders(session.connection(), changed + deleted, -1)
+        session.info["rollup_order_ids"] = changed
+
+
+@event.listens_for(Session, "after_flush")
+def add_changed_orders(session, flush_context):
+    order_ids = session.info.pop("rollup_order_ids", [])
+    order_ids += [order.id for order in session.new if isinstance(order, OrderModel)]
+    rollup_orders(session.connection(), order_ids, 1)
@@ -1,9 +1,22 @@
 from db import db
 from datetime import datetime
+from sqlalchemy import bindparam, event, text
+from sqlalchemy.orm import Session
 
 
 class CartModel(db.Model):
     __tablename__ = "carts"
+    __table_args__ = (
+        db.Index("ix_carts_user_status", "user_id", "status"),
+        # At most one active cart per user.
+        db.Index(
+            "uq_carts_user_active",
+            "user_id",
+            unique=True,
+            postgresql_where=text("status = 'active'"),
+            sqlite_where=text("status = 'active'"),
+        ),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
@@ -11,6 +24,9 @@ class CartModel(db.Model):
     created_at = db.Column(db.DateTime, server_default=db.func.now())
     updated_at = db.Column(db.DateTime, onupdate=datetime.utcnow)
     total_price = db.Column(db.Numeric(10, 2), nullable=False, default=0)
+    # Bumped by every cart write, once per entry appended to the change log
+    # (total reconciliation bumps it without one). Also the cart's ETag.
+    version = db.Column(db.Integer, nullable=False, default=0, server_default="0")
     items = db.relationship(
         "CartItemModel", back_populates="cart", cascade="all, delete-orphan"
     )
@@ -22,6 +38,9 @@ class CartModel(db.Model):
 
 class CartItemModel(db.Model):
     __tablename__ = "cart_items"
+    __table_args__ = (
+        db.Index("uq_cart_items_cart_product", "cart_id", "product_id", unique=True),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     cart_id = db.Column(db.Integer, db.ForeignKey("carts.id"), nullable=False)
@@ -36,3 +55,191 @@ class CartItemModel(db.Model):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.subtotal = self.product_price * self.quantity
+
+
+class CartChangeModel(db.Model):
+    """
+    One entry of a cart's change log: the cart version it produced and what
+    changed. Kinds are item_added, item_updated, item_removed (product_id
+    plus the changed item fields) and status_changed (status).
+    """
+
+    __tablename__ = "cart_changes"
+    __table_args__ = (
+        db.Index("uq_cart_changes_cart_version", "cart_id", "version", unique=True),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    cart_id = db.Column(db.Integer, db.ForeignKey("carts.id"), nullable=False)
+    version = db.Column(db.Integer, nullable=False)
+    kind = db.Column(db.String(20), nullable=False)
+    product_id = db.Column(db.Integer)
+    product_name = db.Column(db.String(255))
+    product_price = db.Column(db.Numeric(10, 2))
+    quantity = db.Column(db.Integer)
+    status = db.Column(db.String(20))
+    created_at = db.Column(db.DateTime, server_default=db.func.now())
+
+
+CHANGE_FIELDS = (
+    "kind",
+    "product_id",
+    "product_name",
+    "product_price",
+    "quantity",
+    "status",
+)
+
+BUMP_CART_VERSION = text(
+    "UPDATE carts SET version = version + :count WHERE id = :cart_id RETURNING version"
+)
+
+BUMP_CART_VERSION_IF = text(
+    """
+    UPDATE carts SET version = version + :count
+    WHERE id = :cart_id AND version = :expected_version
+    RETURNING version
+    """
+)
+
+SET_CARTS_STATUS = text(
+    """
+    UPDATE carts SET status = :status, version = version + 1
+    WHERE id IN :cart_ids
+    RETURNING id, version
+    """
+).bindparams(bindparam("cart_ids", expanding=True))
+
+
+def append_cart_changes(connection, rows):
+    """Insert change log entries that already carry their cart_id and version."""
+    if rows:
+        connection.execute(
+            CartChangeModel.__table__.insert(),
+            [
+                {
+                    field: row.get(field)
+                    for field in ("cart_id", "version", *CHANGE_FIELDS)
+                }
+                for row in rows
+            ],
+        )
+
+
+def record_cart_changes(connection, cart_id, changes, expected_version=None):
+    """
+    Bump the cart version once per change dict and append the changes to
+    the cart's log, numbered up to the new version. Returns that version,
+    or None when the cart does not exist or, with ``expected_version``, is
+    at another version. The version UPDATE also locks the cart row, so
+    concurrent checks against the same version let only one writer through.
+    """
+    if not changes and expected_version is None:
+        return None
+    params = {"cart_id": cart_id, "count": len(changes)}
+    if expected_version is None:
+        version = connection.execute(BUMP_CART_VERSION, params).scalar()
+    else:
+        version = connection.execute(
+            BUMP_CART_VERSION_IF, {**params, "expected_version": expected_version}
+        ).scalar()
+    if version is not None:
+        first = version - len(changes) + 1
+        append_cart_changes(
+            connection,
+            [
+                {**change, "cart_id": cart_id, "version": first + i}
+                for i, change in enumerate(changes)
+            ],
+        )
+    return version
+
+
+def set_carts_status(connection, cart_ids, status):
+    """Set the status of many carts with one UPDATE, logging it per cart."""
+    if not cart_ids:
+        return
+    updated = connection.execute(
+        SET_CARTS_STATUS, {"status": status, "cart_ids": sorted(cart_ids)}
+    ).fetchall()
+    append_cart_changes(
+        connection,
+        [
+            {
+                "cart_id": cart_id,
+                "version": version,
+                "kind": "status_changed",
+                "status": status,
+            }
+            for cart_id, version in updated
+        ],
+    )
+
+
+REFRESH_CART_TOTALS = text(
+    """
+    UPDATE carts SET total_price = (
+        SELECT COALESCE(SUM(subtotal), 0) FROM cart_items
+        WHERE cart_items.cart_id = carts.id
+    ), updated_at = CURRENT_TIMESTAMP
+    WHERE id IN :cart_ids
+    RETURNING id, total_price
+    """
+).bindparams(bindparam("cart_ids", expanding=True))
+
+
+def refresh_cart_totals(connection, cart_ids):
+    """
+    Recompute total_price of the given carts with a single set-based UPDATE
+    and return the new totals as ``{cart_id: total_price}``.
+    """
+    if not cart_ids:
+        return {}
+    result = connection.execute(REFRESH_CART_TOTALS, {"cart_ids": sorted(cart_ids)})
+    return dict(result.fetchall())
+
+
+def lock_cart(cart_id):
+    """
+    Load the cart with ``SELECT ... FOR UPDATE`` (or None), so concurrent
+    checkouts of the same cart run one after the other until commit.
+    """
+    if db.session.get_bind().dialect.name == "sqlite":
+        # SQLite has no row locks; a no-op write takes the database write
+        # lock up front so the read below already sees the previous checkout.
+        db.session.execute(
+            text("UPDATE carts SET status = status WHERE id = :cart_id"),
+            {"cart_id": cart_id},
+        )
+    return CartModel.query.with_for_update().filter_by(id=cart_id).first()
+
+
+@event.listens_for(Session, "before_flush")
+def update_item_subtotals(session, flush_context, instances):
+    for item in session.dirty:
+        if isinstance(item, CartItemModel) and session.is_modified(item):
+            item.subtotal = item.product_price * item.quantity
+
+
+@event.listens_for(Session, "after_flush")
+def update_cart_totals(session, flush_context):
+    """Refresh totals once per flush for every cart whose items changed."""
+    cart_ids = set()
+    for item in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(item, CartItemModel):
+            history = db.inspect(item).attrs.cart_id.history
+            cart_ids.update(c for c in (*history.added, *history.deleted) if c)
+            if item.cart_id:
+                cart_ids.add(item.cart_id)
+    if cart_ids:
+        refresh_cart_totals(session.connection(), cart_ids)
+        session.info.setdefault("refreshed_cart_ids", set()).update(cart_ids)
+
+
+@event.listens_for(Session, "after_flush_postexec")
+def expire_cart_totals(session, flush_context):
+    cart_ids = session.info.pop("refreshed_cart_ids", None)
+    if cart_ids:
+        for obj in list(session.identity_map.values()):
+            if isinstance(obj, CartModel) and obj.id in cart_ids:
+                session.expire(obj, ["total_price", "updated_at"])
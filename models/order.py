@@ -4,6 +4,11 @@ from datetime import datetime
 
 class OrderModel(db.Model):
     __tablename__ = "orders"
+    __table_args__ = (
+        db.Index("ix_orders_user_created", "user_id", "created_at", "id"),
+        db.Index("ix_orders_cart_id", "cart_id"),
+        db.Index("ix_orders_created", "created_at", "id"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
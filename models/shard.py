@@ -0,0 +1,23 @@
+from db import db
+
+
+class ShardBucketModel(db.Model):
+    """Per-bucket id counter; lives on the shard that owns the bucket."""
+
+    __tablename__ = "shard_buckets"
+
+    bucket = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    next_id = db.Column(db.Integer, nullable=False)
+
+
+class LegacyBucketModel(db.Model):
+    """
+    Bucket of a cart or order created before sharding, whose id does not
+    encode it; recorded by ``flask rebalance-shards`` and kept on the primary.
+    """
+
+    __tablename__ = "legacy_buckets"
+
+    table_name = db.Column(db.String(20), primary_key=True)
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    bucket = db.Column(db.SmallInteger, nullable=False)
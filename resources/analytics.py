@@ -0,0 +1,89 @@
+from flask.views import MethodView
+from flask_smorest import Blueprint
+from sqlalchemy import func
+
+from db import db
+from models import OrderDailyRollupModel, UserOrderRollupModel
+from resources.schemas import (
+    DailyRollupArgsSchema,
+    DailyRollupSchema,
+    UserSpendSchema,
+)
+from services.replicas import read_only
+from services.sharding import sharded, shards
+
+blp = Blueprint("Analytics", __name__, description="Order analytics from rollups")
+
+# Canceled orders are listed in the breakdowns but do not count as spend.
+EXCLUDED_FROM_SPEND = ("canceled",)
+
+
+@blp.route("/analytics/daily")
+class DailyOrders(MethodView):
+    @read_only
+    @blp.arguments(DailyRollupArgsSchema, location="query")
+    @blp.response(200, DailyRollupSchema(many=True))
+    def get(self, args):
+        """Orders and revenue per day, status and payment status"""
+        rollup = OrderDailyRollupModel
+        key = (rollup.day, rollup.status, rollup.payment_status)
+        query = db.session.query(
+            *key, func.sum(rollup.order_count), func.sum(rollup.revenue)
+        ).group_by(*key)
+        if "date_from" in args:
+            query = query.filter(rollup.day >= args["date_from"])
+        if "date_to" in args:
+            query = query.filter(rollup.day <= args["date_to"])
+        for field in ("status", "payment_status"):
+            if field in args:
+                query = query.filter(getattr(rollup, field) == args[field])
+
+        # Each shard keeps rollups of its own orders; add them up.
+        totals = {}
+        for _ in shards.each():
+            for day, status, payment_status, count, revenue in query.all():
+                total = totals.setdefault((day, status, payment_status), [0, 0])
+                total[0] += count
+                total[1] += revenue
+        return [
+            {
+                "day": day,
+                "status": status,
+                "payment_status": payment_status,
+                "order_count": count,
+                "revenue": round(float(revenue), 2),
+            }
+            for (day, status, payment_status), (count, revenue) in sorted(
+                totals.items()
+            )
+            if count
+        ]
+
+
+@blp.route("/analytics/users/<int:user_id>")
+class UserSpend(MethodView):
+    @read_only
+    @blp.response(200, UserSpendSchema)
+    @sharded("user_id")
+    def get(self, user_id):
+        """Order count and spend of a user, in total and per order status"""
+        rows = UserOrderRollupModel.query.filter_by(user_id=user_id).all()
+        by_status = {
+            row.status: {
+                "order_count": row.order_count,
+                "total_spent": round(float(row.total_spent), 2),
+            }
+            for row in rows
+            if row.order_count
+        }
+        spend = [
+            totals
+            for status, totals in by_status.items()
+            if status not in EXCLUDED_FROM_SPEND
+        ]
+        return {
+            "user_id": user_id,
+            "order_count": sum(totals["order_count"] for totals in spend),
+            "total_spent": round(sum(totals["total_spent"] for totals in spend), 2),
+            "by_status": by_status,
+        }
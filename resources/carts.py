@@ -1,44 +1,52 @@
 from flask.views import MethodView
 from flask_smorest import Blueprint, abort
-from flask import request
-from models import CartModel, CartItemModel, UserModel, OrderModel
+from flask import Response, request
+from models import CartModel, UserModel, OrderModel
+from models.cart import (
+    append_cart_changes,
+    lock_cart,
+    record_cart_changes,
+    refresh_cart_totals,
+)
+from resources.idempotency import idempotent
 from resources.schemas import (
     CartSchema,
     CartItemSchema,
     CartUpdateSchema,
-    OrderSchema,
     CartItemAddSchema,
+    CartItemBatchSchema,
+    CartItemBatchResultSchema,
+    CartListArgsSchema,
+    CartChangesArgsSchema,
+    CartChangesSchema,
 )
+from resources.pagination import keyset_listing
+from resources.serializers import dump_cart, encode
 import requests
 from db import db
-from sqlalchemy import event, text
+from decimal import Decimal
+from services.cache import cart_cache
+from services.catalog import PREFETCHED_PRODUCTS, catalog, prefetched
+from services.jobs import jobs
+from services.replicas import read_only
+from services.sharding import sharded
+from sqlalchemy import bindparam, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
 
 blp = Blueprint("Carts", __name__, description="Operations on carts")
 
-
-def calculate_cart_total(cart):
-    cart.total_price = sum(item.product_price * item.quantity for item in cart.items)
-    return cart
-
-
-@event.listens_for(CartItemModel, "after_insert")
-@event.listens_for(CartItemModel, "after_update")
-@event.listens_for(CartItemModel, "after_delete")
-def update_cart_total(mapper, connection, target):
-    cart = CartModel.query.get(target.cart_id)
-    if cart:
-        calculate_cart_total(cart)
-        db.session.add(cart)
-        db.session.commit()
+# CartSchema dumps cart.items, so load them with one extra query per request.
+CART_LOADERS = (selectinload(CartModel.items),)
 
 
 def fetch_item_from_fakestore(product_id):
     try:
-        response = requests.get(
-            f"https://fakestoreapi.com/products/{product_id}", timeout=5
-        )
-        response.raise_for_status()
-        data = response.json()
+        products = prefetched(request.environ, PREFETCHED_PRODUCTS) or {}
+        if product_id in products:
+            data = products[product_id]
+        else:
+            data = catalog.get_product(product_id)
         if not data:
             abort(404, message=f"Product {product_id} not found in Fake Store API")
         return {
@@ -57,10 +65,330 @@ def fetch_item_from_fakestore(product_id):
         )
 
 
+def fetch_items_from_fakestore(product_ids, max_age=None):
+    """
+    Resolve several products with at most one Fake Store round trip, from
+    catalog entries at most ``max_age`` seconds old when it is given.
+    Products the asyncio front end fetched for the request are used as-is.
+    """
+    try:
+        products = prefetched(request.environ, PREFETCHED_PRODUCTS)
+        if (
+            max_age is None
+            and products is not None
+            and products.keys() >= set(product_ids)
+        ):
+            products = {product_id: products[product_id] for product_id in product_ids}
+        else:
+            products = catalog.get_many(product_ids, max_age=max_age)
+    except requests.Timeout:
+        abort(504, message="Request to Fake Store API timed out")
+    except requests.RequestException as e:
+        abort(502, message=f"Failed to fetch products from Fake Store API: {str(e)}")
+    return {
+        product_id: data
+        and {
+            "id": data["id"],
+            "title": data["title"],
+            "price": data["price"],
+        }
+        for product_id, data in products.items()
+    }
+
+
+CART_ITEM_PRICES = text(
+    """
+    SELECT carts.user_id, carts.status, cart_items.product_id, cart_items.product_price
+    FROM carts LEFT JOIN cart_items ON cart_items.cart_id = carts.id
+    WHERE carts.id = :cart_id
+    """
+)
+
+
+def cart_item_prices(cart_id):
+    """
+    Read the owner and status of the cart and the prices of its items as
+    ``(cart, {product_id: price})``, or ``(None, {})`` when it does not
+    exist, so checkout can refuse a cart before asking Fake Store anything.
+    Ends the read transaction: no lock or snapshot is held across the API
+    call that follows.
+    """
+    rows = db.session.execute(CART_ITEM_PRICES, {"cart_id": cart_id}).fetchall()
+    db.session.rollback()
+    if not rows:
+        return None, {}
+    prices = {row.product_id: row.product_price for row in rows if row.product_id}
+    return rows[0], prices
+
+
+def find_stale_prices(prices):
+    """
+    Compare item prices (``{product_id: price}``) with the current Fake Store
+    prices, always fetched from the upstream with one round trip, and return
+    the items whose price changed as ``{"product_id", "old_price",
+    "new_price"}`` dicts. Products missing from the catalog keep their price.
+    """
+    if not prices:
+        return []
+    products = fetch_items_from_fakestore(list(prices), max_age=0)
+    return [
+        {
+            "product_id": product_id,
+            "old_price": old_price,
+            "new_price": products[product_id]["price"],
+        }
+        for product_id, old_price in prices.items()
+        if products.get(product_id)
+        and Decimal(str(products[product_id]["price"])) != Decimal(str(old_price))
+    ]
+
+
+def reprice_cart_items(cart, changes):
+    """
+    Apply ``find_stale_prices`` results to the cart with one UPDATE and
+    refresh its total once. Returns the new total, or None without changes.
+    """
+    if not changes:
+        return None
+    cases = []
+    params = {"cart_id": cart.id}
+    for i, change in enumerate(changes):
+        cases.append(f"WHEN :product_id_{i} THEN :product_price_{i}")
+        params[f"product_id_{i}"] = change["product_id"]
+        params[f"product_price_{i}"] = change["new_price"]
+    new_price = f"CASE product_id {' '.join(cases)} END"
+    product_ids = ", ".join(f":product_id_{i}" for i in range(len(changes)))
+    db.session.execute(
+        text(
+            f"""
+            UPDATE cart_items SET
+                product_price = {new_price},
+                subtotal = ({new_price}) * quantity
+            WHERE cart_id = :cart_id AND product_id IN ({product_ids})
+            """
+        ),
+        params,
+    )
+    total = refresh_cart_totals(db.session, [cart.id]).get(cart.id)
+    record_cart_changes(
+        db.session,
+        cart.id,
+        [
+            {
+                "kind": "item_updated",
+                "product_id": change["product_id"],
+                "product_price": change["new_price"],
+            }
+            for change in changes
+        ],
+    )
+    db.session.expire(cart, ["items", "total_price", "updated_at", "version"])
+    return total
+
+
+UPSERT_ITEM = """
+    INSERT INTO cart_items (cart_id, product_id, product_name, product_price, quantity, subtotal)
+    SELECT id, :product_id, :product_name, :product_price, :quantity, :product_price * :quantity
+    FROM carts WHERE id = :cart_id
+    ON CONFLICT (cart_id, product_id) DO UPDATE SET
+        quantity = cart_items.quantity + excluded.quantity,
+        subtotal = cart_items.product_price * (cart_items.quantity + excluded.quantity)
+    RETURNING *
+"""
+
+UPSERT_ITEM_AND_TOTAL = text(
+    f"""
+    WITH item AS ({UPSERT_ITEM}), cart AS (
+        UPDATE carts SET
+            total_price = carts.total_price + item.product_price * :quantity,
+            updated_at = CURRENT_TIMESTAMP,
+            version = carts.version + 1
+        FROM item WHERE carts.id = item.cart_id
+        RETURNING carts.version
+    ), change AS (
+        INSERT INTO cart_changes
+            (cart_id, version, kind, product_id, product_name, product_price, quantity)
+        SELECT item.cart_id, cart.version,
+            CASE WHEN item.quantity = :quantity THEN 'item_added' ELSE 'item_updated' END,
+            item.product_id,
+            CASE WHEN item.quantity = :quantity THEN item.product_name END,
+            item.product_price, item.quantity
+        FROM item, cart
+    )
+    SELECT * FROM item
+    """
+)
+
+ADD_TO_CART_TOTAL = text(
+    """
+    UPDATE carts SET
+        total_price = total_price + :delta,
+        updated_at = CURRENT_TIMESTAMP,
+        version = version + 1
+    WHERE id = :cart_id
+    RETURNING version
+    """
+)
+
+
+def upsert_cart_item(cart_id, product_data, quantity):
+    """
+    Insert the product into the cart or bump its quantity, keeping the cart
+    total, version and change log in step. Relies on the unique (cart_id,
+    product_id) constraint, so concurrent adds of the same product cannot
+    create duplicate rows.
+
+    PostgreSQL does it in one statement; SQLite needs a second one for the
+    total and version and a third for the log entry. Returns the item row,
+    or None when the cart does not exist.
+    """
+    params = {
+        "cart_id": cart_id,
+        "product_id": product_data["id"],
+        "product_name": product_data["title"],
+        "product_price": product_data["price"],
+        "quantity": quantity,
+    }
+    if db.session.get_bind().dialect.name == "postgresql":
+        return db.session.execute(UPSERT_ITEM_AND_TOTAL, params).fetchone()
+
+    item = db.session.execute(text(UPSERT_ITEM), params).fetchone()
+    if item:
+        version = db.session.execute(
+            ADD_TO_CART_TOTAL,
+            {"delta": item.product_price * quantity, "cart_id": cart_id},
+        ).scalar()
+        added = item.quantity == quantity
+        append_cart_changes(
+            db.session,
+            [
+                {
+                    "cart_id": cart_id,
+                    "version": version,
+                    "kind": "item_added" if added else "item_updated",
+                    "product_id": item.product_id,
+                    "product_name": item.product_name if added else None,
+                    "product_price": item.product_price,
+                    "quantity": item.quantity,
+                }
+            ],
+        )
+    return item
+
+
+CART_WITH_ITEMS = text(
+    """
+    SELECT carts.id, cart_items.product_id FROM carts
+    LEFT JOIN cart_items ON cart_items.cart_id = carts.id
+        AND cart_items.product_id IN :product_ids
+    WHERE carts.id = :cart_id
+    """
+).bindparams(bindparam("product_ids", expanding=True))
+
+DELETE_ITEMS = text(
+    """
+    DELETE FROM cart_items
+    WHERE cart_id = :cart_id AND product_id IN :product_ids
+    RETURNING product_id
+    """
+).bindparams(bindparam("product_ids", expanding=True))
+
+
+CART_VERSION = text("SELECT version FROM carts WHERE id = :cart_id")
+
+
+def cart_etag(version):
+    """Cart ETags name the version: every cart write bumps it."""
+    return f"v{version}"
+
+
+def expected_cart_version():
+    """
+    The cart version named by ``If-Match``: the ``"v<version>"`` ETag of
+    ``GET /cart/<id>``, or a bare version number. None without the header.
+    """
+    header = request.headers.get("If-Match", "").strip()
+    if header in ("", "*"):
+        return None
+    tag = header.removeprefix("W/").strip('"')
+    try:
+        return int(tag.removeprefix("v"))
+    except ValueError:
+        abort(400, message="If-Match must be a cart ETag or version")
+
+
+CART_CHANGES = text(
+    """
+    SELECT carts.version AS cart_version, carts.status AS cart_status,
+        carts.total_price, cart_changes.*
+    FROM carts
+    LEFT JOIN cart_changes ON cart_changes.cart_id = carts.id
+        AND cart_changes.version > :since
+    WHERE carts.id = :cart_id
+    ORDER BY cart_changes.version
+    """
+)
+
+
+def collapse_item_operations(operations):
+    """Fold all operations on the same product into one net (action, quantity)."""
+    net = {}
+    for operation in operations:
+        product_id = operation["product_id"]
+        action, quantity = operation["action"], operation["quantity"]
+        if action == "add" and product_id in net:
+            previous_action, previous_quantity = net[product_id]
+            if previous_action == "remove":
+                action = "set"
+            else:
+                action, quantity = previous_action, previous_quantity + quantity
+        net[product_id] = (action, quantity)
+    return net
+
+
+def upsert_cart_items(cart_id, items, mode):
+    """
+    Write many ``(product, quantity)`` pairs with one multi-row upsert.
+    ``mode`` "add" increments existing quantities, "set" replaces them.
+    """
+    values = []
+    params = {"cart_id": cart_id}
+    for i, (product, quantity) in enumerate(items):
+        values.append(
+            f"(:cart_id, :product_id_{i}, :product_name_{i}, :product_price_{i}, "
+            f":quantity_{i}, :subtotal_{i})"
+        )
+        params.update(
+            {
+                f"product_id_{i}": product["id"],
+                f"product_name_{i}": product["title"],
+                f"product_price_{i}": product["price"],
+                f"quantity_{i}": quantity,
+                f"subtotal_{i}": product["price"] * quantity,
+            }
+        )
+    new_quantity = (
+        "cart_items.quantity + excluded.quantity"
+        if mode == "add"
+        else "excluded.quantity"
+    )
+    statement = f"""
+        INSERT INTO cart_items (cart_id, product_id, product_name, product_price, quantity, subtotal)
+        VALUES {", ".join(values)}
+        ON CONFLICT (cart_id, product_id) DO UPDATE SET
+            quantity = {new_quantity},
+            subtotal = cart_items.product_price * ({new_quantity})
+        RETURNING product_id, quantity, subtotal
+    """
+    return db.session.execute(text(statement), params).fetchall()
+
+
 @blp.route("/cart")
 class CartCreate(MethodView):
+    @idempotent
     @blp.arguments(CartSchema(exclude=["items"]))
     @blp.response(201, CartSchema)
+    @sharded("user_id")
     def post(self, cart_data):
         """Create a new cart, ensuring the user has only one active cart."""
         user_id = cart_data["user_id"]
@@ -77,123 +405,219 @@ class CartCreate(MethodView):
 
         cart = CartModel(user_id=user_id)
         db.session.add(cart)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # A concurrent request created the active cart first.
+            db.session.rollback()
+            cart = CartModel.query.filter_by(user_id=user_id, status="active").first()
+            if not cart:
+                abort(409, message="Could not create cart, please retry")
 
         return cart
 
 
 @blp.route("/cart/<int:cart_id>/items")
 class CartItemAdd(MethodView):
+    @idempotent
     @blp.arguments(CartItemAddSchema)
     @blp.response(201, CartItemSchema)
+    @sharded("cart_id")
     def post(self, item_data, cart_id):
         """Add item to cart."""
-        cart = db.session.execute(
-            text("SELECT * FROM carts WHERE id = :cart_id"), {"cart_id": cart_id}
-        ).fetchone()
+        product_data = fetch_item_from_fakestore(item_data["product_id"])
 
-        if not cart:
-            abort(404, message="Cart not found")
+        if not product_data:
+            abort(400, message="Invalid product ID")
 
-        product_id = item_data["product_id"]
-        quantity = item_data.get("quantity", 1)
+        item = upsert_cart_item(cart_id, product_data, item_data.get("quantity", 1))
 
-        product_data = fetch_item_from_fakestore(product_id)
+        if not item:
+            db.session.rollback()
+            abort(404, message="Cart not found")
 
-        if not product_data:
-            abort(400, message="Invalid product ID")
+        db.session.commit()
+        cart_cache.invalidate(cart_id)
+        return dict(item._mapping), 201
 
-        existing_item = db.session.execute(
-            text(
-                "SELECT * FROM cart_items WHERE cart_id = :cart_id AND product_id = :product_id"
-            ),
-            {"cart_id": cart_id, "product_id": product_id},
-        ).fetchone()
 
-        if existing_item:
-            new_quantity = existing_item.quantity + quantity
-            new_subtotal = new_quantity * product_data["price"]
-            db.session.execute(
-                text(
-                    "UPDATE cart_items SET quantity = :quantity, subtotal = :subtotal WHERE id = :item_id"
-                ),
-                {
-                    "quantity": new_quantity,
-                    "subtotal": new_subtotal,
-                    "item_id": existing_item.id,
-                },
-            )
-        else:
-            db.session.execute(
-                text(
-                    """
-                    INSERT INTO cart_items (cart_id, product_id, product_name, product_price, quantity, subtotal)
-                    VALUES (:cart_id, :product_id, :product_name, :product_price, :quantity, :subtotal)
-                """
-                ),
-                {
-                    "cart_id": cart_id,
-                    "product_id": product_data["id"],
-                    "product_name": product_data["title"],
-                    "product_price": product_data["price"],
-                    "quantity": quantity,
-                    "subtotal": product_data["price"] * quantity,
-                },
-            )
+@blp.route("/cart/<int:cart_id>/items/batch")
+class CartItemBatch(MethodView):
+    @idempotent
+    @blp.arguments(CartItemBatchSchema)
+    @blp.response(200, CartItemBatchResultSchema)
+    @sharded("cart_id")
+    def post(self, batch_data, cart_id):
+        """Add, update or remove many cart items in one request."""
+        operations = collapse_item_operations(batch_data["items"])
 
-        total_price = (
-            db.session.execute(
-                text("SELECT SUM(subtotal) FROM cart_items WHERE cart_id = :cart_id"),
-                {"cart_id": cart_id},
-            ).scalar()
-            or 0
-        )
+        rows = db.session.execute(
+            CART_WITH_ITEMS, {"cart_id": cart_id, "product_ids": list(operations)}
+        ).fetchall()
 
-        db.session.execute(
-            text("UPDATE carts SET total_price = :total_price WHERE id = :cart_id"),
-            {"total_price": total_price, "cart_id": cart_id},
+        if not rows:
+            abort(404, message="Cart not found")
+
+        existing = {row.product_id for row in rows if row.product_id is not None}
+        products = fetch_items_from_fakestore(
+            [pid for pid, (action, _) in operations.items() if action != "remove"]
         )
 
+        results = {}
+        changes = []
+        writes = {"add": [], "set": []}
+        removals = []
+        for product_id, (action, quantity) in operations.items():
+            if action == "remove" and product_id in existing:
+                removals.append(product_id)
+            elif action != "remove" and products.get(product_id):
+                writes[action].append((products[product_id], quantity))
+            else:
+                results[product_id] = {"status": "not_found"}
+
+        for mode, items in writes.items():
+            if items:
+                for row in upsert_cart_items(cart_id, items, mode):
+                    added = row.product_id not in existing
+                    results[row.product_id] = {
+                        "status": "added" if added else "updated",
+                        "quantity": row.quantity,
+                        "subtotal": row.subtotal,
+                    }
+                    product = products[row.product_id]
+                    changes.append(
+                        {
+                            "kind": "item_added" if added else "item_updated",
+                            "product_id": row.product_id,
+                            "product_name": product["title"] if added else None,
+                            "product_price": product["price"] if added else None,
+                            "quantity": row.quantity,
+                        }
+                    )
+
+        if removals:
+            for row in db.session.execute(
+                DELETE_ITEMS, {"cart_id": cart_id, "product_ids": removals}
+            ):
+                results[row.product_id] = {"status": "removed"}
+                changes.append({"kind": "item_removed", "product_id": row.product_id})
+
+        totals = refresh_cart_totals(db.session, [cart_id])
+        record_cart_changes(db.session, cart_id, changes)
         db.session.commit()
-        return {"message": "Item added successfully"}, 201
+        cart_cache.invalidate(cart_id)
+
+        return {
+            "cart_id": cart_id,
+            "total_price": totals.get(cart_id, 0),
+            "items": [
+                {"product_id": product_id, "action": action, **results[product_id]}
+                for product_id, (action, _) in operations.items()
+            ],
+        }
 
 
 @blp.route("/cart/<int:cart_id>")
 class CartManager(MethodView):
     @blp.response(200, CartSchema)
+    @sharded("cart_id")
     def get(self, cart_id):
-        """Get full cart details."""
-        cart = CartModel.query.get_or_404(cart_id)
-        return cart
-
+        """
+        Get full cart details. The ETag is the cart version: If-None-Match
+        pollers get a 304 straight from the process's recent version hint,
+        or else after a primary-key lookup of the version. Cached payloads
+        are only served when they are of that version.
+        """
+        version = cart_cache.recent_version(cart_id)
+        if version is None or not request.if_none_match.contains(cart_etag(version)):
+            version = db.session.execute(CART_VERSION, {"cart_id": cart_id}).scalar()
+            if version is None:
+                abort(404, message="Cart not found")
+            cart_cache.note_version(cart_id, version)
+        if request.if_none_match.contains(cart_etag(version)):
+            response = Response(status=304)
+            response.set_etag(cart_etag(version))
+            return response
+
+        body = cart_cache.get(cart_id, version)
+        if body is None:
+            cart = CartModel.query.options(*CART_LOADERS).get_or_404(cart_id)
+            version = cart.version
+            body = cart_cache.store(cart_id, version, encode(dump_cart(cart)))
+        response = Response(body + b"\n", mimetype="application/json")
+        response.set_etag(cart_etag(version))
+        return response
+
+    @idempotent
     @blp.arguments(CartUpdateSchema(exclude=["items"]))
     @blp.response(200, CartSchema)
+    @sharded("cart_id")
     def put(self, cart_data, cart_id):
-        """Update cart status."""
-        cart = CartModel.query.get_or_404(cart_id)
+        """
+        Update cart status, creating the order when it is completed. Like
+        ``POST /order``, checkout lists the items it repriced.
+        """
+        stale_prices = []
+        if cart_data.get("status") == "completed":
+            owner, prices = cart_item_prices(cart_id)
+            if owner is None:
+                abort(404, message="Cart not found")
+            if owner.status != "completed":
+                stale_prices = find_stale_prices(prices)
+        cart = lock_cart(cart_id)
+        if not cart:
+            abort(404, message="Cart not found")
 
+        order_id = None
         if "status" in cart_data:
+            previous = cart.status
             cart.status = cart_data["status"]
+            if cart.status != previous:
+                record_cart_changes(
+                    db.session,
+                    cart.id,
+                    [{"kind": "status_changed", "status": cart.status}],
+                )
 
-            if cart.status == "completed":
+            # A retried checkout waits on the row lock above and then finds
+            # the cart completed, or ordered with its order already there.
+            if (
+                cart.status == "completed"
+                and previous != "completed"
+                and not (
+                    previous == "ordered"
+                    and OrderModel.query.filter_by(cart_id=cart.id).first()
+                )
+            ):
+                total = reprice_cart_items(cart, stale_prices)
                 order = OrderModel(
                     user_id=cart.user_id,
                     cart_id=cart.id,
                     status="pending",
-                    total_price=cart.total_price,
+                    total_price=cart.total_price if total is None else total,
                     shipping_address="",
                     billing_address="",
                     payment_status="pending",
                 )
                 db.session.add(order)
-                db.session.commit()
-
-        calculate_cart_total(cart)
-        db.session.commit()
+                db.session.flush()
+                order_id = order.id
+                cart.repriced_items = stale_prices
+
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            abort(409, message="User already has an active cart")
+        cart_cache.invalidate(cart_id)
+        if order_id is not None:
+            jobs.enqueue("finalize_order", order_id=order_id)
 
         return cart
 
+    @idempotent
     @blp.response(204)
+    @sharded("cart_id")
     def delete(self, cart_id):
         """Delete entire cart and its items using raw SQL queries"""
 
@@ -209,16 +633,24 @@ class CartManager(MethodView):
             {"cart_id": cart_id},
         )
 
+        db.session.execute(
+            text("DELETE FROM cart_changes WHERE cart_id = :cart_id"),
+            {"cart_id": cart_id},
+        )
+
         db.session.execute(
             text("DELETE FROM carts WHERE id = :cart_id"), {"cart_id": cart_id}
         )
 
         db.session.commit()
+        cart_cache.invalidate(cart_id)
         return "", 204
 
 
 @blp.route("/cart/<int:cart_id>/items/<int:product_id>")
 class CartItemManager(MethodView):
+    @idempotent
+    @sharded("cart_id")
     def delete(self, cart_id, product_id):
         """Remove specific item from cart using raw SQL queries."""
 
@@ -239,25 +671,25 @@ class CartItemManager(MethodView):
             {"cart_id": cart_id, "product_id": product_id},
         )
 
-        new_total = db.session.execute(
-            text(
-                "SELECT COALESCE(SUM(subtotal), 0) FROM cart_items WHERE cart_id = :cart_id"
-            ),
-            {"cart_id": cart_id},
-        ).scalar()
-
-        db.session.execute(
-            text("UPDATE carts SET total_price = :new_total WHERE id = :cart_id"),
-            {"new_total": new_total, "cart_id": cart_id},
+        refresh_cart_totals(db.session, [cart_id])
+        record_cart_changes(
+            db.session, cart_id, [{"kind": "item_removed", "product_id": product_id}]
         )
 
         db.session.commit()
+        cart_cache.invalidate(cart_id)
         return {"message": "Item removed from cart"}, 200
 
+    @idempotent
     @blp.arguments(CartItemSchema(partial=True))
     @blp.response(200, CartItemSchema)
+    @sharded("cart_id")
     def patch(self, item_data, cart_id, product_id):
-        """Update item quantity using raw SQL queries."""
+        """
+        Update item quantity using raw SQL queries. With ``If-Match`` set to the
+        cart's ETag the update only applies while the cart is at that version.
+        """
+        expected_version = expected_cart_version()
 
         item = db.session.execute(
             text(
@@ -271,6 +703,20 @@ class CartItemManager(MethodView):
 
         item_id, product_price = item
 
+        changes = []
+        if "quantity" in item_data:
+            changes.append(
+                {
+                    "kind": "item_updated",
+                    "product_id": product_id,
+                    "quantity": item_data["quantity"],
+                }
+            )
+        version = record_cart_changes(db.session, cart_id, changes, expected_version)
+        if expected_version is not None and version is None:
+            db.session.rollback()
+            abort(412, message="Cart has changed, fetch its changes and retry")
+
         if "quantity" in item_data:
             new_quantity = item_data["quantity"]
             new_subtotal = product_price * new_quantity
@@ -286,19 +732,10 @@ class CartItemManager(MethodView):
                 },
             )
 
-        new_total = db.session.execute(
-            text(
-                "SELECT COALESCE(SUM(subtotal), 0) FROM cart_items WHERE cart_id = :cart_id"
-            ),
-            {"cart_id": cart_id},
-        ).scalar()
-
-        db.session.execute(
-            text("UPDATE carts SET total_price = :new_total WHERE id = :cart_id"),
-            {"new_total": new_total, "cart_id": cart_id},
-        )
+        refresh_cart_totals(db.session, [cart_id])
 
         db.session.commit()
+        cart_cache.invalidate(cart_id)
 
         updated_item = db.session.execute(
             text("SELECT * FROM cart_items WHERE id = :item_id"), {"item_id": item_id}
@@ -306,12 +743,53 @@ class CartItemManager(MethodView):
 
         updated_item_dict = dict(updated_item._mapping)
 
-        return updated_item_dict
+        if version is None:
+            return updated_item_dict
+        return updated_item_dict, 200, {"X-Cart-Version": str(version)}
 
 
 @blp.route("/user/<int:user_id>/carts")
 class UserCarts(MethodView):
+    @read_only
+    @blp.arguments(CartListArgsSchema, location="query")
     @blp.response(200, CartSchema(many=True))
-    def get(self, user_id):
-        """Retrieve all carts belonging to a user."""
-        return CartModel.query.filter_by(user_id=user_id).all()
+    @sharded("user_id")
+    def get(self, args, user_id):
+        """Retrieve the carts belonging to a user, one keyset page at a time."""
+        query = CartModel.query.options(*CART_LOADERS).filter_by(user_id=user_id)
+        return keyset_listing(query, CartModel, args, dump_cart)
+
+
+@blp.route("/cart/<int:cart_id>/changes")
+class CartChanges(MethodView):
+    @read_only
+    @blp.arguments(CartChangesArgsSchema, location="query")
+    @blp.response(200, CartChangesSchema)
+    @sharded("cart_id")
+    def get(self, args, cart_id):
+        """
+        Changes of the cart after version ``since``, oldest first, read with
+        one indexed query. When the log no longer reaches back to ``since``
+        the response has ``resync`` set and the client reloads the cart.
+        """
+        since = args["since"]
+        rows = db.session.execute(
+            CART_CHANGES, {"cart_id": cart_id, "since": since}
+        ).fetchall()
+        if not rows:
+            abort(404, message="Cart not found")
+
+        cart = rows[0]
+        changes = [row for row in rows if row.version is not None]
+        # A replica behind the client's version has nothing new yet. The log
+        # must hold every version after ``since``: compaction trims its head
+        # and total reconciliation bumps the version without an entry.
+        resync = since < cart.cart_version and len(changes) != cart.cart_version - since
+        return {
+            "cart_id": cart_id,
+            "version": cart.cart_version,
+            "status": cart.cart_status,
+            "total_price": cart.total_price,
+            "resync": resync,
+            "changes": [] if resync else [dict(row._mapping) for row in changes],
+        }
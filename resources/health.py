@@ -0,0 +1,35 @@
+from flask.views import MethodView
+from flask_smorest import Blueprint
+from services.cache import cart_cache
+from services.catalog import catalog
+from services.jobs import jobs
+from services.metrics import metrics_response
+from services.replicas import replicas
+from services.sharding import shards
+from services.upstream import product_api
+
+blp = Blueprint("Health", __name__, description="Service health and upstream state")
+
+
+@blp.route("/health")
+class Health(MethodView):
+    def get(self):
+        """Report product upstream client, circuit breaker and catalog cache state."""
+        upstream = product_api.snapshot()
+        status = "degraded" if upstream["circuit"]["state"] != "closed" else "ok"
+        return {
+            "status": status,
+            "product_api": upstream,
+            "catalog": catalog.stats(),
+            "cart_cache": cart_cache.stats(),
+            "jobs": jobs.stats(),
+            "db_replicas": replicas.stats(),
+            "db_shards": shards.stats(),
+        }
+
+
+@blp.route("/metrics")
+class Metrics(MethodView):
+    def get(self):
+        """Expose request, SQL, DB pool and upstream metrics in Prometheus format."""
+        return metrics_response()
@@ -0,0 +1,143 @@
+import hashlib
+from datetime import datetime, timedelta
+from functools import wraps
+
+import click
+from flask import Response, current_app, request
+from flask.cli import with_appcontext
+from flask_smorest import abort
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from db import db
+from models import IdempotencyKeyModel
+
+HEADER = "Idempotency-Key"
+
+keys = IdempotencyKeyModel.__table__
+
+
+def request_fingerprint():
+    """Hash of method, path and body, so a key cannot be reused for another request."""
+    digest = hashlib.sha256(f"{request.method} {request.path}\n".encode())
+    digest.update(request.get_data())
+    return digest.hexdigest()
+
+
+def claim(key, fingerprint):
+    """
+    Record ``key`` as in progress; False when another request already holds it.
+
+    The claim commits on its own connection before the view runs, so a
+    concurrent retry sees it. It expires after ``IDEMPOTENCY_LOCK_TIMEOUT``
+    in case the process dies before storing the response.
+    """
+    now = datetime.utcnow()
+    lock_timeout = timedelta(seconds=current_app.config["IDEMPOTENCY_LOCK_TIMEOUT"])
+    try:
+        with db.engine.begin() as connection:
+            connection.execute(
+                delete(keys).where(keys.c.key == key, keys.c.expires_at <= now)
+            )
+            connection.execute(
+                insert(keys).values(
+                    key=key,
+                    fingerprint=fingerprint,
+                    status="in_progress",
+                    created_at=now,
+                    expires_at=now + lock_timeout,
+                )
+            )
+        return True
+    except IntegrityError:
+        return False
+
+
+def load(key):
+    with db.engine.connect() as connection:
+        return connection.execute(select(keys).where(keys.c.key == key)).first()
+
+
+def store(key, response):
+    ttl = timedelta(seconds=current_app.config["IDEMPOTENCY_TTL"])
+    with db.engine.begin() as connection:
+        connection.execute(
+            update(keys)
+            .where(keys.c.key == key)
+            .values(
+                status="completed",
+                response_status=response.status_code,
+                response_body=response.get_data(),
+                response_mimetype=response.mimetype,
+                expires_at=datetime.utcnow() + ttl,
+            )
+        )
+
+
+def release(key):
+    with db.engine.begin() as connection:
+        connection.execute(delete(keys).where(keys.c.key == key))
+
+
+def replay(record, fingerprint):
+    if record is None:
+        # The holder released the key between our insert and select.
+        abort(409, message="Request with this Idempotency-Key is in progress, retry")
+    if record.fingerprint != fingerprint:
+        abort(422, message="Idempotency-Key was already used for a different request")
+    if record.status != "completed":
+        abort(409, message="Request with this Idempotency-Key is in progress, retry")
+    return Response(
+        record.response_body,
+        status=record.response_status,
+        mimetype=record.response_mimetype,
+        headers={"Idempotent-Replayed": "true"},
+    )
+
+
+def idempotent(view):
+    """
+    Make a mutating endpoint safe to retry with an ``Idempotency-Key`` header.
+
+    The first request with a key runs the view and stores its response for
+    ``IDEMPOTENCY_TTL`` seconds; retries with the same key and body get
+    that response replayed instead of running the view again. Server
+    errors and aborted requests release the key so they can be retried.
+    Requests without the header are not affected.
+    """
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get(HEADER)
+        if key is None:
+            return view(*args, **kwargs)
+        if not key or len(key) > 255:
+            abort(400, message="Idempotency-Key must be 1 to 255 characters")
+
+        fingerprint = request_fingerprint()
+        if not claim(key, fingerprint):
+            return replay(load(key), fingerprint)
+
+        try:
+            response = current_app.make_response(view(*args, **kwargs))
+        except BaseException:
+            release(key)
+            raise
+        if response.status_code >= 500 or response.is_streamed:
+            release(key)
+        else:
+            store(key, response)
+        return response
+
+    return wrapper
+
+
+@click.command("purge-idempotency-keys")
+@with_appcontext
+def purge_idempotency_keys_command():
+    """Delete expired idempotency keys."""
+    with db.engine.begin() as connection:
+        deleted = connection.execute(
+            delete(keys).where(keys.c.expires_at <= datetime.utcnow())
+        ).rowcount
+    click.echo(f"Deleted {deleted} expired idempotency keys")
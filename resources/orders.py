@@ -3,12 +3,39 @@ from flask_smorest import abort, Blueprint
 from sqlalchemy.exc import SQLAlchemyError
 from db import db
 from models import OrderModel, CartModel
-from resources.schemas import OrderSchema, OrderUpdateSchema
+from models.cart import lock_cart, record_cart_changes, set_carts_status
+from resources.carts import cart_item_prices, find_stale_prices, reprice_cart_items
+from resources.idempotency import idempotent
+from resources.pagination import keyset_listing
+from resources.schemas import (
+    OrderSchema,
+    OrderUpdateSchema,
+    OrderListArgsSchema,
+    OrderTransitionSchema,
+    OrderTransitionResultSchema,
+)
+from resources.serializers import dump_order, json_response
+from services.cache import cart_cache
+from services.jobs import jobs
+from services.order_transitions import transition_by_ids, transition_matching
+from services.replicas import read_only
+from services.sharding import sharded
 from datetime import datetime
 from sqlalchemy import text
+from sqlalchemy.orm import joinedload, selectinload
 
 blp = Blueprint("Orders", __name__, description="Operations on orders")
 
+# OrderSchema dumps order.cart.items and order.items, so load both up front.
+ORDER_LOADERS = (
+    selectinload(OrderModel.cart).selectinload(CartModel.items),
+    selectinload(OrderModel.items),
+)
+SINGLE_ORDER_LOADERS = (
+    joinedload(OrderModel.cart).selectinload(CartModel.items),
+    selectinload(OrderModel.items),
+)
+
 
 def calculate_order_total(cart):
     """
@@ -21,13 +48,16 @@ def calculate_order_total(cart):
 @blp.route("/order/<int:order_id>")
 class Order(MethodView):
     @blp.response(200, OrderSchema)
+    @sharded("order_id")
     def get(self, order_id):
         """Retrieve order details with cart snapshot"""
-        order = OrderModel.query.get_or_404(order_id)
-        return order
+        order = OrderModel.query.options(*SINGLE_ORDER_LOADERS).get_or_404(order_id)
+        return json_response(dump_order(order))
 
+    @idempotent
     @blp.arguments(OrderUpdateSchema)
     @blp.response(200, OrderSchema)
+    @sharded("order_id")
     def put(self, order_data, order_id):
         """Update order status/shipping details"""
         order = OrderModel.query.get_or_404(order_id)
@@ -44,21 +74,19 @@ class Order(MethodView):
                 ).fetchone()
 
                 if cart_id and cart_id[0]:
-                    db.session.execute(
-                        text(
-                            "UPDATE carts SET status = 'inactive' WHERE id = :cart_id"
-                        ),
-                        {"cart_id": cart_id[0]},
-                    )
+                    set_carts_status(db.session, [cart_id[0]], "inactive")
         for field in ["shipping_address", "billing_address", "payment_status"]:
             if field in order_data:
                 setattr(order, field, order_data[field])
 
         order.updated_at = datetime.utcnow()
         db.session.commit()
+        cart_cache.invalidate(order.cart_id)
         return order
 
+    @idempotent
     @blp.response(204)
+    @sharded("order_id")
     def delete(self, order_id):
         """Cancel an order (if allowed)"""
         order = OrderModel.query.get_or_404(order_id)
@@ -73,16 +101,29 @@ class Order(MethodView):
 
 @blp.route("/order")
 class OrderList(MethodView):
+    @read_only
+    @blp.arguments(OrderListArgsSchema, location="query")
     @blp.response(200, OrderSchema(many=True))
-    def get(self):
-        """List all orders"""
-        return OrderModel.query.all()
+    def get(self, args):
+        """List orders, oldest first, one keyset page (or NDJSON stream) at a time"""
+        query = OrderModel.query.options(*ORDER_LOADERS)
+        return keyset_listing(query, OrderModel, args, dump_order, scatter=True)
 
+    @idempotent
     @blp.arguments(OrderSchema(exclude=["status", "payment_status"]))
     @blp.response(201, OrderSchema)
+    @sharded("cart_id")
     def post(self, order_data):
-        """Create new order from cart"""
-        cart = CartModel.query.get(order_data["cart_id"])
+        """Create new order from cart, repricing its items at current prices"""
+        # Refuse unknown and foreign carts before the Fake Store round trip;
+        # the checks below repeat under the row lock.
+        owner, prices = cart_item_prices(order_data["cart_id"])
+        if owner is None:
+            abort(404, message="Cart not found")
+        if owner.user_id != order_data["user_id"]:
+            abort(403, message="Cart does not belong to this user")
+        stale_prices = find_stale_prices(prices) if owner.status == "active" else []
+        cart = lock_cart(order_data["cart_id"])
 
         if not cart:
             abort(404, message="Cart not found")
@@ -94,18 +135,25 @@ class OrderList(MethodView):
             abort(400, message="Cart is not active for ordering")
 
         try:
+            total = reprice_cart_items(cart, stale_prices)
             order = OrderModel(
                 user_id=order_data["user_id"],
                 cart_id=cart.id,
-                total_price=calculate_order_total(cart),
+                total_price=calculate_order_total(cart) if total is None else total,
                 shipping_address=order_data.get("shipping_address"),
                 billing_address=order_data.get("billing_address"),
             )
 
             cart.status = "ordered"
+            record_cart_changes(
+                db.session, cart.id, [{"kind": "status_changed", "status": "ordered"}]
+            )
 
             db.session.add(order)
             db.session.commit()
+            cart_cache.invalidate(order_data["cart_id"])
+            jobs.enqueue("finalize_order", order_id=order.id)
+            order.repriced_items = stale_prices
             return order
 
         except SQLAlchemyError as e:
@@ -113,10 +161,39 @@ class OrderList(MethodView):
             abort(500, message="Error creating order")
 
 
+@blp.route("/order/transitions")
+class OrderTransitions(MethodView):
+    @idempotent
+    @blp.arguments(OrderTransitionSchema)
+    @blp.response(200, OrderTransitionResultSchema)
+    def post(self, data):
+        """Change the status, payment status or addresses of many orders at once"""
+        changes = {
+            field: value
+            for field, value in data.items()
+            if field not in ("order_ids", "filter")
+        }
+        if "order_ids" in data:
+            chunks = transition_by_ids(data["order_ids"], changes)
+        else:
+            chunks = transition_matching(data["filter"], changes)
+
+        result = dict.fromkeys(["updated", "rejected", "not_found"], 0)
+        orders = []
+        for outcomes in chunks:
+            for order_id, outcome in outcomes.items():
+                result[outcome] += 1
+                orders.append({"id": order_id, "outcome": outcome})
+        return {**result, "orders": orders}
+
+
 @blp.route("/user/<int:user_id>/orders")
 class UserOrders(MethodView):
+    @read_only
+    @blp.arguments(OrderListArgsSchema, location="query")
     @blp.response(200, OrderSchema(many=True))
-    def get(self, user_id):
-        """Retrieve all orders placed by a user."""
-        orders = OrderModel.query.filter_by(user_id=user_id).all()
-        return orders
+    @sharded("user_id")
+    def get(self, args, user_id):
+        """Retrieve the orders placed by a user, one keyset page at a time."""
+        query = OrderModel.query.options(*ORDER_LOADERS).filter_by(user_id=user_id)
+        return keyset_listing(query, OrderModel, args, dump_order)
@@ -0,0 +1,125 @@
+import base64
+import heapq
+from datetime import datetime
+from itertools import islice
+
+from flask import Response, stream_with_context
+from flask_smorest import abort
+from sqlalchemy import String, literal, tuple_
+from sqlalchemy.orm import Session
+
+from resources.serializers import dump_many, encode, json_response
+from services.sharding import shards
+
+MAX_PAGE_SIZE = 500
+STREAM_BATCH_SIZE = 500
+
+
+def encode_cursor(created_at, row_id):
+    raw = f"{created_at.isoformat(sep=' ')}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        created_at, row_id = base64.urlsafe_b64decode(cursor).decode().split("|")
+        return datetime.fromisoformat(created_at), int(row_id)
+    except ValueError:
+        abort(400, message="Invalid cursor")
+
+
+def filter_listing(query, model, args):
+    """Apply the equality and created_at range filters present in ``args``."""
+    for field in ("status", "payment_status"):
+        if field in args:
+            query = query.filter(getattr(model, field) == args[field])
+    if "created_from" in args:
+        query = query.filter(model.created_at >= args["created_from"])
+    if "created_to" in args:
+        query = query.filter(model.created_at < args["created_to"])
+    return query
+
+
+def keyset_listing(query, model, args, dump, scatter=False):
+    """
+    List ``query`` ordered by ``(created_at, id)``, resuming after ``cursor``.
+
+    JSON responses hold at most ``limit`` rows and carry the cursor of the
+    next page in ``X-Next-Cursor``. With ``format=ndjson`` every matching row
+    is streamed one JSON document per line from a server-side cursor.
+    Rows are serialized with ``dump`` from ``resources.serializers``.
+
+    With ``scatter`` the query runs on every shard and the sorted results
+    are merged, so each shard contributes at most ``limit + 1`` rows.
+    """
+    query = filter_listing(query, model, args).order_by(model.created_at, model.id)
+    if "cursor" in args:
+        created_at, row_id = decode_cursor(args["cursor"])
+        # Compare with the textual timestamp so SQLite matches CURRENT_TIMESTAMP.
+        query = query.filter(
+            tuple_(model.created_at, model.id)
+            > tuple_(literal(created_at.isoformat(sep=" "), String), literal(row_id))
+        )
+
+    if scatter and shards.enabled:
+        return scatter_listing(query, args, dump)
+
+    if args["format"] == "ndjson":
+        return stream_ndjson(query.yield_per(STREAM_BATCH_SIZE), dump)
+
+    limit = min(args["limit"], MAX_PAGE_SIZE)
+    return page_response(query.limit(limit + 1).all(), limit, dump)
+
+
+def page_response(rows, limit, dump):
+    """JSON page of the first ``limit`` of ``rows`` (fetched as ``limit + 1``)."""
+    headers = {}
+    if len(rows) > limit:
+        rows = rows[:limit]
+        headers["X-Next-Cursor"] = encode_cursor(rows[-1].created_at, rows[-1].id)
+    return json_response(dump_many(dump, rows), headers=headers)
+
+
+def _keyset_key(row):
+    return row.created_at, row.id
+
+
+def _stream_shard(query, name):
+    """Stream ``query`` from shard ``name`` in a session of its own."""
+    session = Session(shards.engine(name))
+    try:
+        yield from query.with_session(session).yield_per(STREAM_BATCH_SIZE)
+    finally:
+        session.close()
+
+
+def scatter_listing(query, args, dump):
+    """
+    Run ``query`` on every shard and merge the results by keyset. Each shard
+    is read in its own session: item ids are only unique within a shard, so
+    one identity map would hand one shard's items to another's orders.
+    """
+    if args["format"] == "ndjson":
+        merged = heapq.merge(
+            *(_stream_shard(query, name) for name in shards.names),
+            key=_keyset_key,
+        )
+        return stream_ndjson(merged, dump)
+
+    limit = min(args["limit"], MAX_PAGE_SIZE)
+    sessions = [Session(shards.engine(name)) for name in shards.names]
+    try:
+        pages = [query.with_session(s).limit(limit + 1).all() for s in sessions]
+        rows = list(islice(heapq.merge(*pages, key=_keyset_key), limit + 1))
+        return page_response(rows, limit, dump)
+    finally:
+        for session in sessions:
+            session.close()
+
+
+def stream_ndjson(rows, dump):
+    def generate():
+        for row in rows:
+            yield encode(dump(row)) + b"\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
@@ -1,28 +1,145 @@
+import gzip
+import hashlib
+import threading
+from datetime import datetime, timezone
+
+from flask import Response, current_app, request
 from flask.views import MethodView
 from flask_smorest import Blueprint, abort
 import requests
+from resources.schemas import ProductListArgsSchema
+from resources.serializers import encode, json_response
+from services.catalog import PREFETCHED_LISTING, catalog, prefetched
+from services.product_index import ProductIndex
+
+try:
+    import brotli
+except ImportError:  # optional, listings are then offered gzip only
+    brotli = None
 
 blp = Blueprint("Products", __name__, description="Operations on products")
 
 
 def fetch_all_products():
-    """Fetch all products from Fake Store API."""
+    """Fetch all products from Fake Store API (served from the catalog cache)."""
     try:
-        response = requests.get("https://fakestoreapi.com/products", timeout=5)
-        response.raise_for_status()
-        return response.json()
+        products = prefetched(request.environ, PREFETCHED_LISTING)
+        return catalog.get_all() if products is None else products
     except requests.Timeout:
         abort(504, message="Fake Store API timeout")
     except requests.RequestException:
         abort(500, message="Failed to fetch products from Fake Store API")
 
 
+class EncodedListing:
+    """
+    The product listing encoded once per catalog snapshot: JSON body,
+    pre-compressed variants, a strong ETag per variant and the time the
+    content last changed.
+    """
+
+    def __init__(self, products, previous=None):
+        self.bodies = {"identity": encode(products)}
+        self.bodies["gzip"] = gzip.compress(self.bodies["identity"], 6, mtime=0)
+        if brotli is not None:
+            self.bodies["br"] = brotli.compress(self.bodies["identity"])
+        self.digest = hashlib.sha256(self.bodies["identity"]).hexdigest()[:32]
+        # A refresh that returned the same catalog keeps its Last-Modified.
+        if previous is not None and previous.digest == self.digest:
+            self.last_modified = previous.last_modified
+        else:
+            self.last_modified = datetime.now(timezone.utc).replace(microsecond=0)
+
+    def negotiate(self, accept_encodings):
+        """Return ``(encoding, body, etag)`` for the best accepted encoding."""
+        for encoding in ("br", "gzip"):
+            if encoding in self.bodies and accept_encodings[encoding]:
+                return encoding, self.bodies[encoding], f"{self.digest}-{encoding}"
+        return None, self.bodies["identity"], self.digest
+
+
+class ListingCache:
+    """
+    Keeps the ``EncodedListing`` and ``ProductIndex`` of the catalog snapshot
+    last served, rebuilding both when the catalog hands out a new snapshot.
+    """
+
+    def __init__(self):
+        self._products = None
+        self._encoded = None
+        self._index = None
+        self._lock = threading.Lock()
+
+    def get(self, products):
+        """Return ``(encoded, index)`` for the ``products`` snapshot."""
+        with self._lock:
+            if products is not self._products:
+                self._encoded = EncodedListing(products, self._encoded)
+                self._index = ProductIndex(products)
+                self._products = products
+            return self._encoded, self._index
+
+
+listing_cache = ListingCache()
+
+
 @blp.route("/products")
 class ProductList(MethodView):
-    def get(self):
-        """Fetch all available products from the Fake Store API."""
+    @blp.arguments(ProductListArgsSchema, location="query")
+    def get(self, args):
+        """
+        Fetch products, optionally filtered by category, price range and text
+        (``q``), sorted (``sort=price``, ``-rating``, ...) and paginated with
+        ``limit``/``offset``. Responses carry ETag/Last-Modified for revalidation.
+        """
         products = fetch_all_products()
-        if products:
-            return products
-        else:
+        if not products:
             abort(500, message="Failed to fetch products from Fake Store API")
+
+        listing, index = listing_cache.get(products)
+        if args:
+            response = search_response(listing, index, args)
+        else:
+            encoding, body, etag = listing.negotiate(request.accept_encodings)
+            response = Response(body, mimetype="application/json")
+            if encoding:
+                response.content_encoding = encoding
+            response.vary.add("Accept-Encoding")
+            response.set_etag(etag)
+        response.last_modified = listing.last_modified
+        response.cache_control.public = True
+        response.cache_control.max_age = current_app.config["PRODUCTS_MAX_AGE"]
+        return response.make_conditional(request)
+
+
+def search_response(listing, index, args):
+    etag = hashlib.sha256(
+        f"{listing.digest}?{sorted(args.items())}".encode()
+    ).hexdigest()[:32]
+    if request.if_none_match.contains(etag):
+        # Same snapshot and query: skip the lookup, make_conditional sends 304.
+        response = Response(mimetype="application/json")
+    else:
+        offset = args.get("offset", 0)
+        total, page = index.search(
+            category=args.get("category"),
+            min_price=args.get("min_price"),
+            max_price=args.get("max_price"),
+            q=args.get("q"),
+            sort=args.get("sort", "id"),
+            offset=offset,
+            limit=args.get("limit", 50),
+        )
+        headers = {"X-Total-Count": str(total)}
+        if offset + len(page) < total:
+            headers["X-Next-Offset"] = str(offset + len(page))
+        response = json_response(page, headers=headers)
+    response.set_etag(etag)
+    return response
+
+
+@blp.route("/products/cache")
+class ProductCacheStats(MethodView):
+    def get(self):
+        """Report hit/miss/eviction counters of the product catalog cache."""
+        return catalog.stats()
@@ -1,4 +1,4 @@
-from marshmallow import Schema, fields
+from marshmallow import Schema, ValidationError, fields, post_dump, validates_schema
 
 
 class CartItemSchema(Schema):
@@ -15,6 +15,36 @@ class CartItemAddSchema(Schema):
     quantity = fields.Int(load_default=1)
 
 
+class CartItemOperationSchema(Schema):
+    product_id = fields.Int(required=True)
+    quantity = fields.Int(load_default=1, validate=lambda x: x > 0)
+    action = fields.Str(
+        load_default="add", validate=lambda x: x in ["add", "set", "remove"]
+    )
+
+
+class CartItemBatchSchema(Schema):
+    items = fields.List(
+        fields.Nested(CartItemOperationSchema()),
+        required=True,
+        validate=lambda x: 0 < len(x) <= 100,
+    )
+
+
+class CartItemResultSchema(Schema):
+    product_id = fields.Int()
+    action = fields.Str()
+    status = fields.Str()
+    quantity = fields.Int(allow_none=True)
+    subtotal = fields.Float(allow_none=True)
+
+
+class CartItemBatchResultSchema(Schema):
+    cart_id = fields.Int()
+    total_price = fields.Float()
+    items = fields.List(fields.Nested(CartItemResultSchema()))
+
+
 class PlainCartSchema(Schema):
     id = fields.Int(dump_only=True)
     user_id = fields.Int(required=True)
@@ -24,6 +54,7 @@ class PlainCartSchema(Schema):
     created_at = fields.DateTime(dump_only=True)
     updated_at = fields.DateTime(dump_only=True)
     total_price = fields.Float(dump_only=True)
+    version = fields.Int(dump_only=True)
     items = fields.List(fields.Nested(CartItemSchema()))
 
 
@@ -32,8 +63,15 @@ class CartUpdateSchema(Schema):
     items = fields.List(fields.Nested(CartItemSchema()))
 
 
+class RepricedItemSchema(Schema):
+    product_id = fields.Int()
+    old_price = fields.Float()
+    new_price = fields.Float()
+
+
 class CartSchema(PlainCartSchema):
-    pass
+    # Only on checkout responses: cart items whose price changed since added.
+    repriced_items = fields.List(fields.Nested(RepricedItemSchema()), dump_only=True)
 
 
 class PlainOrderSchema(Schema):
@@ -54,9 +92,132 @@ class PlainOrderSchema(Schema):
 class OrderSchema(PlainOrderSchema):
     cart = fields.Nested(CartSchema(), dump_only=True)
     items = fields.List(fields.Nested(CartItemSchema(), dump_only=True))
+    # Only on checkout responses: cart items whose price changed since added.
+    repriced_items = fields.List(fields.Nested(RepricedItemSchema()), dump_only=True)
 
 
 class OrderUpdateSchema(Schema):
     status = fields.Str(validate=lambda x: x in ["pending", "canceled", "approved"])
     shipping_address = fields.Str()
     billing_address = fields.Str()
+
+
+class OrderTransitionFilterSchema(Schema):
+    status = fields.Str()
+    payment_status = fields.Str()
+    created_from = fields.DateTime()
+    created_to = fields.DateTime()
+
+
+class OrderTransitionSchema(Schema):
+    order_ids = fields.List(fields.Int(), validate=lambda x: 0 < len(x) <= 10000)
+    filter = fields.Nested(OrderTransitionFilterSchema(), validate=lambda x: bool(x))
+    status = fields.Str(validate=lambda x: x in ["pending", "canceled", "approved"])
+    payment_status = fields.Str(validate=lambda x: 0 < len(x) <= 20)
+    shipping_address = fields.Str()
+    billing_address = fields.Str()
+
+    @validates_schema
+    def validate_selection(self, data, **kwargs):
+        if ("order_ids" in data) == ("filter" in data):
+            raise ValidationError("Pass either order_ids or filter.")
+        if not set(data) - {"order_ids", "filter"}:
+            raise ValidationError("Nothing to change.")
+
+
+class OrderTransitionOutcomeSchema(Schema):
+    id = fields.Int()
+    outcome = fields.Str()
+
+
+class OrderTransitionResultSchema(Schema):
+    updated = fields.Int()
+    rejected = fields.Int()
+    not_found = fields.Int()
+    orders = fields.List(fields.Nested(OrderTransitionOutcomeSchema()))
+
+
+class ListingArgsSchema(Schema):
+    limit = fields.Int(load_default=50, validate=lambda x: 0 < x <= 500)
+    cursor = fields.Str()
+    format = fields.Str(load_default="json", validate=lambda x: x in ["json", "ndjson"])
+    created_from = fields.DateTime()
+    created_to = fields.DateTime()
+
+
+class CartListArgsSchema(ListingArgsSchema):
+    status = fields.Str()
+
+
+class CartChangesArgsSchema(Schema):
+    since = fields.Int(required=True, validate=lambda x: x >= 0)
+
+
+class CartChangeSchema(Schema):
+    version = fields.Int()
+    kind = fields.Str()
+    product_id = fields.Int()
+    product_name = fields.Str()
+    product_price = fields.Float()
+    quantity = fields.Int()
+    status = fields.Str()
+
+    @post_dump
+    def drop_unset(self, data, **kwargs):
+        # Each kind sets a few fields; leave the rest out of the payload.
+        return {key: value for key, value in data.items() if value is not None}
+
+
+class CartChangesSchema(Schema):
+    cart_id = fields.Int()
+    version = fields.Int()
+    status = fields.Str()
+    total_price = fields.Float()
+    resync = fields.Bool()
+    changes = fields.List(fields.Nested(CartChangeSchema()))
+
+
+class OrderListArgsSchema(ListingArgsSchema):
+    status = fields.Str()
+    payment_status = fields.Str()
+
+
+class ProductListArgsSchema(Schema):
+    category = fields.Str()
+    min_price = fields.Float()
+    max_price = fields.Float()
+    q = fields.Str()
+    sort = fields.Str(
+        validate=lambda x: x.lstrip("-") in ["id", "price", "title", "rating"]
+    )
+    limit = fields.Int(validate=lambda x: 0 < x <= 500)
+    offset = fields.Int(validate=lambda x: x >= 0)
+
+
+class DailyRollupArgsSchema(Schema):
+    date_from = fields.Date(data_key="from")
+    date_to = fields.Date(data_key="to")
+    status = fields.Str()
+    payment_status = fields.Str()
+
+
+class DailyRollupSchema(Schema):
+    day = fields.Date()
+    status = fields.Str()
+    payment_status = fields.Str()
+    order_count = fields.Int()
+    revenue = fields.Float()
+
+
+class StatusSpendSchema(Schema):
+    order_count = fields.Int()
+    total_spent = fields.Float()
+
+
+class UserSpendSchema(Schema):
+    user_id = fields.Int()
+    order_count = fields.Int()
+    total_spent = fields.Float()
+    by_status = fields.Dict(
+        keys=fields.Str(), values=fields.Nested(StatusSpendSchema())
+    )
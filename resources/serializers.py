@@ -0,0 +1,94 @@
+"""
+Hand-written dump functions for the read endpoints.
+
+They produce exactly what ``CartSchema``, ``CartItemSchema`` and
+``OrderSchema`` dump, without marshmallow's per-field dispatch, and encode
+with orjson. ``OrderSchema`` dumps every item twice (under ``cart.items`` and
+``items``); here each item is converted once per response and reused.
+The schemas stay on the endpoints for validation and the API docs, so keep
+both in sync when a field changes (``bench/bench_serialization.py`` checks).
+"""
+
+import orjson
+from flask import Response
+
+
+def _float(value):
+    return None if value is None else float(value)
+
+
+def _datetime(value):
+    return None if value is None else value.isoformat()
+
+
+def dump_cart_item(item):
+    return {
+        "id": item.id,
+        "product_id": item.product_id,
+        "product_name": item.product_name,
+        "product_price": _float(item.product_price),
+        "quantity": item.quantity,
+        "subtotal": _float(item.subtotal),
+    }
+
+
+def _dump_items(items, seen):
+    # Keyed by the item object: ids repeat across shards of one listing.
+    dumped = []
+    for item in items:
+        data = seen.get(item)
+        if data is None:
+            data = seen[item] = dump_cart_item(item)
+        dumped.append(data)
+    return dumped
+
+
+def dump_cart(cart, seen=None):
+    return {
+        "id": cart.id,
+        "user_id": cart.user_id,
+        "status": cart.status,
+        "created_at": _datetime(cart.created_at),
+        "updated_at": _datetime(cart.updated_at),
+        "total_price": _float(cart.total_price),
+        "version": cart.version,
+        "items": _dump_items(cart.items, {} if seen is None else seen),
+    }
+
+
+def dump_order(order, seen=None):
+    seen = {} if seen is None else seen
+    cart = order.cart
+    return {
+        "id": order.id,
+        "user_id": order.user_id,
+        "cart_id": order.cart_id,
+        "status": order.status,
+        "created_at": _datetime(order.created_at),
+        "updated_at": _datetime(order.updated_at),
+        "total_price": _float(order.total_price),
+        "shipping_address": order.shipping_address,
+        "billing_address": order.billing_address,
+        "payment_status": order.payment_status,
+        "cart": None if cart is None else dump_cart(cart, seen),
+        "items": _dump_items(order.items, seen),
+    }
+
+
+def dump_many(dump, rows):
+    seen = {}
+    return [dump(row, seen) for row in rows]
+
+
+def encode(data):
+    # Same key order as Flask's JSON provider, which sorts keys.
+    return orjson.dumps(data, option=orjson.OPT_SORT_KEYS)
+
+
+def json_response(data, status=200, headers=None):
+    return Response(
+        encode(data) + b"\n",
+        status=status,
+        headers=headers,
+        mimetype="application/json",
+    )
@@ -0,0 +1,190 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class LocalCache:
+    """
+    Thread-safe in-process LRU of byte strings with a per-entry TTL.
+
+    Each gunicorn worker holds its own copy, so invalidations only reach the
+    worker that made them. ``CartCache`` checks every entry against the
+    database and stays correct anyway; ``RedisCache`` shares one copy (and
+    its hit rate) between several workers or containers.
+    """
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisCache:
+    """
+    Same interface as ``LocalCache`` on a Redis (or Redis protocol) server,
+    shared by every worker. Needs the ``redis`` package.
+    """
+
+    def __init__(self, url, prefix="pucapp:"):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self.prefix + key, value, ex=ttl or None)
+
+    def delete(self, *keys):
+        if keys:
+            self.client.delete(*(self.prefix + key for key in keys))
+
+    def clear(self):
+        keys = list(self.client.scan_iter(f"{self.prefix}*"))
+        if keys:
+            self.client.delete(*keys)
+
+    def __len__(self):
+        return sum(1 for _ in self.client.scan_iter(f"{self.prefix}*"))
+
+
+def make_backend(url, max_size):
+    """``LocalCache`` for an empty ``url``, ``RedisCache`` for ``redis://`` URLs."""
+    if not url:
+        return LocalCache(max_size)
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisCache(url)
+    raise ValueError(f"Unsupported cache URL: {url}")
+
+
+class CartCache:
+    """
+    Serialized ``GET /cart/<id>`` payloads keyed by cart id, each stored
+    with the ``carts.version`` it was dumped at.
+
+    Every cart write bumps the version, so readers pass the current one and
+    an entry of any other version is a miss. That holds across workers and
+    backends: a worker never serves a cart that another one changed, and a
+    slow reader storing an older payload only costs the next reader a miss.
+    ``invalidate`` frees the entries of written carts early.
+
+    Each process also remembers the version it last read per cart for
+    ``version_ttl`` seconds, so revalidating pollers get their 304 without
+    a query. Only that hint can be behind another worker's write, by at
+    most ``version_ttl``; this worker's own writes drop it.
+    """
+
+    def __init__(self, ttl=300, backend=None, version_ttl=1.0):
+        self.ttl = ttl
+        self.backend = backend or LocalCache()
+        self.version_ttl = version_ttl
+        self._versions = LocalCache()
+        self._lock = threading.Lock()
+        self._counters = dict.fromkeys(
+            ["hits", "misses", "stale", "invalidations", "version_hints"], 0
+        )
+
+    def init_app(self, app):
+        self.ttl = app.config["CART_CACHE_TTL"]
+        self.backend = make_backend(
+            app.config["CART_CACHE_URL"], app.config["CART_CACHE_MAX_SIZE"]
+        )
+        self.version_ttl = app.config["CART_VERSION_HINT_TTL"]
+        self._versions = LocalCache(app.config["CART_CACHE_MAX_SIZE"])
+
+    def recent_version(self, cart_id):
+        """The version this process read for the cart in the last ``version_ttl`` seconds."""
+        if not self.version_ttl:
+            return None
+        version = self._versions.get(cart_id)
+        if version is not None:
+            self._count("version_hints")
+        return version
+
+    def note_version(self, cart_id, version):
+        if self.version_ttl:
+            self._versions.set(cart_id, version, ttl=self.version_ttl)
+
+    def get(self, cart_id, version):
+        """Return the cached body of the cart at ``version``, or None."""
+        if not self.ttl:
+            return None
+        value = self.backend.get(f"cart:{cart_id}")
+        if not value:
+            self._count("misses")
+            return None
+        cached_version, body = value.split(b"\n", 1)
+        if int(cached_version) != version:
+            self._count("stale")
+            return None
+        self._count("hits")
+        return body
+
+    def store(self, cart_id, version, body):
+        """Cache ``body`` as the payload of the cart at ``version``."""
+        if self.ttl:
+            self.backend.set(
+                f"cart:{cart_id}", str(version).encode() + b"\n" + body, ttl=self.ttl
+            )
+        return body
+
+    def invalidate(self, *cart_ids):
+        cart_ids = [cart_id for cart_id in cart_ids if cart_id is not None]
+        if not cart_ids:
+            return
+        self._count("invalidations", len(cart_ids))
+        self._versions.delete(*cart_ids)
+        self.backend.delete(*(f"cart:{cart_id}" for cart_id in cart_ids))
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self._counters,
+                "backend": type(self.backend).__name__,
+                "ttl": self.ttl,
+                "version_ttl": self.version_ttl,
+            }
+
+    def _count(self, key, value=1):
+        with self._lock:
+            self._counters[key] += value
+
+
+cart_cache = CartCache()
@@ -0,0 +1,210 @@
+import time
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import bindparam, text
+
+from db import db
+from services.cache import cart_cache
+from services.jobs import jobs
+from services.sharding import shards
+
+# Carts idle since ``cutoff`` that no order references. Used to find a
+# batch (keyset over id) and again, under lock, right before deleting it.
+IDLE_CART = """
+    carts.status IN :statuses
+    AND COALESCE(carts.updated_at, carts.created_at) < :cutoff
+    AND NOT EXISTS (SELECT 1 FROM orders WHERE orders.cart_id = carts.id)
+"""
+
+FIND_BATCH = text(
+    f"""
+    SELECT id FROM carts
+    WHERE id > :after_id AND {IDLE_CART}
+    ORDER BY id
+    LIMIT :batch_size
+    """
+).bindparams(bindparam("statuses", expanding=True))
+
+
+def _recheck_batch(suffix=""):
+    return text(
+        f"SELECT id FROM carts WHERE id IN :cart_ids AND {IDLE_CART}{suffix}"
+    ).bindparams(
+        bindparam("statuses", expanding=True), bindparam("cart_ids", expanding=True)
+    )
+
+
+RECHECK_BATCH = _recheck_batch()
+LOCK_BATCH = _recheck_batch(" FOR UPDATE")
+
+DELETE_ITEMS = text("DELETE FROM cart_items WHERE cart_id IN :cart_ids").bindparams(
+    bindparam("cart_ids", expanding=True)
+)
+
+DELETE_CHANGES = text("DELETE FROM cart_changes WHERE cart_id IN :cart_ids").bindparams(
+    bindparam("cart_ids", expanding=True)
+)
+
+DELETE_CARTS = text("DELETE FROM carts WHERE id IN :cart_ids").bindparams(
+    bindparam("cart_ids", expanding=True)
+)
+
+
+def sweep_carts(idle_days, batch_size, statuses, dry_run=False, pause=0.0):
+    """
+    Delete carts in ``statuses`` idle for more than ``idle_days`` days, with
+    their items, one batch of at most ``batch_size`` carts per transaction.
+
+    Yields one report per batch, shard after shard. Each batch re-checks its
+    carts under a row lock before deleting, so a cart touched or ordered
+    meanwhile survives.
+    """
+    params = {
+        "statuses": list(statuses),
+        "cutoff": datetime.utcnow() - timedelta(days=idle_days),
+        "batch_size": batch_size,
+    }
+    for _ in shards.each():
+        yield from _sweep_shard({**params, "after_id": 0}, dry_run, pause)
+
+
+def _sweep_shard(params, dry_run, pause):
+    while True:
+        started = time.perf_counter()
+        candidates = [
+            row[0] for row in db.session.execute(FIND_BATCH, params).fetchall()
+        ]
+        if not candidates:
+            db.session.rollback()
+            return
+        params["after_id"] = candidates[-1]
+
+        recheck = LOCK_BATCH
+        if db.session.get_bind().dialect.name == "sqlite":
+            # No row locks in SQLite: take the write lock before re-checking.
+            recheck = RECHECK_BATCH
+            if not dry_run:
+                db.session.execute(text("DELETE FROM carts WHERE 0"))
+        cart_ids = [
+            row[0]
+            for row in db.session.execute(
+                recheck, {**params, "cart_ids": candidates}
+            ).fetchall()
+        ]
+        items = carts = 0
+        if cart_ids and not dry_run:
+            items = db.session.execute(DELETE_ITEMS, {"cart_ids": cart_ids}).rowcount
+            db.session.execute(DELETE_CHANGES, {"cart_ids": cart_ids})
+            carts = db.session.execute(DELETE_CARTS, {"cart_ids": cart_ids}).rowcount
+            db.session.commit()
+            cart_cache.invalidate(*cart_ids)
+        else:
+            db.session.rollback()
+
+        yield {
+            "first_id": candidates[0],
+            "last_id": candidates[-1],
+            "matched": len(cart_ids),
+            "carts_deleted": carts,
+            "items_deleted": items,
+            "ms": round((time.perf_counter() - started) * 1000, 1),
+        }
+        if pause:
+            time.sleep(pause)
+
+
+@jobs.task("sweep_abandoned_carts")
+def sweep_abandoned_carts():
+    """Scheduled run of ``sweep_carts`` with the configured retention policy."""
+    config = current_app.config
+    totals = {"batches": 0, "carts_deleted": 0, "items_deleted": 0}
+    for batch in sweep_carts(
+        config["CART_RETENTION_DAYS"],
+        config["CART_SWEEP_BATCH_SIZE"],
+        config["CART_SWEEP_STATUSES"],
+        pause=config["CART_SWEEP_PAUSE"],
+    ):
+        totals["batches"] += 1
+        totals["carts_deleted"] += batch["carts_deleted"]
+        totals["items_deleted"] += batch["items_deleted"]
+    return totals
+
+
+# Log entries more than ``retain`` versions behind their cart. Clients
+# polling from before them are told to resync from a full cart.
+COMPACT_CHANGES = text(
+    """
+    DELETE FROM cart_changes WHERE id IN (
+        SELECT cart_changes.id FROM cart_changes
+        JOIN carts ON carts.id = cart_changes.cart_id
+        WHERE cart_changes.version <= carts.version - :retain
+        LIMIT :batch_size
+    )
+    """
+)
+
+
+def compact_cart_changes(retain, batch_size):
+    """
+    Trim every cart's change log to its last ``retain`` entries, at most
+    ``batch_size`` rows per transaction. Returns the number of rows deleted.
+    """
+    deleted = 0
+    for _ in shards.each():
+        while True:
+            count = db.session.execute(
+                COMPACT_CHANGES, {"retain": retain, "batch_size": batch_size}
+            ).rowcount
+            db.session.commit()
+            deleted += count
+            if count < batch_size:
+                break
+    return deleted
+
+
+@jobs.task("compact_cart_changes")
+def compact_cart_changes_job():
+    """Scheduled run of ``compact_cart_changes`` with the configured retention."""
+    config = current_app.config
+    deleted = compact_cart_changes(
+        config["CART_CHANGES_RETAIN"], config["CART_SWEEP_BATCH_SIZE"]
+    )
+    return {"changes_deleted": deleted}
+
+
+@click.command("sweep-carts")
+@click.option("--idle-days", type=float, help="Defaults to CART_RETENTION_DAYS.")
+@click.option("--batch-size", type=int, help="Defaults to CART_SWEEP_BATCH_SIZE.")
+@click.option(
+    "--status",
+    "statuses",
+    multiple=True,
+    help="Cart status to sweep, repeatable. Defaults to CART_SWEEP_STATUSES.",
+)
+@click.option("--pause", type=float, help="Seconds to sleep between batches.")
+@click.option("--dry-run", is_flag=True, help="Only report what would be deleted.")
+@with_appcontext
+def sweep_carts_command(idle_days, batch_size, statuses, pause, dry_run):
+    """Delete idle carts that no order references, in small batches."""
+    config = current_app.config
+    totals = {"carts_deleted": 0, "items_deleted": 0, "matched": 0}
+    for batch in sweep_carts(
+        config["CART_RETENTION_DAYS"] if idle_days is None else idle_days,
+        batch_size or config["CART_SWEEP_BATCH_SIZE"],
+        statuses or config["CART_SWEEP_STATUSES"],
+        dry_run=dry_run,
+        pause=config["CART_SWEEP_PAUSE"] if pause is None else pause,
+    ):
+        for key in totals:
+            totals[key] += batch[key]
+        click.echo(
+            f"carts {batch['first_id']}-{batch['last_id']}: matched {batch['matched']},"
+            f" deleted {batch['carts_deleted']} carts and"
+            f" {batch['items_deleted']} items in {batch['ms']} ms"
+        )
+    verb = "Would delete" if dry_run else "Deleted"
+    count = totals["matched"] if dry_run else totals["carts_deleted"]
+    click.echo(f"{verb} {count} carts and {totals['items_deleted']} items")
@@ -0,0 +1,266 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from services.upstream import product_api
+
+logger = logging.getLogger(__name__)
+
+# WSGI environ keys under which the asyncio front end (``async_app``) hands
+# what it already fetched for a request to the sync views.
+PREFETCHED_PRODUCTS = "shopping.prefetched_products"
+PREFETCHED_LISTING = "shopping.prefetched_listing"
+
+
+def fetch_product(product_id):
+    """Fetch a single product from the Fake Store API (None if unknown)."""
+    return product_api.get_json(f"/products/{product_id}") or None
+
+
+def fetch_products():
+    """Fetch the full product listing from the Fake Store API."""
+    return product_api.get_json("/products")
+
+
+def prefetched(environ, key):
+    """
+    What the front end fetched under ``key`` for this request, or None when
+    it did not run; raises the upstream error it got instead.
+    """
+    value = environ.get(key)
+    if isinstance(value, Exception):
+        raise value
+    return value
+
+
+class ProductCatalog:
+    """
+    In-process cache of Fake Store products keyed by product id.
+
+    Entries younger than ``ttl`` are served as hits. Entries older than
+    ``ttl`` but younger than ``ttl + stale_ttl`` are served immediately while
+    a background thread refreshes them (stale-while-revalidate). Anything
+    older is refetched synchronously. The cache holds at most ``max_size``
+    products and evicts the least recently used one when full.
+    """
+
+    def __init__(
+        self,
+        ttl=300,
+        stale_ttl=3600,
+        max_size=1000,
+        product_loader=fetch_product,
+        listing_loader=fetch_products,
+    ):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_size = max_size
+        self.product_loader = product_loader
+        self.listing_loader = listing_loader
+        self._entries = OrderedDict()
+        self._listing = None
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._counters = dict.fromkeys(
+            [
+                "hits",
+                "stale_hits",
+                "misses",
+                "evictions",
+                "refreshes",
+                "refresh_errors",
+            ],
+            0,
+        )
+
+    def init_app(self, app):
+        self.ttl = app.config["CATALOG_TTL"]
+        self.stale_ttl = app.config["CATALOG_STALE_TTL"]
+        self.max_size = app.config["CATALOG_MAX_SIZE"]
+        self.clear()
+
+    def get_product(self, product_id):
+        """Return the product dict for ``product_id`` or None if it does not exist."""
+        product, state = self._lookup(product_id)
+        if state == "fresh":
+            return product
+        if state == "stale":
+            self._refresh_in_background(product_id, self._reload_product, product_id)
+            return product
+        return self._reload_product(product_id)
+
+    def get_many(self, product_ids, max_age=None):
+        """
+        Resolve several products at once as a ``{product_id: product}`` dict.
+
+        Cached entries are used as-is; a single miss is fetched on its own,
+        while several misses are filled from one listing fetch. Unknown ids
+        map to None. With ``max_age`` (seconds) entries fetched longer ago
+        count as misses and no stale entry is served, so ``max_age=0``
+        always reads the products from the upstream.
+        """
+        products, missing = self._cached(product_ids, max_age)
+        if len(missing) == 1:
+            products[missing[0]] = self._reload_product(missing[0])
+        elif missing:
+            listing = {p["id"]: p for p in self._reload_listing() or []}
+            products.update((pid, listing.get(pid)) for pid in missing)
+        return products
+
+    async def get_many_async(self, product_ids, client):
+        """
+        ``get_many`` for asyncio callers: every miss is fetched on its own,
+        all of them concurrently, with ``client`` (an
+        ``AsyncProductAPIClient``).
+        """
+        products, missing = self._cached(product_ids)
+        if missing:
+            fetched = await client.get_many(missing)
+            now = time.monotonic()
+            with self._lock:
+                for product_id, product in fetched.items():
+                    if product:
+                        self._store(product_id, product, now)
+            products.update(fetched)
+        return products
+
+    def get_all(self):
+        """Return the full product listing, filling the per-product entries too."""
+        with self._lock:
+            listing = self._listing
+            state = self._state(listing[1]) if listing else "missing"
+            self._count(state)
+        if state == "fresh":
+            return listing[0]
+        if state == "stale":
+            self._refresh_in_background("__listing__", self._reload_listing)
+            return listing[0]
+        return self._reload_listing()
+
+    async def get_all_async(self, client):
+        """``get_all`` for asyncio callers, fetching a miss with ``client``."""
+        with self._lock:
+            listing = self._listing
+            state = self._state(listing[1]) if listing else "missing"
+            self._count(state)
+        if state == "stale":
+            self._refresh_in_background("__listing__", self._reload_listing)
+        if state in ("fresh", "stale"):
+            return listing[0]
+        products = await client.get_json("/products")
+        self._store_listing(products)
+        return products
+
+    def stats(self):
+        with self._lock:
+            listing_age = (
+                round(time.monotonic() - self._listing[1], 3) if self._listing else None
+            )
+            return {
+                **self._counters,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "stale_ttl": self.stale_ttl,
+                "listing_age": listing_age,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._listing = None
+
+    def _cached(self, product_ids, max_age=None):
+        """
+        Split ``product_ids`` into ``({product_id: product}, missing)``,
+        refreshing stale entries in the background.
+        """
+        products = {}
+        missing = []
+        for product_id in dict.fromkeys(product_ids):
+            product, state = self._lookup(product_id, max_age)
+            if state == "stale":
+                self._refresh_in_background(
+                    product_id, self._reload_product, product_id
+                )
+            if state in ("fresh", "stale"):
+                products[product_id] = product
+            else:
+                missing.append(product_id)
+        return products, missing
+
+    def _lookup(self, product_id, max_age=None):
+        with self._lock:
+            entry = self._entries.get(product_id)
+            state = self._state(entry[1], max_age) if entry else "missing"
+            self._count(state)
+            if state == "expired":
+                del self._entries[product_id]
+            elif entry:
+                self._entries.move_to_end(product_id)
+            return (entry[0] if entry else None), state
+
+    def _state(self, fetched_at, max_age=None):
+        age = time.monotonic() - fetched_at
+        if max_age is not None and age >= max_age:
+            return "outdated"
+        if age < self.ttl:
+            return "fresh"
+        if age < self.ttl + self.stale_ttl:
+            return "stale"
+        return "expired"
+
+    def _count(self, state):
+        key = {"fresh": "hits", "stale": "stale_hits"}.get(state, "misses")
+        self._counters[key] += 1
+
+    def _reload_product(self, product_id):
+        product = self.product_loader(product_id)
+        if product:
+            with self._lock:
+                self._store(product_id, product, time.monotonic())
+        return product
+
+    def _reload_listing(self):
+        products = self.listing_loader()
+        self._store_listing(products)
+        return products
+
+    def _store_listing(self, products):
+        now = time.monotonic()
+        with self._lock:
+            self._listing = (products, now)
+            for product in products or []:
+                self._store(product["id"], product, now)
+
+    def _store(self, product_id, product, fetched_at):
+        self._entries[product_id] = (product, fetched_at)
+        self._entries.move_to_end(product_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self._counters["evictions"] += 1
+
+    def _refresh_in_background(self, key, loader, *args):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def run():
+            try:
+                loader(*args)
+                with self._lock:
+                    self._counters["refreshes"] += 1
+            except Exception:
+                logger.exception("Background refresh of %s failed", key)
+                with self._lock:
+                    self._counters["refresh_errors"] += 1
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=run, daemon=True).start()
+
+
+catalog = ProductCatalog()
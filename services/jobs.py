@@ -0,0 +1,243 @@
+import logging
+import os
+import queue
+import threading
+import time
+
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+logger = logging.getLogger(__name__)
+
+
+class LocalQueue:
+    """
+    In-process FIFO of jobs. Jobs live in the worker's memory only: those
+    still queued when the worker exits (gunicorn's ``max_requests``
+    recycling, a deploy) are dropped.
+
+    A job is a plain dict (``{"name": ..., "kwargs": {...}}``), so a queue
+    backed by a local broker only has to provide the same ``put`` and
+    ``get(timeout)`` (returning None when nothing arrived) to replace it.
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+
+    def put(self, job):
+        self._queue.put(job)
+
+    def get(self, timeout):
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def qsize(self):
+        return self._queue.qsize()
+
+
+class AdvisoryLeader:
+    """
+    Leadership over the periodic jobs, shared by every process that talks
+    to one PostgreSQL database.
+
+    The leader holds a session-level ``pg_try_advisory_lock`` on a connection
+    of its own, so the lock goes away with the process and the next worker
+    to check takes over. ``lead`` is called before each periodic run; on
+    other databases there is nobody to coordinate with and it always leads.
+    """
+
+    LOCK_KEY = 0x6A6F6273  # "jobs"
+
+    def __init__(self, engine):
+        self.engine = engine
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def lead(self):
+        if self.engine.dialect.name != "postgresql":
+            return True
+        with self._lock:
+            if self._connection is not None:
+                try:
+                    self._connection.execute(text("SELECT 1"))
+                    self._connection.commit()
+                    return True
+                except DBAPIError:
+                    logger.warning("Lost the periodic job leader lock")
+                    self._release()
+            connection = self.engine.connect()
+            try:
+                leading = connection.execute(
+                    text("SELECT pg_try_advisory_lock(:key)"), {"key": self.LOCK_KEY}
+                ).scalar()
+                connection.commit()
+            except Exception:
+                connection.invalidate()
+                connection.close()
+                raise
+            if not leading:
+                connection.close()
+                return False
+            self._connection = connection
+            return True
+
+    def is_leader(self):
+        if self.engine.dialect.name != "postgresql":
+            return True
+        with self._lock:
+            return self._connection is not None
+
+    def _release(self):
+        # Never hand a connection holding the lock back to the pool.
+        self._connection.invalidate()
+        self._connection.close()
+        self._connection = None
+
+
+class JobRunner:
+    """
+    Background worker threads running registered jobs in an app context.
+
+    ``enqueue`` returns immediately; ``JOB_WORKERS`` threads per process take
+    jobs off the queue. ``every`` registers periodic jobs that a scheduler
+    thread enqueues. Threads start lazily and again in every forked gunicorn
+    worker, but only the process holding the ``leader`` lock enqueues the
+    periodic jobs; the others skip their turn. With ``JOB_WORKERS=0`` jobs
+    run inline when enqueued, which keeps scripts and benchmarks
+    deterministic.
+    """
+
+    def __init__(self, workers=2, job_queue=None):
+        self.workers = workers
+        self.queue = job_queue or LocalQueue()
+        self.app = None
+        self.leader = None
+        self._handlers = {}
+        self._periodic = {}
+        self._pid = None
+        self._lock = threading.Lock()
+        self._counters = dict.fromkeys(["enqueued", "done", "failed", "skipped"], 0)
+
+    def init_app(self, app, engine=None):
+        """``engine`` is the database whose advisory lock elects the leader."""
+        self.app = app
+        self.workers = app.config["JOB_WORKERS"]
+        self.leader = AdvisoryLeader(engine) if engine is not None else None
+        app.before_request(self.start)
+
+    def task(self, name):
+        """Register the decorated function as the handler of job ``name``."""
+
+        def register(func):
+            self._handlers[name] = func
+            return func
+
+        return register
+
+    def every(self, name, interval):
+        """Enqueue job ``name`` every ``interval`` seconds (0 disables it)."""
+        if interval:
+            self._periodic[name] = interval
+        else:
+            self._periodic.pop(name, None)
+
+    def enqueue(self, name, **kwargs):
+        if name not in self._handlers:
+            raise KeyError(f"Unknown job {name}")
+        self._count("enqueued")
+        job = {"name": name, "kwargs": kwargs, "enqueued_at": time.time()}
+        if not self.workers:
+            self.run(job)
+            return
+        self.start()
+        self.queue.put(job)
+
+    def run(self, job):
+        """Run one job in an app context; failures are logged, not raised."""
+        started = time.perf_counter()
+        try:
+            with self.app.app_context():
+                result = self._handlers[job["name"]](**job["kwargs"])
+        except Exception:
+            self._count("failed")
+            logger.exception("Job %s failed", job["name"])
+            return None
+        self._count("done")
+        logger.info(
+            "Job %s finished in %.1f ms: %s",
+            job["name"],
+            (time.perf_counter() - started) * 1000,
+            result,
+        )
+        return result
+
+    def start(self):
+        if not self.workers or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            for i in range(self.workers):
+                threading.Thread(
+                    target=self._work, name=f"job-worker-{i}", daemon=True
+                ).start()
+            if self._periodic:
+                threading.Thread(
+                    target=self._schedule, name="job-scheduler", daemon=True
+                ).start()
+
+    def _work(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            job = self.queue.get(timeout=1)
+            if job is not None:
+                self.run(job)
+
+    def _schedule(self):
+        pid = os.getpid()
+        due = {
+            name: time.monotonic() + interval
+            for name, interval in self._periodic.items()
+        }
+        while self._pid == pid:
+            now = time.monotonic()
+            ready = [name for name, at in due.items() if at <= now]
+            if ready and self._leading():
+                for name in ready:
+                    self.enqueue(name)
+            else:
+                for name in ready:
+                    self._count("skipped")
+            for name in ready:
+                due[name] = now + self._periodic[name]
+            time.sleep(min(1.0, max(0.0, min(due.values()) - now)))
+
+    def _leading(self):
+        if self.leader is None:
+            return True
+        try:
+            return self.leader.lead()
+        except Exception:
+            logger.exception("Periodic job leader election failed")
+            return False
+
+    def _count(self, key):
+        with self._lock:
+            self._counters[key] += 1
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+        return {
+            **counters,
+            "workers": self.workers,
+            "queued": self.queue.qsize() if hasattr(self.queue, "qsize") else None,
+            "periodic": dict(self._periodic),
+            "leader": self.leader.is_leader() if self.leader else None,
+        }
+
+
+jobs = JobRunner()
@@ -0,0 +1,343 @@
+import cProfile
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from flask import Response, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+
+
+class Metrics:
+    """
+    Process-local registry of counters, histograms and gauges rendered in the
+    Prometheus text format.
+
+    Every gunicorn worker keeps its own registry, so a scrape reports the
+    worker that served it; aggregate across workers on the Prometheus side.
+    """
+
+    def __init__(self):
+        self._meta = {}
+        self._counters = {}
+        self._histograms = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name, help):
+        self._meta.setdefault(name, ("counter", help, None))
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS):
+        self._meta.setdefault(name, ("histogram", help, tuple(buckets)))
+
+    def gauge(self, name, help, collect):
+        """Register a gauge whose ``collect()`` returns ``{labels: value}``."""
+        self._meta.setdefault(name, ("gauge", help, None))
+        self._gauges[name] = collect
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        buckets = self._meta[name][2]
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            series = self._histograms.get(key)
+            if series is None:
+                series = self._histograms[key] = [[0] * (len(buckets) + 1), 0.0, 0]
+            series[0][bisect_left(buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def render(self):
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {
+                key: (list(counts), total, count)
+                for key, (counts, total, count) in self._histograms.items()
+            }
+        lines = []
+        for name, (kind, help, buckets) in self._meta.items():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == "counter":
+                for (series, labels), value in counters.items():
+                    if series == name:
+                        lines.append(f"{name}{_labels(labels)} {value}")
+            elif kind == "gauge":
+                try:
+                    values = self._gauges[name]()
+                except Exception:
+                    logger.exception("Collecting gauge %s failed", name)
+                    values = {}
+                for labels, value in values.items():
+                    lines.append(f"{name}{_labels(labels)} {value}")
+            else:
+                for (series, labels), (counts, total, count) in histograms.items():
+                    if series != name:
+                        continue
+                    cumulative = 0
+                    for bound, bucket_count in zip(buckets + ("+Inf",), counts):
+                        cumulative += bucket_count
+                        le = labels + (("le", bound),)
+                        lines.append(f"{name}_bucket{_labels(le)} {cumulative}")
+                    lines.append(f"{name}_sum{_labels(labels)} {round(total, 6)}")
+                    lines.append(f"{name}_count{_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(f'{key}="{_escape(value)}"' for key, value in labels)
+    return "{" + pairs + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+metrics = Metrics()
+
+metrics.histogram(
+    "http_request_duration_seconds", "Request latency by route, method and status."
+)
+metrics.histogram(
+    "http_request_sql_statements",
+    "SQL statements issued per request, by route.",
+    COUNT_BUCKETS,
+)
+metrics.histogram(
+    "http_request_sql_seconds", "Time spent in SQL statements per request, by route."
+)
+metrics.histogram(
+    "http_request_upstream_seconds",
+    "Time a request blocked on the product API, by route.",
+)
+metrics.histogram("db_statement_duration_seconds", "SQL statement latency by verb.")
+metrics.histogram(
+    "db_pool_checkout_wait_seconds", "Time spent waiting for a pooled DB connection."
+)
+metrics.histogram(
+    "upstream_request_duration_seconds",
+    "Product API call latency by outcome.",
+)
+metrics.counter(
+    "upstream_requests_total",
+    "Product API calls by status code or error kind.",
+)
+metrics.counter("profiled_requests_total", "Slow requests dumped by the profiler.")
+metrics.counter(
+    "unprofiled_requests_total", "Requests not profiled as another one was."
+)
+
+
+def add_request_time(kind, seconds, statements=0):
+    """Add ``seconds`` of ``kind`` ("sql" or "upstream") to the current request."""
+    if not has_request_context() or "_metrics" not in g:
+        return
+    timings = g._metrics
+    timings[kind] += seconds
+    timings["statements"] += statements
+
+
+def record_upstream(outcome, seconds):
+    metrics.inc("upstream_requests_total", status=outcome)
+    metrics.observe("upstream_request_duration_seconds", seconds, status=outcome)
+
+
+class TimedQueuePool(QueuePool):
+    """``QueuePool`` that records how long each checkout waited for a connection."""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            metrics.observe(
+                "db_pool_checkout_wait_seconds", time.perf_counter() - start
+            )
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _start_statement(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("statement_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _end_statement(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get("statement_start")
+    if not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    verb = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "?"
+    metrics.observe("db_statement_duration_seconds", elapsed, verb=verb)
+    add_request_time("sql", elapsed, statements=1)
+
+
+@event.listens_for(Engine, "handle_error")
+def _fail_statement(context):
+    started = (
+        context.connection.info.get("statement_start") if context.connection else None
+    )
+    if started:
+        started.pop()
+
+
+def _pool_gauges(engines):
+    def collect():
+        values = {}
+        for bind, engine in engines().items():
+            pool = engine.pool
+            labels = (("bind", bind or "default"),)
+            if hasattr(pool, "checkedout"):
+                values[labels + (("state", "checked_out"),)] = pool.checkedout()
+            if hasattr(pool, "checkedin"):
+                values[labels + (("state", "idle"),)] = pool.checkedin()
+        return values
+
+    return collect
+
+
+class RequestInstrumentation:
+    """
+    Times every request and breaks it down into SQL and upstream time.
+
+    Adds a ``Server-Timing`` header so the breakdown shows up in browser dev
+    tools and load-test output. With ``PROFILE_SLOW_REQUESTS_MS`` set,
+    requests run under cProfile and those slower than the threshold get
+    their stats written to ``PROFILE_DIR``. Only one profiler can be active
+    per process (Python 3.12 raises otherwise), so a request that starts
+    while another is profiled runs unprofiled.
+    """
+
+    def init_app(self, app, engines):
+        self.profile_threshold = app.config["PROFILE_SLOW_REQUESTS_MS"]
+        self.profile_dir = app.config["PROFILE_DIR"]
+        self._profile_lock = threading.Lock()
+        metrics.gauge(
+            "db_pool_connections",
+            "Pooled DB connections by state.",
+            _pool_gauges(engines),
+        )
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.teardown_request(self._stop_profiler)
+
+    def _start(self):
+        g._metrics = {
+            "start": time.perf_counter(),
+            "sql": 0.0,
+            "statements": 0,
+            "upstream": 0.0,
+        }
+        if self.profile_threshold:
+            self._start_profiler()
+
+    def _start_profiler(self):
+        if not self._profile_lock.acquire(blocking=False):
+            metrics.inc("unprofiled_requests_total")
+            return
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Some other profiling tool (a debugger, coverage) is active.
+            self._profile_lock.release()
+            metrics.inc("unprofiled_requests_total")
+            return
+        g._profiler = profiler
+
+    def _stop_profiler(self, exc=None):
+        profiler = g.pop("_profiler", None)
+        if profiler is not None:
+            profiler.disable()
+            self._profile_lock.release()
+        return profiler
+
+    def _finish(self, response):
+        timings = g.pop("_metrics", None)
+        if timings is None:
+            return response
+        elapsed = time.perf_counter() - timings["start"]
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+
+        metrics.observe(
+            "http_request_duration_seconds",
+            elapsed,
+            route=route,
+            method=request.method,
+            status=response.status_code,
+        )
+        metrics.observe(
+            "http_request_sql_statements", timings["statements"], route=route
+        )
+        metrics.observe("http_request_sql_seconds", timings["sql"], route=route)
+        metrics.observe(
+            "http_request_upstream_seconds", timings["upstream"], route=route
+        )
+        response.headers["Server-Timing"] = (
+            f'db;dur={timings["sql"] * 1000:.1f};desc="{timings["statements"]} queries", '
+            f'upstream;dur={timings["upstream"] * 1000:.1f}, '
+            f"total;dur={elapsed * 1000:.1f}"
+        )
+
+        profiler = self._stop_profiler()
+        if profiler is not None and elapsed * 1000 >= self.profile_threshold:
+            self._dump_profile(profiler, route, elapsed)
+        return response
+
+    def _dump_profile(self, profiler, route, elapsed):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        slug = route.strip("/").replace("/", "_").replace("<", "").replace(">", "")
+        slug = slug.replace(":", "-") or "root"
+        path = os.path.join(
+            self.profile_dir,
+            f"{time.strftime('%Y%m%dT%H%M%S')}-{request.method}-{slug}"
+            f"-{elapsed * 1000:.0f}ms-{os.getpid()}.prof",
+        )
+        profiler.dump_stats(path)
+        metrics.inc("profiled_requests_total", route=route)
+        logger.warning(
+            "Slow request %s %s took %.0f ms, profile written to %s",
+            request.method,
+            request.path,
+            elapsed * 1000,
+            path,
+        )
+
+
+instrumentation = RequestInstrumentation()
+
+
+def metrics_response():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
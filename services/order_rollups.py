@@ -0,0 +1,93 @@
+import time
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import text
+
+from db import db
+from models.analytics import ROLLUP_DAILY, ROLLUP_STRIPES, ROLLUP_USERS, STRIPE
+from services.sharding import shards
+
+IN_STRIPE = f"{STRIPE} = :stripe"
+
+BACKFILL_CHUNK = [
+    text(statement.format(where=f"id > :after_id AND id <= :upto_id AND {IN_STRIPE}"))
+    for statement in (ROLLUP_DAILY, ROLLUP_USERS)
+]
+
+CLEAR_STRIPE = [
+    text("DELETE FROM order_daily_rollups WHERE stripe = :stripe"),
+    text(f"DELETE FROM user_order_rollups WHERE {IN_STRIPE}"),
+]
+
+CHUNK_END = text(
+    f"SELECT id FROM orders WHERE id > :after_id AND {IN_STRIPE}"
+    " ORDER BY id LIMIT 1 OFFSET :offset"
+)
+LAST_ID = text(f"SELECT MAX(id) FROM orders WHERE id > :after_id AND {IN_STRIPE}")
+
+
+def rebuild_order_rollups(connection, stripe, chunk_size):
+    """
+    Replace the rollups of one stripe (the orders of users with
+    ``user_id % ROLLUP_STRIPES == stripe``) with sums read from ``orders``,
+    aggregating ``chunk_size`` orders per statement. Yields one report per
+    chunk; the caller owns the transaction.
+    """
+    for statement in CLEAR_STRIPE:
+        connection.execute(statement, {"stripe": stripe})
+    after_id = 0
+    while True:
+        started = time.perf_counter()
+        params = {"after_id": after_id, "offset": chunk_size - 1, "stripe": stripe}
+        upto_id = connection.execute(CHUNK_END, params).scalar()
+        if upto_id is None:
+            upto_id = connection.execute(LAST_ID, params).scalar()
+            if upto_id is None:
+                return
+        for statement in BACKFILL_CHUNK:
+            connection.execute(
+                statement,
+                {"after_id": after_id, "upto_id": upto_id, "stripe": stripe, "sign": 1},
+            )
+        yield {
+            "stripe": stripe,
+            "first_id": after_id + 1,
+            "last_id": upto_id,
+            "ms": round((time.perf_counter() - started) * 1000, 1),
+        }
+        after_id = upto_id
+
+
+def backfill_order_rollups(chunk_size):
+    """
+    Rebuild the order rollups of every shard from ``orders``, one stripe per
+    transaction. Yields one report per chunk.
+
+    Each stripe's transaction blocks order writes (SQLite's write lock, a
+    SHARE lock on Postgres) so changes made meanwhile are neither lost nor
+    counted twice; writes wait for one stripe at a time, not for the shard.
+    """
+    for shard in shards.each():
+        for stripe in range(ROLLUP_STRIPES):
+            if db.session.get_bind().dialect.name == "postgresql":
+                db.session.execute(text("LOCK TABLE orders IN SHARE MODE"))
+            for chunk in rebuild_order_rollups(db.session, stripe, chunk_size):
+                yield {"shard": shard, **chunk}
+            db.session.commit()
+
+
+@click.command("backfill-order-rollups")
+@click.option("--chunk-size", default=10000, show_default=True)
+@with_appcontext
+def backfill_order_rollups_command(chunk_size):
+    """Rebuild the order analytics rollups from the orders table."""
+    chunks = 0
+    for chunk in backfill_order_rollups(chunk_size):
+        chunks += 1
+        click.echo(
+            f"{chunk['shard']} stripe {chunk['stripe']}:"
+            f" orders {chunk['first_id']}-{chunk['last_id']}"
+            f" in {chunk['ms']} ms"
+        )
+    click.echo(f"Rebuilt order rollups from {chunks} chunks")
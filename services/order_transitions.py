@@ -0,0 +1,189 @@
+from datetime import datetime
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import bindparam, text
+
+from db import db
+from models.analytics import rollup_orders
+from models.cart import set_carts_status
+from services.cache import cart_cache
+from services.sharding import shards
+
+LOCK_ORDERS = """
+    SELECT id, status FROM orders WHERE id IN :order_ids ORDER BY id{lock}
+"""
+
+FIND_ORDERS = """
+    SELECT id, status FROM orders WHERE id > :after_id {where}
+    ORDER BY id LIMIT :chunk_size{lock}
+"""
+
+
+def _for_update(statement, **params):
+    sqlite = db.session.get_bind().dialect.name == "sqlite"
+    return statement.format(lock="" if sqlite else " FOR UPDATE", **params)
+
+
+def _lock_writes():
+    if db.session.get_bind().dialect.name == "sqlite":
+        # No row locks in SQLite: take the write lock before reading.
+        db.session.execute(text("UPDATE orders SET id = id WHERE 0"))
+
+
+def _apply(rows, changes):
+    """
+    Apply ``changes`` to the locked ``(id, status)`` rows with one UPDATE,
+    following the rules of ``PUT /order/<id>``: a completed order keeps its
+    status, and canceling an order makes its cart inactive.
+    """
+    outcomes = {}
+    eligible = []
+    for order_id, status in rows:
+        if "status" in changes and status == "completed":
+            outcomes[order_id] = "rejected"
+        else:
+            eligible.append(order_id)
+    if not eligible:
+        return outcomes
+
+    assignments = ", ".join(f"{field} = :{field}" for field in changes)
+    update = text(
+        f"""
+        UPDATE orders SET {assignments}, updated_at = :updated_at
+        WHERE id IN :order_ids
+        RETURNING id, cart_id
+        """
+    ).bindparams(bindparam("order_ids", expanding=True))
+
+    connection = db.session.connection()
+    rollup_orders(connection, eligible, -1)
+    updated = connection.execute(
+        update, {**changes, "updated_at": datetime.utcnow(), "order_ids": eligible}
+    ).fetchall()
+    rollup_orders(connection, eligible, 1)
+
+    cart_ids = sorted({cart_id for _, cart_id in updated if cart_id})
+    if changes.get("status") == "canceled" and cart_ids:
+        set_carts_status(connection, cart_ids, "inactive")
+    db.session.commit()
+    cart_cache.invalidate(*cart_ids)
+    outcomes.update((order_id, "updated") for order_id, _ in updated)
+    return outcomes
+
+
+def transition_by_ids(order_ids, changes, chunk_size=500):
+    """
+    Apply ``changes`` to ``order_ids``, ``chunk_size`` orders per
+    transaction. Yields ``{order_id: outcome}`` per chunk, where outcome is
+    "updated", "rejected" or "not_found".
+    """
+    by_shard = {}
+    for order_id in dict.fromkeys(order_ids):
+        owner = shards.owner("order_id", order_id) if shards.enabled else None
+        by_shard.setdefault(owner, []).append(order_id)
+    for owner, ids in by_shard.items():
+        if owner is not None:
+            shards.use(owner)
+        for start in range(0, len(ids), chunk_size):
+            chunk = ids[start : start + chunk_size]
+            _lock_writes()
+            rows = db.session.execute(
+                text(_for_update(LOCK_ORDERS)).bindparams(
+                    bindparam("order_ids", expanding=True)
+                ),
+                {"order_ids": chunk},
+            ).fetchall()
+            outcomes = dict.fromkeys(chunk, "not_found")
+            outcomes.update(_apply(rows, changes))
+            db.session.rollback()
+            yield outcomes
+
+
+def transition_matching(filters, changes, chunk_size=500):
+    """
+    Apply ``changes`` to every order matching ``filters`` (status,
+    payment_status, created_from, created_to), walking the orders of each
+    shard by id, one chunk per transaction. Yields outcomes like
+    ``transition_by_ids``.
+    """
+    conditions = []
+    for field in ("status", "payment_status"):
+        if field in filters:
+            conditions.append(f"AND {field} = :{field}")
+    if "created_from" in filters:
+        conditions.append("AND created_at >= :created_from")
+    if "created_to" in filters:
+        conditions.append("AND created_at < :created_to")
+
+    for _ in shards.each():
+        after_id = 0
+        while True:
+            _lock_writes()
+            rows = db.session.execute(
+                text(_for_update(FIND_ORDERS, where=" ".join(conditions))),
+                {**filters, "after_id": after_id, "chunk_size": chunk_size},
+            ).fetchall()
+            if not rows:
+                db.session.rollback()
+                break
+            after_id = rows[-1][0]
+            outcomes = _apply(rows, changes)
+            db.session.rollback()
+            yield outcomes
+
+
+@click.command("transition-orders")
+@click.option("--id", "order_ids", type=int, multiple=True, help="Repeatable.")
+@click.option("--ids-file", type=click.File(), help="One order id per line.")
+@click.option("--where-status", help="Select the orders with this status.")
+@click.option("--where-payment-status", help="... and this payment status.")
+@click.option("--status", type=click.Choice(["pending", "canceled", "approved"]))
+@click.option("--payment-status")
+@click.option("--chunk-size", default=500, show_default=True)
+@with_appcontext
+def transition_orders_command(
+    order_ids,
+    ids_file,
+    where_status,
+    where_payment_status,
+    status,
+    payment_status,
+    chunk_size,
+):
+    """Set the status and/or payment status of many orders at once."""
+    changes = {
+        field: value
+        for field, value in (("status", status), ("payment_status", payment_status))
+        if value is not None
+    }
+    if not changes:
+        raise click.UsageError("Nothing to change: pass --status or --payment-status")
+    order_ids = list(order_ids)
+    if ids_file:
+        order_ids += [int(line) for line in ids_file if line.strip()]
+    filters = {
+        field: value
+        for field, value in (
+            ("status", where_status),
+            ("payment_status", where_payment_status),
+        )
+        if value is not None
+    }
+    if bool(order_ids) == bool(filters):
+        raise click.UsageError("Pass either order ids or --where-* filters")
+
+    if order_ids:
+        chunks = transition_by_ids(order_ids, changes, chunk_size)
+    else:
+        chunks = transition_matching(filters, changes, chunk_size)
+    totals = dict.fromkeys(["updated", "rejected", "not_found"], 0)
+    for outcomes in chunks:
+        for order_id, outcome in sorted(outcomes.items()):
+            totals[outcome] += 1
+            if outcome != "updated":
+                click.echo(f"order {order_id}: {outcome}")
+    click.echo(
+        f"Updated {totals['updated']} orders, {totals['rejected']} rejected,"
+        f" {totals['not_found']} not found"
+    )
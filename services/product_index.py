@@ -0,0 +1,106 @@
+import re
+from bisect import bisect_left, bisect_right
+
+TOKEN = re.compile(r"[a-z0-9]+")
+
+SORT_KEYS = {
+    "id": lambda p: p["id"],
+    "price": lambda p: p["price"],
+    "title": lambda p: p["title"].lower(),
+    "rating": lambda p: (p.get("rating") or {}).get("rate", 0),
+}
+
+
+def tokenize(text):
+    return TOKEN.findall((text or "").lower())
+
+
+class ProductIndex:
+    """
+    Read-only search structures over one catalog snapshot.
+
+    - an inverted index from title/description tokens to product positions,
+      with a sorted token list so query words also match as prefixes
+    - a bucket of positions per (case-insensitive) category
+    - the prices sorted once, so a price range is two bisects
+    - the rank of every product under each sort key
+
+    Built once per snapshot; lookups only intersect position sets.
+    """
+
+    def __init__(self, products):
+        self.products = products
+        self.tokens = {}
+        self.categories = {}
+        for position, product in enumerate(products):
+            text = f"{product.get('title', '')} {product.get('description', '')}"
+            for token in set(tokenize(text)):
+                self.tokens.setdefault(token, set()).add(position)
+            category = (product.get("category") or "").lower()
+            self.categories.setdefault(category, []).append(position)
+        self.vocabulary = sorted(self.tokens)
+
+        by_price = sorted(range(len(products)), key=lambda i: products[i]["price"])
+        self.price_positions = by_price
+        self.prices = [products[i]["price"] for i in by_price]
+
+        self.ranks = {}
+        for name, key in SORT_KEYS.items():
+            order = sorted(range(len(products)), key=lambda i: key(products[i]))
+            rank = [0] * len(products)
+            for r, position in enumerate(order):
+                rank[position] = r
+            self.ranks[name] = rank
+
+    def match_text(self, query):
+        """Positions whose text contains every query word (as a word prefix)."""
+        matches = None
+        for word in set(tokenize(query)):
+            start = bisect_left(self.vocabulary, word)
+            found = set()
+            for token in self.vocabulary[start:]:
+                if not token.startswith(word):
+                    break
+                found |= self.tokens[token]
+            matches = found if matches is None else matches & found
+            if not matches:
+                return set()
+        return matches if matches is not None else set(range(len(self.products)))
+
+    def match_price(self, min_price=None, max_price=None):
+        lo = 0 if min_price is None else bisect_left(self.prices, min_price)
+        hi = (
+            len(self.prices)
+            if max_price is None
+            else bisect_right(self.prices, max_price)
+        )
+        return set(self.price_positions[lo:hi])
+
+    def search(
+        self,
+        category=None,
+        min_price=None,
+        max_price=None,
+        q=None,
+        sort="id",
+        offset=0,
+        limit=50,
+    ):
+        """Return ``(total, products)`` for one page of matching products."""
+        candidates = None
+        if category is not None:
+            candidates = set(self.categories.get(category.lower(), ()))
+        if min_price is not None or max_price is not None:
+            prices = self.match_price(min_price, max_price)
+            candidates = prices if candidates is None else candidates & prices
+        if q:
+            text = self.match_text(q)
+            candidates = text if candidates is None else candidates & text
+        if candidates is None:
+            candidates = range(len(self.products))
+
+        descending = sort.startswith("-")
+        rank = self.ranks[sort.lstrip("-")]
+        ordered = sorted(candidates, key=rank.__getitem__, reverse=descending)
+        page = ordered[offset : offset + limit]
+        return len(ordered), [self.products[position] for position in page]
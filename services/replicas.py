@@ -0,0 +1,169 @@
+import itertools
+import math
+import threading
+import time
+from functools import wraps
+
+from flask import g, has_request_context, request
+from sqlalchemy import event, text
+
+from db import db
+from models import CartModel
+from services.cache import LocalCache, make_backend
+
+BIND_PREFIX = "replica_"
+SHARD_BIND_PREFIX = "shard_"
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+# View arguments that name the data a read returns, and their write keys.
+READ_KEYS = {"user_id": "user", "cart_id": "cart"}
+# The user and cart a write routed by a cart or order id touches.
+OWNERS = {
+    "cart_id": text("SELECT user_id, id AS cart_id FROM carts WHERE id = :id"),
+    "order_id": text("SELECT user_id, cart_id FROM orders WHERE id = :id"),
+}
+
+
+def replica_binds(urls, options):
+    """``SQLALCHEMY_BINDS`` entries for the replica URLs, ``options(url)`` each."""
+    return {
+        f"{BIND_PREFIX}{i}": {"url": url, **options(url)} for i, url in enumerate(urls)
+    }
+
+
+class ReplicaRouter:
+    """
+    Round-robin choice of a read replica for read-only requests.
+
+    Views decorated with ``read_only`` run their reads on the next replica
+    bind (see ``db.RoutingSession``); everything else uses the primary.
+    With ``DB_READ_YOUR_WRITES`` seconds set, a successful write keeps reads
+    of the written user and cart on the primary for that long, so no client
+    reads older data from a lagging replica. ``services.sharding.sharded``
+    hands each write's route to ``note_write``, which looks up the user and
+    cart behind a cart or order id with one primary-key query; the written
+    keys live in the ``CART_CACHE_URL`` backend that all workers share.
+    Reads that name no user or cart, like ``GET /order``, always use a
+    replica.
+
+    Replicas serve the primary database only. With shards configured every
+    statement goes to the shard's own engine, so the replicas are left
+    unused and ``stats`` reports them as disabled.
+    """
+
+    def __init__(self):
+        self.bind_keys = []
+        self.disabled = None
+        self.read_your_writes = 0
+        self.writes = LocalCache()
+        self._cycle = None
+        self._lock = threading.Lock()
+        self._counters = dict.fromkeys(["replica", "primary"], 0)
+
+    def init_app(self, app):
+        binds = app.config.get("SQLALCHEMY_BINDS") or {}
+        self.bind_keys = sorted(key for key in binds if key.startswith(BIND_PREFIX))
+        self.disabled = None
+        if self.bind_keys and any(key.startswith(SHARD_BIND_PREFIX) for key in binds):
+            app.logger.warning("Read replicas are not used with DATABASE_SHARD_URLS")
+            self.disabled = "sharded"
+            self.bind_keys = []
+        self._cycle = itertools.cycle(self.bind_keys)
+        self.read_your_writes = app.config["DB_READ_YOUR_WRITES"]
+        self.writes = make_backend(
+            app.config["CART_CACHE_URL"], app.config["CART_CACHE_MAX_SIZE"]
+        )
+        if self.tracking_writes and isinstance(self.writes, LocalCache):
+            app.logger.warning(
+                "DB_READ_YOUR_WRITES without CART_CACHE_URL only covers reads"
+                " served by the worker that wrote"
+            )
+        app.after_request(self._remember_write)
+
+    @property
+    def tracking_writes(self):
+        return bool(self.bind_keys and self.read_your_writes)
+
+    def pick(self, key=None):
+        """
+        Bind key of the replica for a read of ``key``'s data (``user:<id>``,
+        ``cart:<id>`` or None for no particular one), or None for the primary.
+        """
+        if not self.bind_keys or self._recently_wrote(key):
+            self._count("primary")
+            return None
+        with self._lock:
+            self._counters["replica"] += 1
+            return next(self._cycle)
+
+    def read_only(self, view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            key = next(
+                (
+                    f"{name}:{kwargs[field]}"
+                    for field, name in READ_KEYS.items()
+                    if field in kwargs
+                ),
+                None,
+            )
+            g._db_read_bind = self.pick(key)
+            return view(*args, **kwargs)
+
+        return wrapper
+
+    def note_write(self, field, value):
+        """
+        Remember the user and cart a write request routed by ``field`` (a
+        user, cart or order id) touches, before the view runs so deleted
+        rows still resolve. Free unless replicas and DB_READ_YOUR_WRITES are
+        both configured.
+        """
+        if not self.tracking_writes or request.method in SAFE_METHODS:
+            return
+        written = g.setdefault("_db_written", set())
+        if field == "user_id":
+            written.add(f"user:{value}")
+            return
+        owner = db.session.execute(OWNERS[field], {"id": value}).first()
+        if owner is not None:
+            written.update((f"user:{owner.user_id}", f"cart:{owner.cart_id}"))
+
+    def _recently_wrote(self, key):
+        if not self.read_your_writes or key is None:
+            return False
+        until = self.writes.get(f"wrote:{key}")
+        return until is not None and float(until) > time.time()
+
+    def _remember_write(self, response):
+        written = g.get("_db_written")
+        if written and response.status_code < 400:
+            until = f"{time.time() + self.read_your_writes:.3f}".encode()
+            for key in written:
+                self.writes.set(
+                    f"wrote:{key}", until, ttl=math.ceil(self.read_your_writes)
+                )
+        return response
+
+    def _count(self, key):
+        with self._lock:
+            self._counters[key] += 1
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+        return {**counters, "replicas": len(self.bind_keys), "disabled": self.disabled}
+
+
+replicas = ReplicaRouter()
+
+
+def read_only(view):
+    """Serve the view's reads from a replica when one is configured."""
+    return replicas.read_only(view)
+
+
+@event.listens_for(CartModel, "after_insert")
+def note_new_cart(mapper, connection, cart):
+    # POST /cart is routed by user; remember the cart it creates as well.
+    if has_request_context() and "_db_written" in g:
+        g._db_written.add(f"cart:{cart.id}")
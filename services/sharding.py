@@ -0,0 +1,426 @@
+import hashlib
+from bisect import bisect
+from functools import wraps
+
+import click
+from flask import g
+from flask.cli import with_appcontext
+from sqlalchemy import bindparam, create_engine, event, text
+
+from db import db
+from migrations import upgrade
+from models import CartModel, OrderModel, UserModel
+from models.analytics import rollup_orders
+from services.cache import LocalCache
+from services.replicas import replicas
+
+# Users hash into a fixed number of buckets and the ring maps buckets to
+# shards, so adding a shard moves whole buckets. Carts and orders created
+# while shards are configured carry their bucket as ``id % BUCKETS``, which
+# routes /cart/<id> and /order/<id>; older ones keep their ids and have
+# their bucket recorded in ``legacy_buckets`` on the primary.
+BUCKETS = 256
+BIND_PREFIX = "shard_"
+PRIMARY_SHARD = f"{BIND_PREFIX}0"
+# Tables whose ids route the ``cart_id`` and ``order_id`` view arguments.
+ID_TABLES = {"cart_id": "carts", "order_id": "orders"}
+LEGACY_CACHE_SIZE = 100000
+
+ALLOCATE_ID = text(
+    """
+    INSERT INTO shard_buckets (bucket, next_id) VALUES (:bucket, 1)
+    ON CONFLICT (bucket) DO UPDATE SET next_id = shard_buckets.next_id + 1
+    RETURNING next_id
+    """
+)
+
+LEGACY_WATERMARKS = text(
+    "SELECT table_name, MAX(id) FROM legacy_buckets GROUP BY table_name"
+)
+LEGACY_BUCKET = text(
+    "SELECT bucket FROM legacy_buckets WHERE table_name = :table_name AND id = :id"
+)
+LEGACY_CARTS = text(
+    "SELECT id FROM legacy_buckets WHERE table_name = 'carts' AND bucket IN :buckets"
+).bindparams(bindparam("buckets", expanding=True))
+
+# Rows to record per table, as (id, user_id) above the table's watermark.
+# Orders take their cart's user, whose bucket the cart is recorded in.
+UNRECORDED_ROWS = {
+    "carts": text("SELECT id, user_id FROM carts WHERE id > :after_id"),
+    "orders": text(
+        "SELECT orders.id, carts.user_id FROM orders"
+        " JOIN carts ON carts.id = orders.cart_id WHERE orders.id > :after_id"
+    ),
+}
+RECORD_LEGACY = text(
+    "INSERT INTO legacy_buckets (table_name, id, bucket)"
+    " VALUES (:table_name, :id, :bucket)"
+)
+MAX_ID = text(
+    "SELECT MAX(id) FROM ("
+    " SELECT MAX(id) AS id FROM carts UNION ALL SELECT MAX(id) FROM orders"
+    ") AS ids"
+)
+RAISE_COUNTER = text(
+    """
+    INSERT INTO shard_buckets (bucket, next_id) VALUES (:bucket, :next_id)
+    ON CONFLICT (bucket) DO UPDATE SET next_id = CASE
+        WHEN excluded.next_id > shard_buckets.next_id THEN excluded.next_id
+        ELSE shard_buckets.next_id END
+    """
+)
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+
+def bucket_for_user(user_id):
+    return _hash(f"user-{user_id}") % BUCKETS
+
+
+def shard_binds(urls, options):
+    """``SQLALCHEMY_BINDS`` entries for the shards after the primary (shard_0)."""
+    return {
+        f"{BIND_PREFIX}{i}": {"url": url, **options(url)}
+        for i, url in enumerate(urls, start=1)
+    }
+
+
+class HashRing:
+    """Consistent-hash ring with ``points`` virtual nodes per shard name."""
+
+    def __init__(self, names, points=128):
+        ring = sorted(
+            (_hash(f"{name}#{i}"), name) for name in names for i in range(points)
+        )
+        self._hashes = [h for h, _ in ring]
+        self._names = [name for _, name in ring]
+
+    def owner(self, bucket):
+        position = bisect(self._hashes, _hash(f"bucket-{bucket}"))
+        return self._names[position % len(self._names)]
+
+
+class ShardRouter:
+    """
+    Routes cart, item and order statements to the shard owning their user.
+
+    ``shard_0`` is the primary database and ``shard_<n>`` the
+    ``DATABASE_SHARD_URLS`` binds. With a single shard nothing is routed.
+    Otherwise views pick their shard with ``sharded`` and background work
+    walks every shard with ``each``, and new carts and orders get ids from
+    their bucket's counter. Ids up to the highest one recorded in
+    ``legacy_buckets`` were created before sharding; their bucket is looked
+    up on the primary once per process and id.
+    """
+
+    def __init__(self):
+        self.names = [PRIMARY_SHARD]
+        self.ring = HashRing(self.names)
+        self._watermarks = None
+        self._legacy = LocalCache(LEGACY_CACHE_SIZE)
+
+    def init_app(self, app):
+        binds = app.config.get("SQLALCHEMY_BINDS") or {}
+        extra = sorted(
+            (key for key in binds if key.startswith(BIND_PREFIX)),
+            key=lambda key: int(key[len(BIND_PREFIX) :]),
+        )
+        self.names = [PRIMARY_SHARD, *extra]
+        self.ring = HashRing(self.names)
+        self._watermarks = None
+        self._legacy.clear()
+
+    @property
+    def enabled(self):
+        return len(self.names) > 1
+
+    def engine(self, name):
+        return db.engines[None if name == PRIMARY_SHARD else name]
+
+    def use(self, name):
+        """Send the session's statements to shard ``name`` for this context."""
+        g._db_shard_engine = self.engine(name)
+
+    def watermark(self, table):
+        """Highest id of ``table`` created before sharding (0: none)."""
+        if self._watermarks is None:
+            with self.engine(PRIMARY_SHARD).connect() as connection:
+                self._watermarks = dict(connection.execute(LEGACY_WATERMARKS).all())
+        return self._watermarks.get(table, 0)
+
+    def bucket(self, field, value):
+        """
+        Bucket of a ``user_id``, or of a cart or order id (its user's
+        bucket); None for an id created before sharding that is unknown.
+        """
+        if field == "user_id":
+            return bucket_for_user(value)
+        table = ID_TABLES[field]
+        if value > self.watermark(table):
+            return value % BUCKETS
+        bucket = self._legacy.get((table, value))
+        if bucket is None:
+            with self.engine(PRIMARY_SHARD).connect() as connection:
+                bucket = connection.execute(
+                    LEGACY_BUCKET, {"table_name": table, "id": value}
+                ).scalar()
+            if bucket is None:
+                return None
+            self._legacy.set((table, value), bucket)
+        return bucket
+
+    def for_user(self, user_id):
+        return self.ring.owner(bucket_for_user(user_id))
+
+    def owner(self, field, value):
+        """Shard holding the rows of ``field``; unknown ids go to the primary."""
+        bucket = self.bucket(field, value)
+        return PRIMARY_SHARD if bucket is None else self.ring.owner(bucket)
+
+    def route(self, field, value):
+        if self.enabled:
+            self.use(self.owner(field, value))
+
+    def each(self):
+        """Yield every shard name with the session routed to it."""
+        if not self.enabled:
+            yield PRIMARY_SHARD
+            return
+        try:
+            for name in self.names:
+                self.use(name)
+                yield name
+        finally:
+            g.pop("_db_shard_engine", None)
+
+    def next_id(self, connection, bucket):
+        next_id = connection.execute(ALLOCATE_ID, {"bucket": bucket}).scalar()
+        return next_id * BUCKETS + bucket
+
+    def stats(self):
+        buckets = dict.fromkeys(self.names, 0)
+        for bucket in range(BUCKETS):
+            buckets[self.ring.owner(bucket)] += 1
+        return {"enabled": self.enabled, "buckets": buckets}
+
+
+shards = ShardRouter()
+
+
+def sharded(field):
+    """
+    Run the view on the shard owning ``field``: ``user_id``, or a cart or
+    order id, taken from the URL or the parsed request body.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if field in kwargs:
+                value = kwargs[field]
+            else:
+                value = next(
+                    arg[field] for arg in args if isinstance(arg, dict) and field in arg
+                )
+            shards.route(field, value)
+            replicas.note_write(field, value)
+            return view(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+# Without shards ids come from the tables' own sequences; only rows created
+# once shards are configured carry their bucket.
+@event.listens_for(CartModel, "before_insert")
+def assign_cart_id(mapper, connection, cart):
+    if cart.id is None and shards.enabled:
+        cart.id = shards.next_id(connection, bucket_for_user(cart.user_id))
+
+
+@event.listens_for(OrderModel, "before_insert")
+def assign_order_id(mapper, connection, order):
+    if order.id is None and shards.enabled:
+        # The order's user owns its cart, so the order lands in the cart's
+        # bucket (also for carts created before sharding) and lives next to it.
+        order.id = shards.next_id(connection, bucket_for_user(order.user_id))
+
+
+def record_legacy_rows(connection):
+    """
+    Record the bucket of every cart and order created before sharding that
+    ``legacy_buckets`` does not list yet, and start every bucket's id
+    counter above the existing ids. Returns the number of rows recorded.
+    """
+    watermarks = dict(connection.execute(LEGACY_WATERMARKS).all())
+    recorded = 0
+    for table, select in UNRECORDED_ROWS.items():
+        rows = connection.execute(select, {"after_id": watermarks.get(table, 0)}).all()
+        if rows:
+            connection.execute(
+                RECORD_LEGACY,
+                [
+                    {"table_name": table, "id": row_id, "bucket": bucket_for_user(uid)}
+                    for row_id, uid in rows
+                ],
+            )
+        recorded += len(rows)
+    max_id = connection.execute(MAX_ID).scalar() or 0
+    connection.execute(
+        RAISE_COUNTER,
+        [{"bucket": bucket, "next_id": max_id // BUCKETS} for bucket in range(BUCKETS)],
+    )
+    return recorded
+
+
+# Rows of a bucket per table, as (table, bucket expression, copied columns).
+# Orders go with their cart. Item and change ids are local to a shard, so
+# the target assigns new ones.
+BUCKET_ROWS = (
+    ("carts", "id", None),
+    ("orders", "cart_id", None),
+    (
+        "cart_items",
+        "cart_id",
+        "cart_id, product_id, product_name, product_price, quantity, subtotal",
+    ),
+    (
+        "cart_changes",
+        "cart_id",
+        "cart_id, version, kind, product_id, product_name, product_price,"
+        " quantity, status, created_at",
+    ),
+    ("shard_buckets", "bucket", None),
+)
+
+
+def _copy_rows(src, dst, table, columns, where, params):
+    # Plain SQL on both sides keeps the stored values as they are (SQLite
+    # timestamps stay in the text format keyset cursors compare against).
+    rows = src.execute(
+        _bucket_query(f"SELECT {columns or '*'} FROM {table} WHERE {where}"), params
+    ).fetchall()
+    if rows:
+        names = list(rows[0]._fields)
+        dst.execute(
+            text(
+                f"INSERT INTO {table} ({', '.join(names)})"
+                f" VALUES ({', '.join(':' + name for name in names)})"
+            ),
+            [dict(row._mapping) for row in rows],
+        )
+    return rows
+
+
+def _in_buckets(key):
+    """WHERE clause for the rows whose cart id (or bucket) ``key`` is in ``:buckets``."""
+    if key == "bucket":
+        return "bucket IN :buckets"
+    return (
+        f"({key} IN :legacy"
+        f" OR ({key} > :watermark AND {key} % {BUCKETS} IN :buckets))"
+    )
+
+
+def _bucket_query(sql):
+    lists = ["buckets", "legacy"] if ":legacy" in sql else ["buckets"]
+    return text(sql).bindparams(*(bindparam(name, expanding=True) for name in lists))
+
+
+def move_buckets(source, target, buckets):
+    """
+    Copy the carts, orders, items, change logs and id counters of ``buckets`` (and the
+    orders' share of the rollups) from the ``source`` to the ``target``
+    engine in one transaction each, then delete them from the source.
+    Carts created before sharding are found through ``legacy_buckets``.
+    Returns the number of rows moved per table.
+    """
+    params = {"buckets": list(buckets)}
+    with shards.engine(PRIMARY_SHARD).connect() as primary:
+        params["legacy"] = [row[0] for row in primary.execute(LEGACY_CARTS, params)]
+        params["watermark"] = dict(primary.execute(LEGACY_WATERMARKS).all()).get(
+            "carts", 0
+        )
+    moved = {}
+    with source.begin() as src, target.begin() as dst:
+        user_ids = {
+            row[0]
+            for row in src.execute(
+                _bucket_query(
+                    f"SELECT DISTINCT user_id FROM carts WHERE {_in_buckets('id')}"
+                ),
+                params,
+            )
+        }
+        if user_ids:
+            users = UserModel.__table__
+            present = dst.execute(users.select().where(users.c.id.in_(user_ids)))
+            missing = user_ids - {row.id for row in present}
+            if missing:
+                dst.execute(users.insert(), [{"id": user_id} for user_id in missing])
+
+        for table, key, columns in BUCKET_ROWS:
+            where = _in_buckets(key)
+            rows = _copy_rows(src, dst, table, columns, where, params)
+            moved[table] = len(rows)
+            if table == "orders":
+                # Order rollups are kept per shard; move the orders' share.
+                order_ids = [row.id for row in rows]
+                rollup_orders(dst, order_ids, 1)
+                rollup_orders(src, order_ids, -1)
+        for table, key, _ in reversed(BUCKET_ROWS):
+            src.execute(
+                _bucket_query(f"DELETE FROM {table} WHERE {_in_buckets(key)}"), params
+            )
+    return moved
+
+
+@click.command("rebalance-shards")
+@click.argument("new_url")
+@click.option("--dry-run", is_flag=True, help="Only list the buckets that would move.")
+@with_appcontext
+def rebalance_shards_command(new_url, dry_run):
+    """
+    Add the database at NEW_URL as the next shard: migrate it and move the
+    buckets the ring now assigns to it, one bucket per transaction.
+
+    The first run, on an unsharded database, records the buckets of the
+    existing carts and orders in ``legacy_buckets`` so they keep their ids.
+    Writes to the moving buckets (on the first run: all writes) must be
+    paused from the start until the app is restarted with NEW_URL appended
+    to DATABASE_SHARD_URLS.
+    """
+    name = f"{BIND_PREFIX}{len(shards.names)}"
+    ring = HashRing([*shards.names, name])
+    moves = {}
+    for bucket in range(BUCKETS):
+        if ring.owner(bucket) == name:
+            moves.setdefault(shards.ring.owner(bucket), []).append(bucket)
+    for source, buckets in moves.items():
+        click.echo(f"{len(buckets)} buckets move from {source} to {name}")
+    if dry_run:
+        return
+
+    if not shards.enabled:
+        with shards.engine(PRIMARY_SHARD).begin() as connection:
+            recorded = record_legacy_rows(connection)
+        click.echo(f"Recorded the buckets of {recorded} carts and orders")
+    target = create_engine(new_url)
+    for applied in upgrade(target):
+        click.echo(f"Applied {applied} on {name}")
+    totals = dict.fromkeys(["carts", "orders", "cart_items"], 0)
+    for source, buckets in moves.items():
+        for bucket in buckets:
+            moved = move_buckets(shards.engine(source), target, [bucket])
+            for key in totals:
+                totals[key] += moved[key]
+    target.dispose()
+    click.echo(
+        f"Moved {totals['carts']} carts, {totals['orders']} orders and"
+        f" {totals['cart_items']} items to {name}."
+        f" Append it to DATABASE_SHARD_URLS and restart the app."
+    )
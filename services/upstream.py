@@ -0,0 +1,247 @@
+import random
+import threading
+import time
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from services.metrics import add_request_time, record_upstream
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(requests.RequestException):
+    """Raised without calling upstream while the circuit breaker is open."""
+
+
+class UpstreamBusyError(requests.RequestException):
+    """Raised when no upstream slot frees up within the pool timeout."""
+
+
+class _RetryableStatus(requests.RequestException):
+    """Internal marker for upstream responses worth retrying."""
+
+
+class CircuitBreaker:
+    """
+    Error-rate circuit breaker over a sliding window of recent calls.
+
+    Once at least ``min_calls`` outcomes are recorded and the failure ratio
+    reaches ``error_rate``, the breaker opens and rejects calls for
+    ``cooldown`` seconds. It then lets a single probe through (half-open):
+    success closes it again, failure reopens it.
+    """
+
+    def __init__(self, error_rate=0.5, min_calls=10, window=20, cooldown=30):
+        self.error_rate = error_rate
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+        self._outcomes = deque(maxlen=window)
+        self._state = "closed"
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self._state == "open":
+                if time.monotonic() - self._opened_at < self.cooldown:
+                    return False
+                self._state = "half_open"
+            if self._state == "half_open":
+                if self._probing:
+                    return False
+                self._probing = True
+            return True
+
+    def record(self, success):
+        with self._lock:
+            if self._state == "half_open":
+                self._probing = False
+                if success:
+                    self._state = "closed"
+                    self._outcomes.clear()
+                else:
+                    self._open()
+                return
+            self._outcomes.append(success)
+            failures = self._outcomes.count(False)
+            if (
+                len(self._outcomes) >= self.min_calls
+                and failures / len(self._outcomes) >= self.error_rate
+            ):
+                self._open()
+
+    def _open(self):
+        self._state = "open"
+        self._opened_at = time.monotonic()
+        self._outcomes.clear()
+
+    def snapshot(self):
+        with self._lock:
+            calls = len(self._outcomes)
+            failures = self._outcomes.count(False)
+            return {
+                "state": self._state,
+                "window_calls": calls,
+                "window_failures": failures,
+                "error_rate": round(failures / calls, 3) if calls else 0.0,
+                "open_for": (
+                    round(time.monotonic() - self._opened_at, 3)
+                    if self._state != "closed"
+                    else None
+                ),
+            }
+
+
+class ProductAPIClient:
+    """
+    Shared HTTP client for the product upstream (Fake Store API).
+
+    Uses a single keep-alive ``requests.Session`` with a bounded connection
+    pool, caps the number of in-flight calls, retries idempotent GETs with
+    jittered exponential backoff and guards everything with a circuit breaker.
+    """
+
+    def __init__(
+        self,
+        base_url="https://fakestoreapi.com",
+        pool_size=10,
+        pool_timeout=2.0,
+        connect_timeout=2.0,
+        read_timeout=5.0,
+        retries=2,
+        backoff=0.1,
+        breaker=None,
+    ):
+        self.base_url = base_url
+        self.pool_timeout = pool_timeout
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker()
+        self._configure_pool(pool_size)
+        self._counters = dict.fromkeys(
+            ["requests", "failures", "retries", "rejected"], 0
+        )
+        self._counter_lock = threading.Lock()
+
+    def init_app(self, app):
+        self.base_url = app.config["PRODUCT_API_URL"]
+        self.pool_timeout = app.config["UPSTREAM_POOL_TIMEOUT"]
+        self.connect_timeout = app.config["UPSTREAM_CONNECT_TIMEOUT"]
+        self.read_timeout = app.config["UPSTREAM_READ_TIMEOUT"]
+        self.retries = app.config["UPSTREAM_RETRIES"]
+        self.backoff = app.config["UPSTREAM_BACKOFF"]
+        self.breaker = CircuitBreaker(
+            error_rate=app.config["BREAKER_ERROR_RATE"],
+            min_calls=app.config["BREAKER_MIN_CALLS"],
+            window=app.config["BREAKER_WINDOW"],
+            cooldown=app.config["BREAKER_COOLDOWN"],
+        )
+        self._configure_pool(app.config["UPSTREAM_POOL_SIZE"])
+
+    def _configure_pool(self, pool_size):
+        self.pool_size = pool_size
+        self._slots = threading.BoundedSemaphore(pool_size)
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_size, pool_block=True
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        self.session = session
+
+    def get_json(self, path):
+        """GET ``path`` and decode the JSON body; None for 404 or an empty body."""
+        response = self.get(path)
+        if response.status_code == 404 or not response.content:
+            return None
+        return response.json()
+
+    def get(self, path):
+        """GET ``path``, retrying transient failures with jittered backoff."""
+        start = time.perf_counter()
+        try:
+            return self._get_with_retries(path)
+        finally:
+            add_request_time("upstream", time.perf_counter() - start)
+
+    def _get_with_retries(self, path):
+        attempt = 0
+        while True:
+            try:
+                return self._send("GET", path)
+            except (CircuitOpenError, UpstreamBusyError):
+                raise
+            except (requests.ConnectionError, requests.Timeout, _RetryableStatus) as e:
+                if attempt >= self.retries:
+                    if isinstance(e, _RetryableStatus):
+                        e.response.raise_for_status()
+                    raise
+            attempt += 1
+            self._count("retries")
+            time.sleep(random.uniform(0, self.backoff * 2**attempt))
+
+    def _send(self, method, path):
+        if not self._slots.acquire(timeout=self.pool_timeout):
+            self._count("rejected")
+            record_upstream("busy", 0.0)
+            raise UpstreamBusyError("No free product API connection")
+        start = time.perf_counter()
+        try:
+            if not self.breaker.allow():
+                self._count("rejected")
+                record_upstream("circuit_open", 0.0)
+                raise CircuitOpenError("Product API circuit breaker is open")
+            self._count("requests")
+            response = self.session.request(
+                method,
+                f"{self.base_url}{path}",
+                timeout=(self.connect_timeout, self.read_timeout),
+            )
+        except CircuitOpenError:
+            raise
+        except requests.RequestException as e:
+            self._record(False)
+            outcome = "timeout" if isinstance(e, requests.Timeout) else "error"
+            record_upstream(outcome, time.perf_counter() - start)
+            raise
+        finally:
+            self._slots.release()
+
+        record_upstream(response.status_code, time.perf_counter() - start)
+
+        if response.status_code in RETRYABLE_STATUSES:
+            self._record(False)
+            raise _RetryableStatus(response=response)
+        self._record(True)
+        if response.status_code != 404:
+            response.raise_for_status()
+        return response
+
+    def _record(self, success):
+        self.breaker.record(success)
+        if not success:
+            self._count("failures")
+
+    def _count(self, key):
+        with self._counter_lock:
+            self._counters[key] += 1
+
+    def snapshot(self):
+        with self._counter_lock:
+            counters = dict(self._counters)
+        return {
+            "base_url": self.base_url,
+            "pool_size": self.pool_size,
+            "connect_timeout": self.connect_timeout,
+            "read_timeout": self.read_timeout,
+            "circuit": self.breaker.snapshot(),
+            **counters,
+        }
+
+
+product_api = ProductAPIClient()
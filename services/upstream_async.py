@@ -0,0 +1,146 @@
+import asyncio
+import json
+import random
+import time
+
+import aiohttp
+import requests
+
+from services.metrics import record_upstream
+from services.upstream import (
+    RETRYABLE_STATUSES,
+    CircuitOpenError,
+    UpstreamBusyError,
+    product_api,
+)
+
+
+class AsyncProductAPIClient:
+    """
+    asyncio client for the product upstream (Fake Store API), used by the
+    ``async_app`` front end.
+
+    One keep-alive ``aiohttp`` session per event loop keeps up to
+    ``max_in_flight`` calls in flight at once, and ``get_many`` fetches
+    several products in parallel. Retries, timeouts and the circuit breaker
+    (shared with the sync ``ProductAPIClient``) behave like the sync
+    client's, and failures raise the same ``requests`` exceptions.
+    """
+
+    def __init__(
+        self,
+        base_url="https://fakestoreapi.com",
+        max_in_flight=100,
+        pool_timeout=2.0,
+        connect_timeout=2.0,
+        read_timeout=5.0,
+        retries=2,
+        backoff=0.1,
+        breaker=None,
+    ):
+        self.base_url = base_url
+        self.max_in_flight = max_in_flight
+        self.pool_timeout = pool_timeout
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = breaker or product_api.breaker
+        self.in_flight = 0
+        self._session = None
+        self._slots = None
+
+    def init_app(self, app):
+        self.base_url = app.config["PRODUCT_API_URL"]
+        self.max_in_flight = app.config["UPSTREAM_ASYNC_MAX_IN_FLIGHT"]
+        self.pool_timeout = app.config["UPSTREAM_POOL_TIMEOUT"]
+        self.connect_timeout = app.config["UPSTREAM_CONNECT_TIMEOUT"]
+        self.read_timeout = app.config["UPSTREAM_READ_TIMEOUT"]
+        self.retries = app.config["UPSTREAM_RETRIES"]
+        self.backoff = app.config["UPSTREAM_BACKOFF"]
+        self.breaker = product_api.breaker
+
+    async def session_context(self, _app):
+        """``aiohttp`` cleanup context owning the session of the serving loop."""
+        self._session = aiohttp.ClientSession(
+            base_url=self.base_url,
+            connector=aiohttp.TCPConnector(limit=self.max_in_flight),
+            timeout=aiohttp.ClientTimeout(
+                sock_connect=self.connect_timeout, sock_read=self.read_timeout
+            ),
+        )
+        self._slots = asyncio.Semaphore(self.max_in_flight)
+        yield
+        await self._session.close()
+        self._session = None
+
+    async def get_many(self, product_ids):
+        """Fetch several products concurrently as ``{product_id: product}``."""
+        product_ids = list(dict.fromkeys(product_ids))
+        products = await asyncio.gather(
+            *(self.get_json(f"/products/{product_id}") for product_id in product_ids)
+        )
+        return {
+            product_id: product or None
+            for product_id, product in zip(product_ids, products)
+        }
+
+    async def get_json(self, path):
+        """GET ``path`` and decode the JSON body; None for 404 or an empty body."""
+        attempt = 0
+        while True:
+            try:
+                status, body = await self._send(path)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= self.retries:
+                    raise
+            else:
+                if status not in RETRYABLE_STATUSES or attempt >= self.retries:
+                    break
+            attempt += 1
+            await asyncio.sleep(random.uniform(0, self.backoff * 2**attempt))
+        if status == 404 or not body:
+            return None
+        if status >= 400:
+            raise requests.HTTPError(f"{status} error from product API for {path}")
+        return json.loads(body)
+
+    async def _send(self, path):
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.pool_timeout)
+        except asyncio.TimeoutError:
+            record_upstream("busy", 0.0)
+            raise UpstreamBusyError("No free product API connection")
+        self.in_flight += 1
+        start = time.perf_counter()
+        try:
+            if not self.breaker.allow():
+                record_upstream("circuit_open", 0.0)
+                raise CircuitOpenError("Product API circuit breaker is open")
+            try:
+                async with self._session.get(path) as response:
+                    status, body = response.status, await response.read()
+            except asyncio.TimeoutError as e:
+                self.breaker.record(False)
+                record_upstream("timeout", time.perf_counter() - start)
+                raise requests.Timeout(str(e) or "Product API request timed out")
+            except aiohttp.ClientError as e:
+                self.breaker.record(False)
+                record_upstream("error", time.perf_counter() - start)
+                raise requests.ConnectionError(str(e))
+        finally:
+            self.in_flight -= 1
+            self._slots.release()
+        record_upstream(status, time.perf_counter() - start)
+        self.breaker.record(status not in RETRYABLE_STATUSES)
+        return status, body
+
+    def snapshot(self):
+        return {
+            "base_url": self.base_url,
+            "max_in_flight": self.max_in_flight,
+            "in_flight": self.in_flight,
+        }
+
+
+product_api_async = AsyncProductAPIClient()